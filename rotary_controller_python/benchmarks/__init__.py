@@ -0,0 +1,205 @@
+"""
+Benchmarks of the communication hot paths, executed against the pty board simulator.
+
+Each benchmark returns a `Result` with the latency distribution of the measured operation, the
+results can be stored as a JSON baseline and later runs compared against it::
+
+    python -m rotary_controller_python.benchmarks --save baseline.json
+    python -m rotary_controller_python.benchmarks --compare baseline.json --threshold 0.2
+"""
+import contextlib
+import json
+import logging
+import os
+import platform
+import statistics
+import time
+
+from rotary_controller_python.utils.communication import DeviceManager
+from rotary_controller_python.utils.simulator import Simulator
+
+log = logging.getLogger(__name__)
+
+SLAVE_ADDRESS = 17
+DEFAULT_THRESHOLD = 0.2
+TRANSPORTS = ("minimalmodbus", "rtu")
+
+SERVO_SETTINGS = dict(min_speed=1, max_speed=1000, acceleration=1000, ratio_num=400, ratio_den=360)
+SCALE_SETTINGS = dict(ratio_num=5, ratio_den=1, sync_ratio_num=360, sync_ratio_den=100)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Result:
+    def __init__(self, name, latencies, elapsed):
+        self.name = name
+        self.count = len(latencies)
+        self.p50 = percentile(latencies, 0.5)
+        self.p99 = percentile(latencies, 0.99)
+        self.mean = statistics.fmean(latencies)
+        self.tps = self.count / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return dict(count=self.count, p50=self.p50, p99=self.p99, mean=self.mean, tps=self.tps)
+
+    def __str__(self):
+        return (
+            f"{self.name:<32} n={self.count:<6d} p50={self.p50 * 1000:8.3f}ms "
+            f"p99={self.p99 * 1000:8.3f}ms tps={self.tps:10.1f}"
+        )
+
+
+def measure(name, operation, duration=1.0, max_count=None) -> Result:
+    """Call `operation` repeatedly for `duration` seconds and collect the latency of each call"""
+    latencies = []
+    started = time.perf_counter()
+    while True:
+        before = time.perf_counter()
+        operation()
+        after = time.perf_counter()
+        latencies.append(after - before)
+        if after - started >= duration or (max_count is not None and len(latencies) >= max_count):
+            break
+    return Result(name, latencies, time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def make_device(port, **kwargs):
+    """A DeviceManager connected to the simulator, its port is closed when the block exits"""
+    dm = DeviceManager(serial_device=port, address=SLAVE_ADDRESS, **kwargs)
+    try:
+        if not dm.connected:
+            raise ConnectionError(f"Unable to open {port}")
+        yield dm
+    finally:
+        dm.close()
+
+
+def upload_settings(dm: DeviceManager):
+    """The same register writes the app issues when it resyncs the settings at every reconnect"""
+    with dm.transaction():
+        for key, value in SERVO_SETTINGS.items():
+            setattr(dm.servo, key, value)
+        for scale in dm.scales:
+            for key, value in SCALE_SETTINGS.items():
+                setattr(scale, key, value)
+
+
+def bench_fast_data_refresh(port, duration, **kwargs):
+    with make_device(port, **kwargs) as dm:
+        return measure("fast_data_refresh", dm.fast_data.refresh, duration)
+
+
+def bench_single_reads(port, duration, **kwargs):
+    with make_device(port, shadow_max_age=None, **kwargs) as dm:
+
+        def read_servo():
+            for key in SERVO_SETTINGS:
+                getattr(dm.servo, key)
+
+        return measure("servo_single_reads", read_servo, duration)
+
+
+def bench_block_reads(port, duration, **kwargs):
+    # Only the explicit refresh goes to the bus, the getters are served from the image
+    with make_device(port, shadow_max_age=60, **kwargs) as dm:
+
+        def read_servo():
+            dm.shadow.refresh()
+            for key in SERVO_SETTINGS:
+                getattr(dm.servo, key)
+
+        return measure("servo_block_reads", read_servo, duration)
+
+
+def bench_upload(port, duration, **kwargs):
+    with make_device(port, **kwargs) as dm:
+        return measure("upload", lambda: upload_settings(dm), duration)
+
+
+def bench_reconnect(port, duration, **kwargs):
+    def reconnect():
+        with make_device(port, **kwargs) as dm:
+            upload_settings(dm)
+            dm.fast_data.refresh()
+
+    return measure("reconnect", reconnect, duration)
+
+
+def bench_decode(port, duration, **kwargs):
+    with make_device(port, **kwargs) as dm:
+        raw_data = dm.device.read_registers(
+            registeraddress=dm.fast_data.addresses.base_address,
+            number_of_registers=int(dm.fast_data.bytes_count),
+        )
+        return measure("fast_data_decode", lambda: dm.fast_data.decode(raw_data), duration)
+
+
+BENCHMARKS = [
+    bench_fast_data_refresh,
+    bench_single_reads,
+    bench_block_reads,
+    bench_upload,
+    bench_reconnect,
+    bench_decode,
+]
+
+
+def run_benchmarks(duration=1.0, baudrate=None, transports=TRANSPORTS, **kwargs) -> dict:
+    """
+    Run every benchmark with each transport against a fresh simulator,
+    returns a dictionary of results named `transport/benchmark`
+    """
+    results = dict()
+    with Simulator(address=SLAVE_ADDRESS, baudrate=baudrate) as simulator:
+        for transport in transports:
+            for benchmark in BENCHMARKS:
+                result = benchmark(simulator.port, duration, transport=transport, **kwargs)
+                result.name = f"{transport}/{result.name}"
+                log.info(str(result))
+                results[result.name] = result
+    return results
+
+
+def save_baseline(path, results: dict, **metadata):
+    data = dict(
+        created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        metadata=metadata,
+        results={name: result.to_dict() for name, result in results.items()},
+    )
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def load_baseline(path) -> dict or None:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)["results"]
+
+
+def compare(results: dict, baseline: dict, threshold=DEFAULT_THRESHOLD) -> list:
+    """
+    Compare results against a baseline, returns a list of human readable regressions.
+    Latencies may grow and throughput may drop at most by `threshold` (a fraction).
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for key in ("p50", "p99"):
+            limit = reference[key] * (1 + threshold)
+            value = getattr(result, key)
+            if value > limit:
+                regressions.append(f"{name}.{key}: {value * 1000:.3f}ms > {limit * 1000:.3f}ms")
+        limit = reference["tps"] * (1 - threshold)
+        if result.tps < limit:
+            regressions.append(f"{name}.tps: {result.tps:.1f} < {limit:.1f}")
+    return regressions
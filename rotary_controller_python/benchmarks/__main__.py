@@ -0,0 +1,52 @@
+import argparse
+import logging
+import sys
+
+from rotary_controller_python.benchmarks import (
+    DEFAULT_THRESHOLD,
+    TRANSPORTS,
+    compare,
+    load_baseline,
+    run_benchmarks,
+    save_baseline,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Communication benchmarks against the board simulator")
+    parser.add_argument("--duration", type=float, default=1.0, help="Seconds spent on each benchmark")
+    parser.add_argument("--baudrate", type=int, default=None, help="Emulate the wire time of this baudrate")
+    parser.add_argument(
+        "--transport", action="append", choices=TRANSPORTS, help="Transport to measure, repeat for several"
+    )
+    parser.add_argument("--save", metavar="FILE", help="Store the results as a new baseline")
+    parser.add_argument("--compare", metavar="FILE", help="Fail when the results regress against this baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed regression fraction")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    transports = args.transport if args.transport else TRANSPORTS
+    results = run_benchmarks(duration=args.duration, baudrate=args.baudrate, transports=transports)
+    for result in results.values():
+        print(result)
+
+    if args.save:
+        save_baseline(args.save, results, baudrate=args.baudrate, duration=args.duration)
+        print(f"Baseline saved to {args.save}")
+
+    if args.compare:
+        baseline = load_baseline(args.compare)
+        if baseline is None:
+            print(f"Baseline {args.compare} not found")
+            return 2
+        regressions = compare(results, baseline, args.threshold)
+        for item in regressions:
+            print(f"REGRESSION {item}")
+        if len(regressions) > 0:
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
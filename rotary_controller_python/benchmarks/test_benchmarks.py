@@ -0,0 +1,81 @@
+"""
+Pytest entry point of the communication benchmarks.
+
+Set RCP_BENCH_BASELINE to a baseline file created with `python -m rotary_controller_python.benchmarks --save`
+to fail on regressions, RCP_BENCH_DURATION and RCP_BENCH_THRESHOLD tune the run.
+"""
+import gc
+import os
+import sys
+
+import pytest
+
+from rotary_controller_python import benchmarks
+from rotary_controller_python.utils.simulator import Simulator
+
+DURATION = float(os.environ.get("RCP_BENCH_DURATION", "0.5"))
+THRESHOLD = float(os.environ.get("RCP_BENCH_THRESHOLD", str(benchmarks.DEFAULT_THRESHOLD)))
+BASELINE = os.environ.get("RCP_BENCH_BASELINE")
+
+
+@pytest.fixture(scope="module")
+def simulator():
+    with Simulator(address=benchmarks.SLAVE_ADDRESS) as sim:
+        yield sim
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    if BASELINE is None:
+        return None
+    data = benchmarks.load_baseline(BASELINE)
+    if data is None:
+        pytest.fail(f"Baseline {BASELINE} not found")
+    return data
+
+
+@pytest.mark.parametrize("transport", benchmarks.TRANSPORTS)
+@pytest.mark.parametrize("benchmark", benchmarks.BENCHMARKS, ids=lambda item: item.__name__)
+def test_benchmark(benchmark, transport, simulator, baseline):
+    result = benchmark(simulator.port, DURATION, transport=transport)
+    result.name = f"{transport}/{result.name}"
+    print(result)
+    assert result.count > 0
+
+    if baseline is not None:
+        regressions = benchmarks.compare({result.name: result}, baseline, THRESHOLD)
+        assert regressions == []
+
+
+@pytest.mark.parametrize("transport", benchmarks.TRANSPORTS)
+def test_fast_data_decode_memory(transport, simulator):
+    """Decoding reuses the register buffer and keeps nothing but the latest sample alive"""
+    with benchmarks.make_device(simulator.port, transport=transport) as dm:
+        fast_data = dm.fast_data
+        buffer = fast_data.buffer
+        fast_data.refresh()
+        raw = fast_data.view if transport == "rtu" else dm.device.read_registers(
+            fast_data.addresses.base_address, fast_data.bytes_count
+        )
+        for _ in range(100):
+            fast_data.decode(raw)
+
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        for _ in range(1000):
+            fast_data.decode(raw)
+        gc.collect()
+        assert sys.getallocatedblocks() - blocks < 50
+        assert fast_data.buffer is buffer
+
+        # The same measurement, as reported at runtime
+        assert abs(fast_data.allocations_per_sample) < 0.05
+        assert abs(dm.metrics.summary()["allocations_per_sample"]) < 0.05
+        assert fast_data.buffer_reuses == fast_data.samples_count
+
+        # A decode keeping its samples alive shows up in the counter
+        retained = fast_data.retained_blocks
+        samples = []
+        for _ in range(100):
+            samples.append(fast_data.decode(raw))
+        assert fast_data.retained_blocks - retained >= 100
@@ -1,9 +1,10 @@
 import os.path
 from kivy.logger import Logger
-from kivy.config import ConfigParser
 from kivy.lang import Builder
 from kivy.uix.settings import SettingsWithSidebar
 
+from rotary_controller_python.config import config
+
 log = Logger.getChild("app-settings")
 
 INPUTS_COUNT = 4
@@ -13,12 +14,6 @@ INPUTS_COUNT = 4
 #     log.info(f"Loading KV file: {kv_file}")
 #     Builder.load_file(kv_file)
 
-config_path = os.path.abspath(
-    os.path.join(os.path.dirname(__file__), "..", "..", "config.ini")
-)
-config = ConfigParser()
-config.read(config_path)
-
 
 class AppSettings(SettingsWithSidebar):
     def __init__(self, **kwargs):
@@ -1,11 +1,7 @@
 import os
-import time
-import collections
 
-from decimal import Decimal
 from kivy.logger import Logger
 from kivy.factory import Factory
-from kivy.clock import Clock
 from kivy.lang import Builder
 from kivy.properties import NumericProperty, StringProperty, ObjectProperty, ListProperty, BooleanProperty
 from kivy.uix.boxlayout import BoxLayout
@@ -37,23 +33,15 @@ class CoordBar(BoxLayout, SavingDispatcher):
     _skip_save = ["position", "formatted_axis_speed"]
 
     def __init__(self, input_index, **kv):
-        super().__init__(**kv)
-        self.input_index = input_index
+        # The index is the key of the saved settings, it must be set before they are read
+        super().__init__(input_index=input_index, **kv)
 
-        self.speed_history = collections.deque(maxlen=5)
-        self.previous_axis_time: float = 0
-        self.previous_axis_pos: Decimal = Decimal(0)
-        self.upload()
-        Clock.schedule_interval(self.update_speed, 1.0 / 10)
-
-    def upload(self):
+    def device_settings(self) -> dict:
+        """The settings that are also registers of the scale, as plain values"""
         props = self.get_our_properties()
         prop_names = [item.name for item in props]
         device_props = self.get_writeable_properties(type(self.device.scales[self.input_index]))
-        matches = [item for item in prop_names if item in device_props]
-        for item in matches:
-            log.info(f"Writing scale settings for scale {self.input_index}: {item}={self.__getattribute__(item)}")
-            self.device.scales[self.input_index].__setattr__(item, self.__getattribute__(item))
+        return {item: self.__getattribute__(item) for item in prop_names if item in device_props}
 
     def toggle_sync(self):
         running_app = App.get_running_app()
@@ -62,16 +50,27 @@ class CoordBar(BoxLayout, SavingDispatcher):
         running_app.manual_full_update()
 
     def on_sync_ratio_num(self, instance, value):
-        self.device.scales[instance.input_index].sync_ratio_num = int(value)
+        self.write_sync_ratio()
 
     def on_sync_ratio_den(self, instance, value):
-        self.device.scales[instance.input_index].sync_ratio_den = int(value)
+        self.write_sync_ratio()
 
     def on_ratio_num(self, instance, value):
-        self.device.scales[instance.input_index].ratio_num = int(value)
+        self.write_ratio()
 
     def on_ratio_den(self, instance, value):
-        self.device.scales[instance.input_index].ratio_den = int(value)
+        self.write_ratio()
+
+    def write_ratio(self):
+        # Numerator and denominator are sent in a single request, the firmware never sees a mixed ratio
+        with self.device.transaction():
+            self.device.scales[self.input_index].ratio_num = int(self.ratio_num)
+            self.device.scales[self.input_index].ratio_den = int(self.ratio_den)
+
+    def write_sync_ratio(self):
+        with self.device.transaction():
+            self.device.scales[self.input_index].sync_ratio_num = int(self.sync_ratio_num)
+            self.device.scales[self.input_index].sync_ratio_den = int(self.sync_ratio_den)
 
     def update_position(self):
         if not self.sync_enable:
@@ -85,27 +84,15 @@ class CoordBar(BoxLayout, SavingDispatcher):
     def new_position(self, value):
         self.device.scales[self.input_index].position = int(float(value) * 1000)
 
-    def update_speed(self, *args, **kv):
-        current_time = time.time()
-
-        # Calculate axis speed
-        self.speed_history.append(
-            (Decimal(self.position) - self.previous_axis_pos) /
-            Decimal(current_time - self.previous_axis_time)
-        )
-
-        average = (sum(self.speed_history) / Decimal(len(self.speed_history)))
-
+    def set_speed(self, speed):
+        """Show the speed estimated by the app, given in mm/s"""
         app = App.get_running_app()
         if app is None:
             return
 
         if app.formats.current_format == "IN":
             # Speed in feet per minute
-            self.formatted_axis_speed = float(average * 60 / Decimal("25.4") / 12)
+            self.formatted_axis_speed = float(speed * 60 / 25.4 / 12)
         else:
             # Speed in mt/minute
-            self.formatted_axis_speed = float(average * 60 / 1000)
-
-        self.previous_axis_time = current_time
-        self.previous_axis_pos = Decimal(self.position)
+            self.formatted_axis_speed = float(speed * 60 / 1000)
@@ -0,0 +1,50 @@
+import os
+
+from kivy.app import App
+from kivy.clock import Clock
+from kivy.logger import Logger
+from kivy.lang import Builder
+from kivy.properties import StringProperty
+from kivy.uix.popup import Popup
+
+log = Logger.getChild(__name__)
+
+kv_file = os.path.join(os.path.dirname(__file__), __file__.replace(".py", ".kv"))
+if os.path.exists(kv_file):
+    log.info(f"Loading KV file: {kv_file}")
+    Builder.load_file(kv_file)
+
+
+class FramesOverlay(Popup):
+    """Frame timings of the Clock callbacks, refreshed every second while open"""
+
+    report = StringProperty("")
+    task_refresh = None
+
+    def on_open(self):
+        self.refresh()
+        self.task_refresh = Clock.schedule_interval(self.refresh, 1.0)
+
+    def on_dismiss(self):
+        if self.task_refresh is not None:
+            self.task_refresh.cancel()
+            self.task_refresh = None
+
+    def refresh(self, *args):
+        app = App.get_running_app()
+        if not app.frames.enabled:
+            self.report = "Frame profiling is disabled, set frame_profiling = 1\nin the [diagnostics] section of config.ini"
+            return
+        lines = [app.frames.report()]
+        if app.device is not None:
+            bus = app.device.metrics.summary()
+            lines.append(
+                f"\nBus: {bus['tps']:.0f}/s  usage {bus['utilisation'] * 100:.0f}%  "
+                f"read p99 {bus['read_p99'] * 1000:.1f}ms  failures {bus['failures']}  "
+                f"allocations/sample {bus['allocations_per_sample']:.2f}"
+            )
+        self.report = "\n".join(lines)
+
+    def reset(self):
+        App.get_running_app().frames.reset()
+        self.refresh()
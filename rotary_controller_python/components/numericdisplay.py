@@ -0,0 +1,158 @@
+import collections
+import os
+
+from kivy.core.text import Label as CoreLabel
+from kivy.graphics import Color, Rectangle
+from kivy.logger import Logger
+from kivy.lang import Builder
+from kivy.properties import StringProperty, NumericProperty, ColorProperty, OptionProperty
+from kivy.uix.behaviors import ButtonBehavior
+from kivy.uix.widget import Widget
+
+log = Logger.getChild(__name__)
+kv_file = os.path.join(os.path.dirname(__file__), __file__.replace(".py", ".kv"))
+if os.path.exists(kv_file):
+    log.info(f"Loading KV file: {kv_file}")
+    Builder.load_file(kv_file)
+
+# Characters produced by the position and speed formats, others are added on first use
+DEFAULT_CHARSET = "0123456789+-.: "
+
+
+class GlyphAtlas:
+    """
+    The glyphs of one font at one size, rasterised together in a single white texture. Each glyph
+    is a region of that texture, the displays tint them with their own color.
+    """
+
+    # The font size follows the widget height, so every resize asks for a new size, the least
+    # recently used atlases are dropped, displays still using one keep their own reference
+    _atlases = collections.OrderedDict()
+    max_atlases = 8
+    rasterisations = 0
+
+    def __init__(self, font_name, font_size, charset=DEFAULT_CHARSET):
+        self.font_name = font_name
+        self.font_size = font_size
+        self.charset = ""
+        self.texture = None
+        self.height = 0
+        self.glyphs = dict()
+        self.render(charset)
+
+    @classmethod
+    def get(cls, font_name, font_size) -> "GlyphAtlas":
+        key = (font_name, int(round(font_size)))
+        atlas = cls._atlases.get(key)
+        if atlas is None:
+            atlas = GlyphAtlas(font_name, key[1])
+            cls._atlases[key] = atlas
+            while len(cls._atlases) > cls.max_atlases:
+                cls._atlases.popitem(last=False)
+        else:
+            cls._atlases.move_to_end(key)
+        return atlas
+
+    def render(self, charset):
+        label = CoreLabel(text=charset, font_name=self.font_name, font_size=self.font_size)
+        label.refresh()
+        GlyphAtlas.rasterisations += 1
+
+        texture = label.texture
+        x = 0
+        for char in charset:
+            width, _ = label.get_extents(char)
+            self.glyphs[char] = texture.get_region(x, 0, width, texture.height)
+            x += width
+        self.charset = charset
+        self.texture = texture
+        self.height = texture.height
+
+    def glyph(self, char):
+        region = self.glyphs.get(char)
+        if region is None:
+            # Regions handed out before keep pointing to the previous texture, which stays valid
+            self.render(self.charset + char)
+            region = self.glyphs[char]
+        return region
+
+
+class NumericDisplay(Widget):
+    """
+    A single line readout composed from the glyphs of a GlyphAtlas. Each character is a textured
+    quad, so changing a digit only updates the texture coordinates of its quad instead of
+    rasterising and uploading the whole string again.
+    """
+
+    text = StringProperty("")
+    font_name = StringProperty("fonts/iosevka-regular.ttf")
+    font_size = NumericProperty(32)
+    color = ColorProperty([1, 1, 1, 1])
+    background_color = ColorProperty([0, 0, 0, 0])
+    halign = OptionProperty("right", options=["left", "center", "right"])
+    valign = OptionProperty("middle", options=["top", "middle", "bottom"])
+
+    def __init__(self, **kv):
+        self.atlas = None
+        self.quads = []
+        self.shown = []
+        super().__init__(**kv)
+        with self.canvas:
+            self.color_instruction = Color(rgba=self.color)
+        self.fbind("color", self.update_color)
+        self.fbind("font_name", self.reset_atlas)
+        self.fbind("font_size", self.reset_atlas)
+        for name in ("text", "pos", "size", "halign", "valign"):
+            self.fbind(name, self.update_quads)
+        self.update_quads()
+
+    def update_color(self, *args):
+        self.color_instruction.rgba = self.color
+
+    def reset_atlas(self, *args):
+        self.atlas = None
+        self.update_quads()
+
+    def update_quads(self, *args):
+        if self.font_size <= 0:
+            return
+        if self.atlas is None:
+            self.atlas = GlyphAtlas.get(self.font_name, self.font_size)
+            self.shown = []
+
+        glyphs = [self.atlas.glyph(char) for char in self.text]
+        while len(self.quads) < len(glyphs):
+            quad = Rectangle()
+            self.canvas.add(quad)
+            self.quads.append(quad)
+        while len(self.quads) > len(glyphs):
+            self.canvas.remove(self.quads.pop())
+
+        width = sum(glyph.width for glyph in glyphs)
+        if self.halign == "left":
+            x = self.x
+        elif self.halign == "center":
+            x = self.x + (self.width - width) / 2
+        else:
+            x = self.right - width
+        if self.valign == "top":
+            y = self.top - self.atlas.height
+        elif self.valign == "bottom":
+            y = self.y
+        else:
+            y = self.y + (self.height - self.atlas.height) / 2
+
+        shown = []
+        for i, (quad, glyph) in enumerate(zip(self.quads, glyphs)):
+            placement = (glyph, x, y)
+            if i >= len(self.shown) or self.shown[i] != placement:
+                quad.texture = glyph
+                quad.pos = (x, y)
+                quad.size = glyph.size
+            shown.append(placement)
+            x += glyph.width
+        self.shown = shown
+
+
+class NumericButton(ButtonBehavior, NumericDisplay):
+    pass
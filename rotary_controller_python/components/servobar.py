@@ -32,23 +32,25 @@ class ServoBar(BoxLayout, SavingDispatcher):
     current_position = NumericProperty(0.0)
     desired_position = NumericProperty(0.0)
 
+    # Updated by every poll, these do not belong in the settings file
+    _skip_save = ["current_position", "desired_position"]
+
     def __init__(self, device: DeviceManager, **kv):
         self.device = device
         super().__init__(**kv)
-        self.upload()
 
-    def upload(self):
+    def device_settings(self) -> dict:
+        """The settings that are also registers of the servo, as plain values"""
         props = self.get_our_properties()
         prop_names = [item.name for item in props]
         device_props = self.get_writeable_properties(type(self.device.servo))
-        matches = [item for item in prop_names if item in device_props]
-        for item in matches:
-            self.device.servo.__setattr__(item, self.__getattribute__(item))
+        return {item: self.__getattribute__(item) for item in prop_names if item in device_props}
 
     def on_index(self, instance, value):
         if self.divisions != 0 and self.device is not None:
-            self.device.index.index = self.index
-            self.device.index.divisions = self.divisions
+            with self.device.transaction():
+                self.device.index.index = self.index
+                self.device.index.divisions = self.divisions
         else:
             log.error("Divisions must be != 0")
         return True
@@ -69,10 +71,15 @@ class ServoBar(BoxLayout, SavingDispatcher):
         self.device.servo.acceleration = self.acceleration
 
     def on_ratio_num(self, instance, value):
-        self.device.servo.ratio_num = self.ratio_num
+        self.write_ratio()
 
     def on_ratio_den(self, instance, value):
-        self.device.servo.ratio_den = self.ratio_den
+        self.write_ratio()
+
+    def write_ratio(self):
+        with self.device.transaction():
+            self.device.servo.ratio_num = self.ratio_num
+            self.device.servo.ratio_den = self.ratio_den
 
     def on_enable(self, instance, vlaue):
         # todo: implement this in the c side
@@ -1,14 +1,17 @@
 import os
+import threading
 
 import kivy
 from kivy.logger import Logger, FileHandler
 from kivy.app import App
-from kivy.properties import StringProperty, NumericProperty, ObjectProperty
+from kivy.clock import Clock
+from kivy.properties import StringProperty, NumericProperty, ObjectProperty, OptionProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.tabbedpanel import TabbedPanel, TabbedPanelItem
 from kivy.uix.popup import Popup
 from kivy.lang import Builder
 
+from rotary_controller_python.utils import logtail
 
 log = Logger.getChild(__name__)
 kv_file = os.path.join(os.path.dirname(__file__), __file__.replace(".py", ".kv"))
@@ -16,10 +19,41 @@ if os.path.exists(kv_file):
     log.info(f"Loading KV file: {kv_file}")
     Builder.load_file(kv_file)
 
+LEVEL_COLORS = {
+    "TRACE": (0.6, 0.6, 0.6, 1),
+    "DEBUG": (0.6, 0.6, 0.6, 1),
+    "INFO": (1, 1, 1, 1),
+    "WARNING": (1, 0.8, 0.2, 1),
+    "ERROR": (1, 0.3, 0.3, 1),
+    "CRITICAL": (1, 0.3, 0.3, 1),
+}
 
 class LogsPanel(BoxLayout):
+    """
+    The end of the application log in a RecycleView. Only the last `page_size` lines are read when
+    the panel opens, older pages are read backwards on request and lines appended to the file are
+    added as they come. Reading the file and filtering by level and text run in a background thread.
+    """
+
+    page_size = 1000
+    max_lines = 20000
+    level = OptionProperty("DEBUG", options=logtail.LEVELS)
+    filter_text = StringProperty("")
+    status = StringProperty("")
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        # (level, line) of every line read, oldest first
+        self.entries = []
+        self.path = None
+        self.start_offset = 0
+        self.tail = None
+        self.task_follow = None
+        self.following = False
+        # Results of a filter started before the latest change are discarded
+        self.generation = 0
+        # Same for the reads started before the file was last opened or the panel was closed
+        self.session = 0
         self.refresh_logs()
 
     @staticmethod
@@ -29,13 +63,168 @@ class LogsPanel(BoxLayout):
                 return h.filename
         return None
 
+    @staticmethod
+    def run_in_background(job, done, failed=None):
+        """Run `job` in a worker thread and pass its result to `done` on the UI thread"""
+        def run():
+            try:
+                result = job()
+            except Exception as e:
+                log.error(e.__str__())
+                if failed is not None:
+                    Clock.schedule_once(lambda dt: failed())
+                return
+            Clock.schedule_once(lambda dt: done(result))
+
+        threading.Thread(target=run, name="log-viewer", daemon=True).start()
+
+    @staticmethod
+    def with_levels(lines, previous=None) -> list:
+        entries = []
+        for line in lines:
+            previous = logtail.level_of(line, previous)
+            entries.append((previous, line))
+        return entries
+
+    @staticmethod
+    def matches(entries, level, text) -> list:
+        minimum = logtail.LEVELS.index(level)
+        text = text.lower()
+        return [
+            {"text": line, "color": LEVEL_COLORS.get(level, LEVEL_COLORS["INFO"])}
+            for level, line in entries
+            if (level is None or logtail.LEVELS.index(level) >= minimum) and text in line.lower()
+        ]
+
     def refresh_logs(self):
-        log_filename = self.get_log_file_path()
-        if log_filename is not None:
-            with open(self.get_log_file_path(), "r") as logfile:
-                self.ids['log_text_area'].text = logfile.read()
-        else:
-            self.ids['log_text_area'].text = "Enable file logging in your Kivy config!"
+        self.stop()
+        self.path = self.get_log_file_path()
+        if self.path is None or not os.path.exists(self.path):
+            self.entries = []
+            self.ids['log_view'].data = []
+            self.status = "Enable file logging in your Kivy config!"
+            return
+
+        path = self.path
+        size = os.path.getsize(path)
+        session = self.session
+
+        def done(result):
+            if session != self.session:
+                return
+            lines, start = result
+            self.entries = self.with_levels(lines)
+            self.start_offset = start
+            self.tail = logtail.LogTail(path, offset=size)
+            self.task_follow = Clock.schedule_interval(self.follow, 1.0)
+            self.apply_filter()
+
+        self.status = "Loading..."
+        self.run_in_background(lambda: logtail.read_lines_before(path, size, self.page_size), done)
+
+    def load_older(self):
+        if self.path is None or self.start_offset == 0:
+            return
+        path = self.path
+        end = self.start_offset
+        session = self.session
+
+        def done(result):
+            lines, start = result
+            if session != self.session or end != self.start_offset:
+                return
+            self.entries = self.with_levels(lines) + self.entries
+            self.start_offset = start
+            self.apply_filter()
+
+        self.run_in_background(lambda: logtail.read_lines_before(path, end, self.page_size), done)
+
+    def follow(self, *args):
+        if self.following or self.tail is None:
+            return
+        self.following = True
+        tail = self.tail
+        session = self.session
+        generation = self.generation
+        previous = self.entries[-1][0] if len(self.entries) > 0 else None
+        level = self.level
+        text = self.filter_text
+
+        def job():
+            restarts = tail.restarts
+            lines = tail.read_new()
+            entries = self.with_levels(lines, previous)
+            return tail.restarts != restarts, entries, self.matches(entries, level, text)
+
+        def done(result):
+            self.following = False
+            if session != self.session:
+                return
+            rotated, entries, data = result
+            if rotated:
+                # The offsets of the lines shown belong to the old file, read the new one from its end
+                self.refresh_logs()
+                return
+            if len(entries) == 0:
+                return
+            self.entries.extend(entries)
+            if len(self.entries) > self.max_lines:
+                dropped = self.entries[:len(self.entries) - self.max_lines]
+                del self.entries[:len(dropped)]
+                self.start_offset += sum(len(line.encode("utf-8")) + 1 for _, line in dropped)
+            if generation != self.generation:
+                # A filter started meanwhile did not see these lines
+                self.apply_filter()
+                return
+
+            view = self.ids['log_view']
+            at_bottom = view.scroll_y <= 0
+            view.data.extend(data)
+            if len(view.data) > self.max_lines:
+                del view.data[:len(view.data) - self.max_lines]
+            if at_bottom:
+                view.scroll_y = 0
+            self.update_status(len(view.data))
+
+        self.run_in_background(job, done, failed=lambda: setattr(self, "following", False))
+
+    def apply_filter(self, *args):
+        self.generation += 1
+        generation = self.generation
+        entries = list(self.entries)
+        level = self.level
+        text = self.filter_text
+
+        def done(data):
+            if generation != self.generation:
+                return
+            view = self.ids['log_view']
+            view.data = data
+            view.scroll_y = 0
+            self.update_status(len(data))
+
+        self.run_in_background(lambda: self.matches(entries, level, text), done)
+
+    def on_level(self, instance, value):
+        self.apply_filter()
+
+    def on_filter_text(self, instance, value):
+        self.apply_filter()
+
+    def next_level(self):
+        levels = logtail.LEVELS
+        self.level = levels[(levels.index(self.level) + 1) % len(levels)]
+
+    def update_status(self, shown):
+        beginning = ", start of file" if self.start_offset == 0 else ""
+        self.status = f"{shown} of {len(self.entries)} lines{beginning}"
+
+    def stop(self):
+        self.session += 1
+        self.tail = None
+        if self.task_follow is not None:
+            self.task_follow.cancel()
+            self.task_follow = None
 
 
 class ServoPanel(BoxLayout):
@@ -122,8 +311,11 @@ class Setup(Popup):
 
         # Add Tab to allow reviewing the application logs
         log_pane = TabbedPanelItem(text=f"Logs")
-        log_pane.add_widget(LogsPanel())
+        self.logs_panel = LogsPanel()
+        log_pane.add_widget(self.logs_panel)
         self.tabbed_panel.add_widget(log_pane)
 
         self.tabbed_panel.default_tab = panes[0]
 
+    def on_dismiss(self):
+        self.logs_panel.stop()
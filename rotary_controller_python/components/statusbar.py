@@ -19,3 +19,14 @@ class StatusBar(BoxLayout):
     fps = NumericProperty(0)
     speed = NumericProperty(0)
     max_speed = NumericProperty(0)
+    # Summary of the communication metrics
+    tps = NumericProperty(0)
+    bus_usage = NumericProperty(0)
+    read_latency = NumericProperty(0)
+    failures = NumericProperty(0)
+
+    def set_metrics(self, summary: dict):
+        self.tps = summary["tps"]
+        self.bus_usage = summary["utilisation"] * 100
+        self.read_latency = summary["read_p99"] * 1000
+        self.failures = summary["failures"]
@@ -0,0 +1,141 @@
+import os
+
+import numpy as np
+from kivy.app import App
+from kivy.graphics import Color, Line
+from kivy.logger import Logger
+from kivy.lang import Builder
+from kivy.properties import ListProperty, NumericProperty, ObjectProperty, OptionProperty, StringProperty
+from kivy.uix.popup import Popup
+from kivy.uix.widget import Widget
+
+from rotary_controller_python.utils import decimate
+from rotary_controller_python.utils.history import TIMESTAMP, SERVO_CURRENT, SERVO_DESIRED, scale_column
+
+log = Logger.getChild(__name__)
+
+kv_file = os.path.join(os.path.dirname(__file__), __file__.replace(".py", ".kv"))
+if os.path.exists(kv_file):
+    log.info(f"Loading KV file: {kv_file}")
+    Builder.load_file(kv_file)
+
+WINDOWS = [5, 10, 30, 60, 120]
+
+
+def value_range(*series) -> tuple:
+    """Range of the values of all the series, widened when they are flat"""
+    low = min(float(np.min(values)) for values in series)
+    high = max(float(np.max(values)) for values in series)
+    if high - low < 1e-9:
+        return low - 0.5, high + 0.5
+    return low, high
+
+
+class TracePlot(Widget):
+    """
+    The servo desired and current positions, and optionally one scale, over the last `seconds` of
+    the sample history. Each trace is a single Line instruction whose points are replaced on every
+    refresh, decimated to about one bucket per horizontal pixel so the cost does not depend on the
+    length of the window. The servo traces share their vertical range, the scale has its own.
+    """
+
+    history = ObjectProperty(None)
+    seconds = NumericProperty(10)
+    method = OptionProperty("minmax", options=["minmax", "lttb"])
+    # Input index of the scale traced next to the servo, -1 for none
+    scale_index = NumericProperty(-1)
+    servo_range = ListProperty([0.0, 0.0])
+    scale_range = ListProperty([0.0, 0.0])
+    desired_color = ListProperty([0.2, 0.6, 1.0, 1.0])
+    current_color = ListProperty([1.0, 0.8, 0.2, 1.0])
+    scale_color = ListProperty([0.4, 1.0, 0.4, 1.0])
+
+    def __init__(self, **kv):
+        super().__init__(**kv)
+        with self.canvas:
+            self.desired_color_instruction = Color(rgba=self.desired_color)
+            self.desired_line = Line(width=1)
+            self.current_color_instruction = Color(rgba=self.current_color)
+            self.current_line = Line(width=1)
+            self.scale_color_instruction = Color(rgba=self.scale_color)
+            self.scale_line = Line(width=1)
+
+    def decimated(self, x, y, start, end):
+        count = max(2, int(self.width))
+        if self.method == "lttb":
+            return decimate.lttb(x, y, count)
+        return decimate.minmax(x, y, count, start, end)
+
+    def points(self, x, y, start, end, low, high) -> list:
+        selected = self.decimated(x, y, start, end)
+        points = np.empty(2 * len(selected))
+        points[0::2] = self.x + (x[selected] - start) * (self.width / (end - start))
+        points[1::2] = self.y + (y[selected] - low) * (self.height / (high - low))
+        return points.tolist()
+
+    def clear(self):
+        self.desired_line.points = []
+        self.current_line.points = []
+        self.scale_line.points = []
+
+    def refresh(self, *args):
+        rows = self.history.window(self.seconds) if self.history is not None else None
+        if rows is None or len(rows) < 2 or self.width < 2:
+            self.clear()
+            return
+
+        x = rows[:, TIMESTAMP]
+        # The right edge is the latest sample, the traces scroll left as new samples arrive
+        end = x[-1]
+        start = end - self.seconds
+        desired = rows[:, SERVO_DESIRED]
+        current = rows[:, SERVO_CURRENT]
+        low, high = value_range(desired, current)
+        self.servo_range = [low, high]
+        self.desired_line.points = self.points(x, desired, start, end, low, high)
+        self.current_line.points = self.points(x, current, start, end, low, high)
+
+        if self.scale_index < 0:
+            self.scale_line.points = []
+            return
+        scale = rows[:, scale_column(int(self.scale_index))]
+        low, high = value_range(scale)
+        self.scale_range = [low, high]
+        self.scale_line.points = self.points(x, scale, start, end, low, high)
+
+
+class TracePopup(Popup):
+    """Plot screen, refreshed while it is open"""
+
+    scale_name = StringProperty("None")
+    task_refresh = None
+
+    def on_open(self):
+        app = App.get_running_app()
+        if app.engine is not None:
+            self.ids.plot.history = app.engine.history
+        self.task_refresh = app.frames.schedule_interval(self.ids.plot.refresh, 1.0 / 15, name="trace_plot")
+
+    def on_dismiss(self):
+        if self.task_refresh is not None:
+            self.task_refresh.cancel()
+            self.task_refresh = None
+
+    def next_window(self):
+        plot = self.ids.plot
+        larger = [seconds for seconds in WINDOWS if seconds > plot.seconds]
+        plot.seconds = larger[0] if len(larger) > 0 else WINDOWS[0]
+
+    def next_scale(self):
+        app = App.get_running_app()
+        plot = self.ids.plot
+        count = len(app.home.coord_bars) if app.home is not None else 0
+        plot.scale_index = plot.scale_index + 1 if plot.scale_index + 1 < count else -1
+        if plot.scale_index < 0:
+            self.scale_name = "None"
+        else:
+            self.scale_name = app.home.coord_bars[int(plot.scale_index)].axis_name
+
+    def toggle_method(self):
+        plot = self.ids.plot
+        plot.method = "lttb" if plot.method == "minmax" else "minmax"
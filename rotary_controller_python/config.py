@@ -0,0 +1,10 @@
+import os.path
+
+from kivy.config import ConfigParser
+
+# Kept apart from the settings panel, so reading the configuration does not import the settings widgets
+config_path = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "config.ini")
+)
+config = ConfigParser()
+config.read(config_path)
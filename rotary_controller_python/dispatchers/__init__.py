@@ -1,11 +1,9 @@
-import os
-import shutil
-
-import yaml
 from kivy.logger import Logger
 from kivy.event import EventDispatcher
 from kivy.properties import StringProperty, NumericProperty, BooleanProperty
 
+from rotary_controller_python.dispatchers import persistence
+
 log = Logger.getChild(__name__)
 
 
@@ -39,15 +37,18 @@ class SavingDispatcher(EventDispatcher):
         ]
 
     @property
-    def filename(self):
-        os.makedirs("settings/", exist_ok=True)
-        return f"settings/{self.__class__.__name__}-{self.uid}.yaml"
+    def settings_key(self):
+        """Stable name of the settings of this object, instances of the same class add their input index"""
+        input_index = getattr(self, "input_index", None)
+        if input_index is None:
+            return self.__class__.__name__
+        return f"{self.__class__.__name__}-{int(input_index)}"
 
     def read_settings(self):
         props = self.get_our_properties()
         prop_names = [item.name for item in props]
 
-        config_data = read_settings(self.filename)
+        config_data = persistence.store.get(self.settings_key)
         if config_data is None:
             self.save_settings()
             return
@@ -66,37 +67,11 @@ class SavingDispatcher(EventDispatcher):
         self.bind(**kwargs)
 
     def save_settings(self, *args, **kv):
+        """Snapshot the properties and leave the file write to the persistence worker"""
         props = self.get_our_properties()
         prop_names = [item.name for item in props]
         data = dict()
         for item in prop_names:
             data[item] = self.__getattribute__(item)
 
-        write_settings(self.filename, data)
-
-
-def read_settings(file: str):
-    if not os.path.exists(file):
-        return None
-
-    try:
-        with open(file, "r") as f:
-            data = yaml.safe_load(f.read())
-            return data
-    except Exception as e:
-        log.error(e.__str__())
-        return None
-
-
-def write_settings(file: str, data):
-    if os.path.exists(file):
-        shutil.move(file, f"{file}.old")
-
-    try:
-        with open(file, "w") as f:
-            yaml.dump(data, f)
-        return True
-
-    except Exception as e:
-        log.error(e.__str__())
-        return False
+        persistence.store.update(self.settings_key, data)
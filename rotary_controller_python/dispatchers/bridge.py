@@ -0,0 +1,66 @@
+import re
+
+from kivy.logger import Logger
+
+from rotary_controller_python.dispatchers.formats import FormatsDispatcher
+
+log = Logger.getChild(__name__)
+
+DECIMALS = re.compile(r"\.(\d+)f")
+
+
+def decimals_of(fmt: str) -> int:
+    """Number of decimals shown by a format string such as {:+0.3f}"""
+    match = DECIMALS.search(fmt)
+    return int(match.group(1)) if match is not None else 0
+
+
+class DisplayBridge:
+    """
+    Moves the values of the device samples into widget properties, dispatching only the changes
+    that are visible at the resolution of the active formats. A position jittering below the last
+    displayed digit does not trigger any kv expression or relayout.
+    """
+
+    def __init__(self, formats: FormatsDispatcher):
+        self.formats = formats
+        # (widget, property name) -> value last dispatched, quantised to the display resolution
+        self.shown = dict()
+        self.position_step = 1.0
+        self.angle_step = 1.0
+        self.dispatched = 0
+        self.suppressed = 0
+        for name in ("position_format", "angle_format", "factor"):
+            formats.fbind(name, self.reset)
+        self.reset()
+
+    def reset(self, *args):
+        """Recompute the resolutions, the next value of every property is dispatched"""
+        self.position_step = self.formats.factor * 10 ** -decimals_of(self.formats.position_format)
+        self.angle_step = 10 ** -decimals_of(self.formats.angle_format)
+        self.shown.clear()
+
+    def set(self, widget, name, value, step) -> bool:
+        key = (widget, name)
+        quantised = round(value / step)
+        if self.shown.get(key) == quantised:
+            self.suppressed += 1
+            return False
+        self.shown[key] = quantised
+        setattr(widget, name, value)
+        self.dispatched += 1
+        return True
+
+    def set_position(self, widget, name, value) -> bool:
+        return self.set(widget, name, value, self.position_step)
+
+    def set_angle(self, widget, name, value) -> bool:
+        return self.set(widget, name, value, self.angle_step)
+
+    def statistics(self) -> dict:
+        total = self.dispatched + self.suppressed
+        return dict(
+            dispatched=self.dispatched,
+            suppressed=self.suppressed,
+            suppressed_ratio=self.suppressed / total if total > 0 else 0.0,
+        )
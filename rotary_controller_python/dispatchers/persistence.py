@@ -0,0 +1,183 @@
+import glob
+import os
+import re
+import threading
+import time
+
+import yaml
+from kivy.logger import Logger
+
+log = Logger.getChild(__name__)
+
+# The libyaml bindings parse and emit several times faster, fall back when they are not built
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+SETTINGS_FILE = "settings/settings.yaml"
+# Files written by the previous versions, one per widget instance: {ClassName}-{uid}.yaml
+LEGACY_PATTERN = re.compile(r"^(?P<name>[A-Za-z_]\w*)-(?P<uid>\d+)\.yaml$")
+
+
+def load_yaml(file: str):
+    if not os.path.exists(file):
+        return None
+
+    try:
+        with open(file, "r") as f:
+            return yaml.load(f, Loader=Loader)
+    except Exception as e:
+        log.error(e.__str__())
+        return None
+
+
+def write_atomic(file: str, data) -> bool:
+    """
+    Write the yaml file through a temporary file renamed over the old one, after an fsync,
+    so that a power loss leaves either the old or the new settings on the SD card.
+    """
+    directory = os.path.dirname(file)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{file}.tmp"
+    try:
+        with open(temporary, "w") as f:
+            yaml.dump(data, f, Dumper=Dumper)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, file)
+        if directory != "" and hasattr(os, "O_DIRECTORY"):
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return True
+    except Exception as e:
+        log.error(e.__str__())
+        return False
+
+
+class PersistenceWorker:
+    """
+    Writes settings files from a background thread.
+
+    Each file is written `debounce` seconds after its last change, changes arriving in the meantime
+    replace the pending data, so a burst of property updates ends up in a single write. A file
+    changing continuously is still written at least every `max_delay` seconds.
+    """
+
+    def __init__(self, debounce=1.0, max_delay=5.0):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        # file name -> (first change, last change, data)
+        self.pending = dict()
+        self.writes_count = 0
+        self.changes_count = 0
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    def _deadline(self, first_change, last_change):
+        return min(last_change + self.debounce, first_change + self.max_delay)
+
+    def schedule(self, file: str, data: dict):
+        """Queue the data to be written to the file, `data` must not be modified afterwards"""
+        now = time.monotonic()
+        with self._condition:
+            first_change = self.pending[file][0] if file in self.pending else now
+            self.pending[file] = (first_change, now, data)
+            self.changes_count += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="settings-writer", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _write_due(self, force=False) -> int:
+        # Taking and writing under one lock keeps the writes of a file in the order of its changes
+        with self._write_lock:
+            with self._condition:
+                now = time.monotonic()
+                due = [
+                    file for file, (first, last, _) in self.pending.items()
+                    if force or self._deadline(first, last) <= now
+                ]
+                items = [(file, self.pending.pop(file)[2]) for file in due]
+            for file, data in items:
+                if write_atomic(file, data):
+                    self.writes_count += 1
+        return len(items)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadlines = [self._deadline(first, last) for first, last, _ in self.pending.values()]
+                timeout = min(deadlines) - time.monotonic() if len(deadlines) > 0 else None
+                if timeout is None or timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+            self._write_due()
+
+    def flush(self):
+        """Write every pending change right away, from the calling thread"""
+        count = self._write_due(force=True)
+        if count > 0:
+            log.info(f"Flushed {count} settings files")
+
+
+class SettingsStore:
+    """
+    All the saved settings in a single file, one section per object keyed by a stable name such
+    as the class name and the input index, read once at startup. Updates are written back through
+    the persistence worker, so the changes of all the objects share the same debounced writes.
+    """
+
+    def __init__(self, file=SETTINGS_FILE, worker: PersistenceWorker = None):
+        self.file = file
+        self.worker = worker if worker is not None else writer
+        self.sections = None
+
+    def load(self) -> dict:
+        if self.sections is None:
+            data = load_yaml(self.file)
+            if data is None:
+                data = self.migrate()
+            self.sections = data
+        return self.sections
+
+    def migrate(self) -> dict:
+        """
+        Collect the files of the previous versions, the uid in their name depended on the creation
+        order of the widgets so the key is rebuilt from their content, newest file first.
+        """
+        directory = os.path.dirname(self.file)
+        files = [
+            path for path in glob.glob(os.path.join(directory, "*.yaml"))
+            if LEGACY_PATTERN.match(os.path.basename(path))
+        ]
+        sections = dict()
+        for path in sorted(files, key=os.path.getmtime, reverse=True):
+            data = load_yaml(path)
+            if not isinstance(data, dict):
+                continue
+            key = LEGACY_PATTERN.match(os.path.basename(path)).group("name")
+            if "input_index" in data:
+                key = f"{key}-{int(data['input_index'])}"
+            if key not in sections:
+                sections[key] = data
+                log.info(f"Migrated {path} to the {key} settings")
+
+        if len(sections) > 0:
+            write_atomic(self.file, sections)
+        return sections
+
+    def get(self, key) -> dict or None:
+        return self.load().get(key)
+
+    def update(self, key, data: dict):
+        sections = self.load()
+        sections[key] = data
+        self.worker.schedule(self.file, dict(sections))
+
+
+writer = PersistenceWorker()
+store = SettingsStore()
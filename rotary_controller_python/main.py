@@ -1,5 +1,8 @@
 import logging
 import os
+import time
+
+from rotary_controller_python.utils.profiler import profiler
 
 from kivy.uix.popup import Popup
 from kivy.logger import Logger, KivyFormatter
@@ -15,17 +18,22 @@ from kivy.properties import (
     ObjectProperty,
 )
 from kivy.uix.boxlayout import BoxLayout
-from rotary_controller_python.components.appsettings import AppSettings
 from rotary_controller_python.components.coordbar import CoordBar
 from rotary_controller_python.components.servobar import ServoBar
 from rotary_controller_python.components.statusbar import StatusBar
+from rotary_controller_python.dispatchers import persistence
+from rotary_controller_python.dispatchers.bridge import DisplayBridge
 from rotary_controller_python.dispatchers.formats import FormatsDispatcher
-from rotary_controller_python.utils import communication
-
-from rotary_controller_python.components.appsettings import config
-from rotary_controller_python.network.models import Wireless, NetworkInterface
+from rotary_controller_python.utils import communication, connection
+from rotary_controller_python.utils.engine import CommsEngine
+from rotary_controller_python.utils.frames import FrameProfiler
+from rotary_controller_python.utils.recorder import SessionRecorder
+from rotary_controller_python.utils.scheduler import PollGroup, NORMAL, SLOW, ON_DEMAND
+from rotary_controller_python.utils.speed import SpeedEstimator
+from rotary_controller_python.config import config
 
 log = Logger.getChild(__name__)
+profiler.mark("imports")
 
 for h in log.root.handlers:
     h.formatter = KivyFormatter('%(asctime)s - %(filename)s:%(lineno)s-%(funcName)s - %(levelname)s - %(message)s')
@@ -56,15 +64,8 @@ class Home(BoxLayout):
 
 
 class MainApp(App):
-    network_settings = ObjectProperty(
-        defaultvalue=NetworkInterface(
-            name="wlan0",
-            dhcp=False,
-            address="10.0.0.1/24",
-            gateway="10.0.0.254",
-            wireless=Wireless(ssid="test", password="test"),
-        )
-    )
+    # A network.models.NetworkInterface, imported with the network screens only when needed
+    network_settings = ObjectProperty(None)
     display_color = ConfigParserProperty(
         defaultvalue="#ffffffff",
         section="formatting",
@@ -74,6 +75,7 @@ class MainApp(App):
 
     blink = BooleanProperty(False)
     connected = BooleanProperty(False)
+    connection_state = StringProperty(connection.DISCONNECTED)
     formats = FormatsDispatcher()
     abs_inc = ConfigParserProperty(
         defaultvalue="ABS", section="global", key="abs_inc", config=config, val_type=str
@@ -89,23 +91,105 @@ class MainApp(App):
     serial_address = ConfigParserProperty(
         defaultvalue=7, section="device", key="address", config=config, val_type=int
     )
+    shadow_max_age = ConfigParserProperty(
+        defaultvalue=0.25, section="device", key="shadow_max_age", config=config, val_type=float
+    )
+    serial_transport = ConfigParserProperty(
+        defaultvalue=communication.DEFAULT_TRANSPORT, section="device", key="transport", config=config, val_type=str
+    )
+    metrics_file = ConfigParserProperty(
+        defaultvalue="metrics.json", section="device", key="metrics_file", config=config, val_type=str
+    )
+    record_sessions = ConfigParserProperty(
+        defaultvalue=0, section="diagnostics", key="record_sessions", config=config, val_type=int
+    )
+    recordings_dir = ConfigParserProperty(
+        defaultvalue="recordings", section="diagnostics", key="recordings_dir", config=config, val_type=str
+    )
+    # A session recording played back instead of connecting to the board, when set
+    replay_file = ConfigParserProperty(
+        defaultvalue="", section="diagnostics", key="replay_file", config=config, val_type=str
+    )
+    replay_speed = ConfigParserProperty(
+        defaultvalue=1.0, section="diagnostics", key="replay_speed", config=config, val_type=float
+    )
+    telemetry_enabled = ConfigParserProperty(
+        defaultvalue=0, section="telemetry", key="enabled", config=config, val_type=int
+    )
+    telemetry_host = ConfigParserProperty(
+        defaultvalue="0.0.0.0", section="telemetry", key="host", config=config, val_type=str
+    )
+    telemetry_port = ConfigParserProperty(
+        defaultvalue=8765, section="telemetry", key="port", config=config, val_type=int
+    )
+    frame_profiling = ConfigParserProperty(
+        defaultvalue=0, section="diagnostics", key="frame_profiling", config=config, val_type=int
+    )
+    frames_file = ConfigParserProperty(
+        defaultvalue="frames.json", section="diagnostics", key="frames_file", config=config, val_type=str
+    )
     device = ObjectProperty()
+    engine = ObjectProperty()
     home = ObjectProperty()
     task_update = None
-    task_update_slow = None
+    speed_estimator = None
+    # (register struct, values) pairs written by upload, taken on the UI thread
+    settings_snapshot = ()
+    bridge = None
+    frames = None
+    telemetry = None
     task_counter = 0
+    last_sample = None
 
     def __init__(self, **kv):
+        self.frames = FrameProfiler(
+            bus_time=lambda: self.device.blocking_time if self.device is not None else 0.0
+        )
         try:
-            self.device = communication.DeviceManager(
-                serial_device=self.serial_port,
-                baudrate=self.serial_baudrate,
-                address=self.serial_address
-            )
+            if self.replay_file != "":
+                from rotary_controller_python.utils.replay import ReplayDeviceManager
+
+                self.device = ReplayDeviceManager(
+                    self.replay_file,
+                    speed=self.replay_speed,
+                    address=self.serial_address,
+                    shadow_max_age=self.shadow_max_age,
+                    connect=False,
+                )
+            else:
+                self.device = communication.DeviceManager(
+                    serial_device=self.serial_port,
+                    baudrate=self.serial_baudrate,
+                    address=self.serial_address,
+                    shadow_max_age=self.shadow_max_age,
+                    transport=self.serial_transport,
+                    # The engine opens the port from its own thread, after the window is built
+                    connect=False,
+                    recorder=self.start_recorder() if self.record_sessions else None,
+                )
+            self.engine = CommsEngine(self.device)
+            self.engine.on_state_change = self.on_engine_result(self.set_connection_state)
+            self.engine.on_resync = self.upload
+            self.speed_estimator = SpeedEstimator(self.engine.history)
         except Exception as e:
-            log.error(f"Communication cannot be started, will try again: {e.__str__()}")
+            log.error(f"Communication cannot be started, the app runs without a board: {e.__str__()}")
+            self.engine = None
+            if self.device is None:
+                # Never connected, the writes of the bars are dropped
+                self.device = communication.DeviceManager(connect=False)
 
         super().__init__(**kv)
+        self.bridge = DisplayBridge(self.formats)
+        profiler.mark("app_init")
+
+    def start_recorder(self) -> SessionRecorder or None:
+        try:
+            os.makedirs(self.recordings_dir, exist_ok=True)
+            path = os.path.join(self.recordings_dir, time.strftime("session-%Y%m%d-%H%M%S.rcr"))
+            return SessionRecorder(path)
+        except Exception as e:
+            log.error(f"Unable to record the session: {e.__str__()}")
+            return None
 
     @staticmethod
     def load_help(help_file_name):
@@ -123,64 +207,221 @@ class MainApp(App):
         with open(help_file_path, "r") as f:
             return f.read()
 
-    def on_network_settings(self):
-        print(self.network_settings.dict())
+    def on_network_settings(self, instance, value):
+        if value is not None:
+            log.info(value.dict())
 
     def open_custom_settings(self):
+        from rotary_controller_python.components.appsettings import AppSettings
+
         settings = AppSettings()
         popup = Popup(title="Custom Settings", content=settings, size_hint=(0.9, 0.9))
         popup.open()
 
-    def update_slow(self, *args):
-        if self.device.connected:
-            self.home.status_bar.speed = self.device.servo.estimated_speed * self.home.servo.ratio_den / self.home.servo.ratio_num
-            # self.home.servo.offset = self.device.servo.absolute_offset
+    @staticmethod
+    def open_setup():
+        # The setup screens and their KV rules are only loaded the first time they are opened
+        from rotary_controller_python.components.setup import Setup
+
+        Setup().open()
+
+    @staticmethod
+    def open_trace_plot():
+        from rotary_controller_python.components.traceplot import TracePopup
+
+        TracePopup().open()
+
+    @staticmethod
+    def open_wifi():
+        from rotary_controller_python.network.ui.wifi import Wifi
+
+        Wifi().open()
+
+    def on_engine_result(self, callback):
+        """Wrap a callback so that results coming from the comms engine are applied on the UI thread"""
+        return lambda result: self.frames.schedule_once(lambda dt: callback(result), name=callback.__name__)
+
+    def register_poll_groups(self):
+        """The register groups refreshed by the comms engine, next to the realtime fast data"""
+        servo = self.device.servo
+        scheduler = self.engine.scheduler
+        scheduler.add(PollGroup(
+            "servo_speed",
+            NORMAL,
+            read=lambda: servo.read_fields("estimated_speed", "max_speed"),
+            callback=self.on_engine_result(self.set_servo_speed),
+            slave=self.device.name,
+        ))
+        scheduler.add(PollGroup(
+            "execution",
+            SLOW,
+            read=lambda: self.device.base.read_fields("execution_interval", "execution_cycles"),
+            callback=self.on_engine_result(self.set_execution),
+            slave=self.device.name,
+        ))
+        scheduler.add(PollGroup(
+            "full_update",
+            ON_DEMAND,
+            read=lambda: dict(
+                **servo.read_fields("estimated_speed", "max_speed", "absolute_offset"),
+                **self.device.base.read_fields("execution_interval", "execution_cycles"),
+            ),
+            callback=self.on_engine_result(self.apply_full_update),
+            slave=self.device.name,
+        ))
+
+    def set_speed(self, estimated_speed):
+        self.home.status_bar.speed = estimated_speed * self.home.servo.ratio_den / self.home.servo.ratio_num
+
+    def set_servo_speed(self, values):
+        self.set_speed(values['estimated_speed'])
+        self.home.status_bar.max_speed = values['max_speed']
+
+    def set_execution(self, values):
+        self.home.status_bar.interval = values['execution_interval']
+        self.home.status_bar.cycles = values['execution_cycles']
+
+    def apply_full_update(self, values):
+        self.set_servo_speed(values)
+        self.set_execution(values)
+        self.home.servo.offset = values['absolute_offset']
 
     def manual_full_update(self):
-        self.home.status_bar.speed = self.device.servo.estimated_speed * self.home.servo.ratio_den / self.home.servo.ratio_num
-        self.home.status_bar.max_speed = self.device.servo.max_speed
-        self.home.status_bar.cycles = self.device.fast_data.cycles
-        self.home.status_bar.interval = self.device.base.execution_interval
-        self.home.servo.offset = self.device.servo.absolute_offset
+        if self.engine is not None:
+            self.engine.scheduler.request("full_update", slave=self.device.name)
+
+    def set_connection_state(self, state):
+        self.connection_state = state
+
+    def on_connection_state(self, instance, value):
+        log.info(f"Connection state: {value}")
+        self.connected = value == connection.LIVE
 
     def update(self, *args):
-        try:
-            self.device.fast_data.refresh()
-            if not self.device.connected:
-                # self.task_update.timeout = 1.0 / 30
-                self.device.connected = True
-                self.upload()
+        if self.engine is None:
+            return
+        sample = self.engine.latest
+        if not self.connected or sample is None or sample is self.last_sample:
+            return
 
-        except Exception as e:
-            log.error(f"No connection: {e.__str__()}")
-            self.task_update.timeout = 2.0
-            self.device.connected = False
+        self.last_sample = sample
+        if profiler.mark("first_live_position"):
+            log.info(profiler.report())
+        for bar in self.home.coord_bars:
+            self.bridge.set_position(bar, "position", sample.scale_current[bar.input_index])
+        self.bridge.set_angle(self.home.servo, "current_position", sample.servo_current)
+        self.bridge.set_angle(self.home.servo, "desired_position", sample.servo_desired)
+
+    def update_speeds(self, *args):
+        """One estimate for all the axes, computed from the shared sample history"""
+        if self.speed_estimator is None:
+            return
+        speeds = self.speed_estimator.update() if self.connected else None
+        for bar in self.home.coord_bars:
+            bar.set_speed(speeds[bar.input_index] if speeds is not None else 0.0)
 
-        if self.device.connected:
-            self.task_update.timeout = 1.0 / 30
-            for bar in self.home.coord_bars:
-                bar.position = self.device.fast_data.scale_current[bar.input_index]
-            self.home.servo.current_position = self.device.fast_data.servo_current
-            self.home.servo.desired_position = self.device.fast_data.servo_desired
+    def snapshot_settings(self, *args):
+        """Copy the settings of the bars into plain values, the resync runs on the comms thread"""
+        snapshot = [(self.device.servo, self.home.servo.device_settings())]
+        for bar in self.home.coord_bars:
+            snapshot.append((self.device.scales[bar.input_index], bar.device_settings()))
+        self.settings_snapshot = tuple(snapshot)
 
-        self.connected = self.device.connected
+    def bind_settings_snapshot(self):
+        for bar in [self.home.servo] + list(self.home.coord_bars):
+            bar.bind(**{name: self.snapshot_settings for name in bar.device_settings()})
+        self.snapshot_settings()
 
-    def upload(self):
-        self.home.servo.upload()
-        for scale in self.home.coord_bars:
-            scale.upload()
+    def upload(self) -> bool:
+        """Write the configuration of every bar to the board, called by the engine on reconnection"""
+        snapshot = self.settings_snapshot
+        if len(snapshot) == 0:
+            return True
+        log.info(f"Writing the settings of {len(snapshot)} devices")
+        with self.device.transaction() as tx:
+            for target, values in snapshot:
+                for name, value in values.items():
+                    setattr(target, name, value)
+        return tx.ok is not False
 
     def blinker(self, *args):
         self.home.status_bar.fps = Clock.get_fps()
+        if self.device is not None:
+            self.home.status_bar.set_metrics(self.device.metrics.summary())
         self.blink = not self.blink
 
     def build(self):
+        if self.frame_profiling:
+            # Before scheduling anything, only the callbacks scheduled afterwards are measured
+            self.frames.enable()
         self.home = Home(device=self.device)
-        self.task_update = Clock.schedule_interval(self.update, 1.0 / 30)
-        self.task_update_slow = Clock.schedule_interval(self.update_slow, 1.0 / 10)
-        Clock.schedule_interval(self.blinker, 1.0 / 4)
+        self.task_update = self.frames.schedule_interval(self.update, 1.0 / 30)
+        self.frames.schedule_interval(self.update_speeds, 1.0 / 10)
+        if self.engine is not None:
+            self.bind_settings_snapshot()
+            self.register_poll_groups()
+            # Started once the bars exist, so that the first resync uploads their configuration
+            self.engine.start()
+            if self.telemetry_enabled:
+                self.start_telemetry()
+        self.frames.schedule_interval(self.blinker, 1.0 / 4)
+        profiler.mark("build")
         return self.home
 
+    def on_start(self):
+        from kivy.core.window import Window
+
+        def first_frame(*args):
+            Window.unbind(on_flip=first_frame)
+            profiler.mark("first_frame")
+            log.info(profiler.report())
+
+        Window.bind(on_flip=first_frame)
+
+    def start_telemetry(self):
+        from rotary_controller_python.utils.telemetry import TelemetryServer
+
+        try:
+            self.telemetry = TelemetryServer(self.engine, host=self.telemetry_host, port=self.telemetry_port)
+            self.telemetry.start()
+        except Exception as e:
+            log.error(f"Unable to start the telemetry server: {e.__str__()}")
+            self.telemetry = None
+
+    def dump_metrics(self):
+        if self.device is None:
+            return
+        try:
+            self.device.metrics.dump(self.metrics_file)
+        except Exception as e:
+            log.error(f"Unable to write the communication metrics: {e.__str__()}")
+
+    @staticmethod
+    def open_frames_overlay():
+        from rotary_controller_python.components.framesoverlay import FramesOverlay
+
+        FramesOverlay().open()
+
+    def dump_frames(self):
+        if not self.frames.enabled:
+            return
+        try:
+            self.frames.dump(self.frames_file)
+        except Exception as e:
+            log.error(f"Unable to write the frame timings: {e.__str__()}")
+
+    def on_stop(self):
+        if self.telemetry is not None:
+            self.telemetry.stop()
+        if self.engine is not None:
+            self.engine.stop()
+        if self.device is not None and self.device.recorder is not None:
+            self.device.recorder.close()
+        self.dump_metrics()
+        self.dump_frames()
+        log.info(f"Display updates: {self.bridge.statistics()}")
+        persistence.writer.flush()
+
 
 if __name__ == "__main__":
     MainApp().run()
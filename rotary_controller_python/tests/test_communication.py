@@ -0,0 +1,31 @@
+"""
+Bus time accounting of DeviceManager.execute, used by the frame profiler of the UI thread.
+"""
+import threading
+import time
+
+from rotary_controller_python.utils.communication import DeviceManager
+
+
+def test_blocking_time_is_counted_per_thread():
+    dm = DeviceManager(connect=False)
+    measured = dict()
+
+    def worker(name, delay):
+        for _ in range(5):
+            dm.execute(time.sleep, delay)
+        measured[name] = dm.blocking_time
+
+    threads = [threading.Thread(target=worker, args=(f"worker-{i}", 0.01 * (i + 1))) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The waits of the other threads are not charged to this one
+    assert dm.blocking_time == 0.0
+    for i in range(4):
+        assert 0.05 * (i + 1) <= measured[f"worker-{i}"] < 0.05 * (i + 1) + 0.05
+
+    dm.execute(time.sleep, 0.01)
+    assert 0.01 <= dm.blocking_time < 0.05
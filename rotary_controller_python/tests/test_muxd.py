@@ -0,0 +1,193 @@
+"""
+Behaviour of the serial port multiplexer against the simulated board: the register cache, the
+merging of identical reads and the answers to malformed requests.
+"""
+import asyncio
+import os
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from rotary_controller_python.utils import muxd, rtu
+from rotary_controller_python.utils.simulator import Simulator
+
+ADDRESS = 17
+
+
+@pytest.fixture
+def simulator():
+    with Simulator(address=ADDRESS) as sim:
+        yield sim
+
+
+class Daemon:
+    """A multiplexer serving its Unix socket from an event loop running on a background thread"""
+
+    def __init__(self, simulator, socket_path, max_age):
+        self.multiplexer = muxd.Multiplexer(
+            serial_device=simulator.port, max_age=max_age, socket_path=socket_path, tcp_port=0
+        )
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.serving = asyncio.run_coroutine_threadsafe(self.multiplexer.serve(), self.loop)
+        deadline = time.monotonic() + 2.0
+        while not os.path.exists(socket_path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout=5.0)
+
+    def request(self, pdu: bytes) -> bytes:
+        return self.run(self.multiplexer.request(ADDRESS, pdu))
+
+    def stop(self):
+        self.serving.cancel()
+        deadline = time.monotonic() + 2.0
+        while self.multiplexer.servers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+@pytest.fixture
+def daemon_factory(simulator, tmp_path):
+    daemons = []
+
+    def start(max_age=10.0):
+        daemon = Daemon(simulator, str(tmp_path / "muxd.sock"), max_age)
+        daemons.append(daemon)
+        return daemon
+
+    yield start
+    for daemon in daemons:
+        daemon.stop()
+
+
+def read_pdu(address, count, function=muxd.READ_HOLDING_REGISTERS) -> bytes:
+    return struct.pack(">BHH", function, address, count)
+
+
+def exchange(client: socket.socket, pdu: bytes, transaction=1) -> bytes:
+    """Send one Modbus TCP request and return the response PDU"""
+    client.sendall(muxd.MBAP.pack(transaction, 0, len(pdu) + 1, ADDRESS) + pdu)
+    header = client.recv(muxd.MBAP.size, socket.MSG_WAITALL)
+    answered, _, length, _ = muxd.MBAP.unpack(header)
+    assert answered == transaction
+    return client.recv(length - 1, socket.MSG_WAITALL)
+
+
+def test_cache_hit_within_max_age(simulator, daemon_factory):
+    daemon = daemon_factory(max_age=10.0)
+    mux = daemon.multiplexer
+    address = simulator.addresses.scales[0].max_value
+    first = daemon.request(read_pdu(address, 2))
+    second = daemon.request(read_pdu(address, 2))
+    assert first == second
+    assert mux.bus_requests == 1
+    assert mux.cache_hits == 1
+
+
+def test_cache_expires(daemon_factory):
+    daemon = daemon_factory(max_age=0.05)
+    daemon.request(read_pdu(0, 2))
+    time.sleep(0.1)
+    daemon.request(read_pdu(0, 2))
+    assert daemon.multiplexer.bus_requests == 2
+    assert daemon.multiplexer.cache_hits == 0
+
+
+def test_identical_concurrent_reads_are_merged(daemon_factory):
+    daemon = daemon_factory(max_age=0.0)
+
+    async def concurrent():
+        return await asyncio.gather(*[daemon.multiplexer.request(ADDRESS, read_pdu(0, 4)) for _ in range(3)])
+
+    responses = daemon.run(concurrent())
+    assert responses[0] == responses[1] == responses[2]
+    assert responses[0][0] == muxd.READ_HOLDING_REGISTERS
+    assert daemon.multiplexer.bus_requests == 1
+    assert daemon.multiplexer.coalesced_count == 2
+
+
+def test_write_invalidates_the_cache(simulator, daemon_factory):
+    daemon = daemon_factory(max_age=10.0)
+    address = simulator.addresses.scales[0].max_value
+    daemon.request(read_pdu(address, 2))
+    written = daemon.request(struct.pack(">BHHBHH", muxd.WRITE_MULTIPLE_REGISTERS, address, 2, 4, 0x1234, 0x5678))
+    assert written[0] == muxd.WRITE_MULTIPLE_REGISTERS
+    assert daemon.request(read_pdu(address, 2)) == struct.pack(">BBHH", muxd.READ_HOLDING_REGISTERS, 4, 0x1234, 0x5678)
+    assert daemon.multiplexer.bus_requests == 3
+
+    daemon.request(struct.pack(">BHH", muxd.WRITE_SINGLE_REGISTER, address + 1, 0x4321))
+    assert daemon.request(read_pdu(address + 1, 1)) == struct.pack(">BBH", muxd.READ_HOLDING_REGISTERS, 2, 0x4321)
+    assert daemon.multiplexer.bus_requests == 5
+
+
+@pytest.mark.parametrize(
+    "pdu, code",
+    [
+        (read_pdu(0, 0), muxd.ILLEGAL_DATA_VALUE),
+        (read_pdu(0, 126), muxd.ILLEGAL_DATA_VALUE),
+        (read_pdu(0xFFFF, 2), muxd.ILLEGAL_DATA_ADDRESS),
+        (read_pdu(0, 1)[:3], muxd.ILLEGAL_DATA_VALUE),
+        (struct.pack(">BHHBH", muxd.WRITE_MULTIPLE_REGISTERS, 0, 2, 2, 0), muxd.ILLEGAL_DATA_VALUE),
+        (struct.pack(">BHHBH", muxd.WRITE_MULTIPLE_REGISTERS, 0xFFFF, 2, 4, 0) + b"\x00\x00", muxd.ILLEGAL_DATA_ADDRESS),
+        (bytes((0x2B, 0x0E, 0x01, 0x00)), muxd.ILLEGAL_FUNCTION),
+    ],
+)
+def test_malformed_requests(daemon_factory, pdu, code):
+    daemon = daemon_factory()
+    response = daemon.request(pdu)
+    assert response == muxd.exception_pdu(pdu[0], code)
+    # Rejected before reaching the bus or the cache
+    assert daemon.multiplexer.bus_requests == 0
+    assert len(daemon.multiplexer.cache) == 0
+
+
+def test_malformed_request_keeps_the_connection(daemon_factory, tmp_path):
+    daemon = daemon_factory()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(2.0)
+        client.connect(str(tmp_path / "muxd.sock"))
+        assert exchange(client, read_pdu(0, 0), 1) == muxd.exception_pdu(muxd.READ_HOLDING_REGISTERS, muxd.ILLEGAL_DATA_VALUE)
+        assert exchange(client, read_pdu(0, 1), 2)[:2] == bytes((muxd.READ_HOLDING_REGISTERS, 2))
+
+
+def test_unexpected_error_answers_device_failure(daemon_factory, tmp_path):
+    daemon = daemon_factory()
+
+    def broken(*args):
+        raise RuntimeError("broken cache")
+
+    daemon.multiplexer.cache.lookup = broken
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(2.0)
+        client.connect(str(tmp_path / "muxd.sock"))
+        failed = exchange(client, read_pdu(0, 1), 1)
+        assert failed == muxd.exception_pdu(muxd.READ_HOLDING_REGISTERS, muxd.SERVER_DEVICE_FAILURE)
+        written = exchange(client, struct.pack(">BHH", muxd.WRITE_SINGLE_REGISTER, 0, 1), 2)
+        assert written[0] == muxd.WRITE_SINGLE_REGISTER
+
+
+def test_unknown_units_do_not_grow_the_cache(daemon_factory):
+    daemon = daemon_factory()
+    for unit in (1, 2, 3):
+        daemon.run(daemon.multiplexer.request(unit, read_pdu(0, 125)))
+    assert len(daemon.multiplexer.cache) == 0
+
+
+def test_mux_port(simulator, daemon_factory, tmp_path):
+    daemon_factory()
+    instrument = rtu.RtuInstrument(port=muxd.MuxPort(str(tmp_path / "muxd.sock")), slaveaddress=ADDRESS)
+    address = simulator.addresses.scales[0].max_value
+    instrument.write_long(address, -123456, signed=True, byteorder=rtu.BYTEORDER_LITTLE_SWAP)
+    assert instrument.read_long(address, signed=True, byteorder=rtu.BYTEORDER_LITTLE_SWAP) == -123456
+    assert simulator.image.get_long(address) == -123456
+    with pytest.raises(rtu.SlaveReportedException):
+        instrument.read_registers(simulator.image.count, 2)
+    instrument.port.close()
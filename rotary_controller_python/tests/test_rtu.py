@@ -0,0 +1,147 @@
+"""
+Behaviour of the native RTU transport against the simulated board, including the retry and
+deadline handling under the faults injected by the simulator.
+"""
+import struct
+import time
+
+import pytest
+
+from rotary_controller_python.utils import rtu
+from rotary_controller_python.utils.simulator import Faults, Simulator
+
+ADDRESS = 17
+
+
+class ScriptedRandom:
+    """Stands in for the random generator of the simulator, returns the given values then `default`"""
+
+    def __init__(self, values, default=0.99):
+        self.values = list(values)
+        self.default = default
+
+    def random(self):
+        return self.values.pop(0) if len(self.values) > 0 else self.default
+
+
+@pytest.fixture
+def simulator():
+    with Simulator(address=ADDRESS) as sim:
+        yield sim
+
+
+def make_instrument(simulator, **kwargs) -> rtu.RtuInstrument:
+    return rtu.RtuInstrument(port=rtu.RtuPort(port=simulator.port, **kwargs), slaveaddress=ADDRESS)
+
+
+def test_crc16():
+    # CRC-16/MODBUS check value and the read request of the specification, sent as C5 CD
+    assert rtu.crc16(b"123456789") == 0x4B37
+    assert rtu.crc16(bytes.fromhex("01030000000a")) == 0xCDC5
+    assert rtu.crc16(b"") == 0xFFFF
+
+
+def test_word_order():
+    raw = bytes.fromhex("01020304")
+    assert rtu.word_order(raw, rtu.BYTEORDER_BIG) == bytes.fromhex("01020304")
+    assert rtu.word_order(raw, rtu.BYTEORDER_LITTLE) == bytes.fromhex("04030201")
+    assert rtu.word_order(raw, rtu.BYTEORDER_BIG_SWAP) == bytes.fromhex("02010403")
+    assert rtu.word_order(raw, rtu.BYTEORDER_LITTLE_SWAP) == bytes.fromhex("03040102")
+
+
+@pytest.mark.parametrize(
+    "byteorder",
+    [rtu.BYTEORDER_BIG, rtu.BYTEORDER_LITTLE, rtu.BYTEORDER_BIG_SWAP, rtu.BYTEORDER_LITTLE_SWAP],
+)
+def test_32_bit_values_round_trip(simulator, byteorder):
+    instrument = make_instrument(simulator)
+    address = simulator.addresses.scales[0].max_value
+    instrument.write_long(address, -123456789, signed=True, byteorder=byteorder)
+    assert instrument.read_long(address, signed=True, byteorder=byteorder) == -123456789
+    instrument.write_float(address, 1.5, byteorder=byteorder)
+    assert instrument.read_float(address, byteorder=byteorder) == 1.5
+
+
+def test_little_swap_matches_the_firmware_layout(simulator):
+    instrument = make_instrument(simulator)
+    address = simulator.addresses.scales[0].max_value
+    instrument.write_long(address, -123456789, signed=True, byteorder=rtu.BYTEORDER_LITTLE_SWAP)
+    assert simulator.image.get_long(address) == -123456789
+
+
+def test_read_and_write_registers(simulator):
+    instrument = make_instrument(simulator)
+    instrument.write_registers(0, [1, 2, 0xFFFF])
+    assert instrument.read_registers(0, 3) == [1, 2, 0xFFFF]
+
+    buffer = bytearray(6)
+    instrument.read_registers_into(0, 3, buffer)
+    assert struct.unpack("<3H", buffer) == (1, 2, 0xFFFF)
+
+
+def test_exception_frame(simulator):
+    instrument = make_instrument(simulator)
+    with pytest.raises(rtu.SlaveReportedException, match="code 2"):
+        instrument.read_registers(simulator.image.count, 2)
+    # Exceptions reported by the slave are not retried
+    assert instrument.port.retries_count == 0
+    # The port is still in sync with the slave afterwards
+    assert instrument.read_registers(0, 1) is not None
+
+
+def test_retry_after_crc_error(simulator):
+    instrument = make_instrument(simulator)
+    instrument.write_registers(0, [42])
+    simulator.faults = Faults(crc_error_rate=0.5)
+    # First response corrupted, the second one is sent untouched
+    simulator.random = ScriptedRandom([0.99, 0.1])
+    assert instrument.read_registers(0, 1) == [42]
+    assert instrument.port.crc_errors_count == 1
+    assert instrument.port.retries_count == 1
+
+
+def test_retries_are_bounded(simulator):
+    simulator.faults = Faults(crc_error_rate=1.0)
+    instrument = make_instrument(simulator, retries=2, latency_budget=1.0)
+    with pytest.raises(rtu.CrcError):
+        instrument.read_registers(0, 1)
+    assert instrument.port.crc_errors_count == 3
+    assert instrument.port.retries_count == 2
+
+
+def test_truncated_response(simulator):
+    simulator.faults = Faults(drop_rate=1.0)
+    instrument = make_instrument(simulator, retries=1, latency_budget=1.0)
+    with pytest.raises(rtu.NoResponseError, match="Incomplete"):
+        instrument.read_registers(0, 10)
+    assert instrument.port.timeouts_count == 2
+
+
+def test_timeout(simulator):
+    simulator.faults = Faults(timeout_rate=1.0, timeout_delay=0.2)
+    instrument = make_instrument(simulator, retries=0)
+    started = time.perf_counter()
+    with pytest.raises(rtu.NoResponseError):
+        instrument.read_registers(0, 1)
+    assert time.perf_counter() - started < 0.1
+    assert instrument.port.timeouts_count == 1
+
+
+def test_latency_budget(simulator):
+    simulator.faults = Faults(latency=0.3)
+    slow = make_instrument(simulator, response_margin=0.01, retries=10, latency_budget=0.1)
+    started = time.perf_counter()
+    with pytest.raises(rtu.NoResponseError):
+        slow.read_registers(0, 1)
+    # The retries stop at the budget, well before ten attempts
+    assert time.perf_counter() - started < 0.15
+    assert 0 < slow.port.retries_count < 10
+    slow.port.close()
+
+    # Let the late responses drain before a patient port asks again
+    simulator.faults = Faults()
+    time.sleep(0.4)
+    simulator.faults = Faults(latency=0.05)
+    patient = make_instrument(simulator, response_margin=0.1, latency_budget=0.3)
+    assert len(patient.read_registers(0, 1)) == 1
+    assert patient.port.retries_count == 0
@@ -0,0 +1,84 @@
+"""
+Poll groups of several boards sharing the bus, against a simulator answering two slave addresses.
+"""
+import time
+
+import pytest
+
+from rotary_controller_python.utils.bus import SerialBus
+from rotary_controller_python.utils.communication import DeviceManager
+from rotary_controller_python.utils.connection import LIVE
+from rotary_controller_python.utils.engine import CommsEngine
+from rotary_controller_python.utils.scheduler import PollGroup, PollScheduler, REALTIME, NORMAL, ON_DEMAND
+from rotary_controller_python.utils.simulator import Simulator
+
+MAIN = 17
+SECOND = 18
+
+
+class TwoSlaves(Simulator):
+    """Serves both addresses from the same register image"""
+
+    def handle(self, frame):
+        if len(frame) > 0 and frame[0] in (MAIN, SECOND):
+            self.address = frame[0]
+        return super().handle(frame)
+
+
+def test_groups_of_different_slaves_with_the_same_name():
+    scheduler = PollScheduler()
+    main = scheduler.add(PollGroup("fast_data", REALTIME, lambda: None, slave="main"))
+    second = scheduler.add(PollGroup("fast_data", NORMAL, lambda: None, slave="second"))
+    assert set(scheduler.groups.values()) == {main, second}
+    assert set(scheduler.statistics()) == {"main/fast_data", "second/fast_data"}
+
+    # Registering a group again replaces the one of the same slave only
+    replaced = scheduler.add(PollGroup("fast_data", NORMAL, lambda: None, slave="second"))
+    assert set(scheduler.groups.values()) == {main, replaced}
+
+    scheduler.remove("fast_data", slave="second")
+    assert list(scheduler.groups.values()) == [main]
+
+
+def test_request_names_the_slave():
+    scheduler = PollScheduler()
+    main = scheduler.add(PollGroup("full_update", ON_DEMAND, lambda: None, slave="main"))
+    second = scheduler.add(PollGroup("full_update", ON_DEMAND, lambda: None, slave="second"))
+    scheduler.request("full_update", slave="second")
+    assert scheduler.due(time.monotonic()) == [second]
+    assert not main.requested
+    with pytest.raises(KeyError):
+        scheduler.request("full_update")
+
+
+def test_attached_board_does_not_replace_the_main_fast_data():
+    with TwoSlaves(address=MAIN) as simulator:
+        bus = SerialBus(simulator.port, transport="rtu")
+        main = DeviceManager(address=MAIN, bus=bus, connect=False, name="main")
+        second = DeviceManager(address=SECOND, bus=bus, connect=False, name="second")
+        engine = CommsEngine(main)
+        engine.attach(second)
+        second_samples = []
+        engine.scheduler.add(PollGroup(
+            "fast_data",
+            NORMAL,
+            read=lambda: second.fast_data.refresh(),
+            callback=second_samples.append,
+            slave="second",
+        ))
+
+        engine.start()
+        try:
+            time.sleep(1.5)
+            assert engine.state == LIVE
+            assert engine.slave_states["second"] == LIVE
+            statistics = engine.scheduler.statistics()
+            samples = engine.samples_count
+        finally:
+            engine.stop()
+            bus.close()
+
+    assert samples > 10
+    assert statistics["main/fast_data"]["runs"] > 10
+    assert statistics["second/fast_data"]["runs"] > 3
+    assert len(second_samples) > 3
@@ -0,0 +1,86 @@
+"""
+Register layout of the firmware structs, the offsets below follow the C declarations in
+addresses.py with the natural alignment of the STM32 compiler.
+"""
+import pytest
+
+from rotary_controller_python.utils.addresses import (
+    FAST_DATA_SCHEMA,
+    GLOBAL_SCHEMA,
+    SCALE_SCHEMA,
+    SERVO_SCHEMA,
+    SCALES_COUNT,
+    FastDataAddresses,
+    GlobalAddresses,
+)
+from rotary_controller_python.utils.communication import DeviceManager
+from rotary_controller_python.utils.simulator import Simulator
+
+
+def test_struct_sizes():
+    assert SERVO_SCHEMA.registers == 36
+    # 41 bytes padded to the 4 byte alignment of the int32 members
+    assert SCALE_SCHEMA.registers == 22
+    assert GLOBAL_SCHEMA.registers == 8 + 4 + 36 + SCALES_COUNT * 22
+    assert FAST_DATA_SCHEMA.registers == 14
+
+
+def test_global_offsets():
+    addresses = GlobalAddresses(0)
+    assert addresses.execution_cycles == 6
+    assert addresses.index_structure_offset.base_address == 8
+    assert addresses.index_structure_offset.index == 10
+    servo = addresses.servo_structure_offset
+    assert servo.base_address == 12
+    assert servo.current_position == 28
+    assert servo.current_steps == 30
+    assert servo.desired_steps == 32
+    assert servo.breaking_time == 44
+    assert servo.estimated_speed == servo.breaking_time
+    assert servo.allowed_error == 46
+    assert [scale.base_address for scale in addresses.scales] == [48, 70, 92, 114]
+    assert addresses.scales[1].position == 82
+    assert addresses.scales[1].sync_motion == 90
+
+
+def test_global_offsets_with_base_address():
+    # The index offset used to include the base address twice
+    addresses = GlobalAddresses(100)
+    assert addresses.index_structure_offset.base_address == 108
+    assert addresses.servo_structure_offset.desired_steps == 132
+
+
+def test_fast_data_offsets():
+    addresses = FastDataAddresses(GlobalAddresses(0).scales[SCALES_COUNT - 1].end)
+    assert addresses.base_address == 136
+    assert addresses.scale_current == 140
+    assert addresses.cycles == 148
+    assert addresses.end == 150
+
+
+@pytest.fixture(scope="module")
+def simulator():
+    with Simulator(address=17) as sim:
+        yield sim
+
+
+@pytest.mark.parametrize("shadow_max_age", [None, 0.25], ids=["direct", "shadow"])
+def test_servo_fields_decoding(simulator, shadow_max_age):
+    servo = simulator.addresses.servo_structure_offset
+    with simulator._lock:
+        simulator.image.set_long(servo.desired_steps, -123456)
+        # A far target at a fixed speed, the simulator reports the speed in the breakingTime slot
+        simulator.image.set_float(servo.absolute_offset, 1e6)
+        simulator.image.set_float(servo.min_speed, 100)
+        simulator.image.set_float(servo.max_speed, 100)
+        simulator.image.set_float(servo.acceleration, 1e9)
+        simulator.image.set_float(servo.breaking_space, 12.5)
+
+    dm = DeviceManager(serial_device=simulator.port, address=17, transport="rtu", shadow_max_age=shadow_max_age)
+    try:
+        assert dm.servo.desired_steps == -123456
+        assert dm.servo.breaking_space == 12.5
+        assert dm.servo.breaking_time == 100.0
+        assert dm.servo.estimated_speed == 100.0
+    finally:
+        dm.close()
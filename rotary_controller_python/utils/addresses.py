@@ -1,133 +1,143 @@
+from rotary_controller_python.utils.schema import AddressMap, Field, Nested, StructSchema
+
 SCALES_COUNT = 4
 
+# typedef struct {
+#     TIM_HandleTypeDef * timerHandle;
+#     uint16_t encoderPrevious;
+#     uint16_t encoderCurrent;
+#     int32_t ratioNum;
+#     int32_t ratioDen;
+#     int32_t maxValue;
+#     int32_t minValue;
+#     int32_t position;
+#     int32_t error;
+#     int32_t syncRatioNum, syncRatioDen;
+#     bool syncMotion;
+# } input_t;
+SCALE_SCHEMA = StructSchema("input_t", [
+    # Pointers are 32 bit wide on the STM32
+    Field("timer_handle", "L", c_name="timerHandle"),
+    Field("encoder_previous", "H", c_name="encoderPrevious"),
+    Field("encoder_current", "H", c_name="encoderCurrent"),
+    Field("ratio_num", "l", c_name="ratioNum"),
+    Field("ratio_den", "l", c_name="ratioDen"),
+    Field("max_value", "l", c_name="maxValue"),
+    Field("min_value", "l", c_name="minValue"),
+    Field("position", "l"),
+    Field("error", "l"),
+    Field("sync_ratio_num", "l", c_name="syncRatioNum"),
+    Field("sync_ratio_den", "l", c_name="syncRatioDen"),
+    Field("sync_motion", "?", c_name="syncMotion"),
+])
 
-class ScaleAddresses:
-    #     typedef struct {
-    #     TIM_HandleTypeDef * timerHandle;
-    #     uint16_t encoderPrevious;
-    #     uint16_t encoderCurrent;
-    #     int32_t ratioNum;
-    #     int32_t ratioDen;
-    #     int32_t maxValue;
-    #     int32_t minValue;
-    #     int32_t position;
-    #     int32_t error;
-    #     int32_t syncRatioNum, syncRatioDen;
-    #     bool syncMotion;
-    # } input_t;
-    def __init__(self, base_address):
-        self.base_address = base_address
-        self.timer_handle = 0 + base_address
-        self.encoder_previous = 2 + base_address
-        self.encoder_current = 3 + base_address
-        self.ratio_num = 4 + base_address
-        self.ratio_den = 6 + base_address
-        self.max_value = 8 + base_address
-        self.min_value = 10 + base_address
-        self.position = 12 + base_address
-        self.error = 14 + base_address
-        self.sync_ratio_num = 16 + base_address
-        self.sync_ratio_den = 18 + base_address
-        self.sync_motion = 20 + base_address
-        self.end = 22 + base_address
-
-
-class IndexAddresses:
-    def __init__(self, base_address):
-        self.base_address = base_address
-        self.divisions = 0 + base_address
-        self.index = 2 + base_address
-        self.end = 4 + base_address
-
-
-class GlobalAddresses:
-    # typedef struct {
-    #     uint32_t execution_interval;
-    #     uint32_t execution_interval_previous;
-    #     uint32_t execution_interval_current;
-    #     uint32_t execution_cycles;
-    #     index_t index;
-    #     servo_t servo;
-    #     input_t scales[SCALES_COUNT];
-    # } rampsSharedData_t;
+# typedef struct {
+#     int32_t divisions;
+#     int32_t index;
+# } index_t;
+INDEX_SCHEMA = StructSchema("index_t", [
+    Field("divisions", "l"),
+    Field("index", "l"),
+])
+
+# typedef struct {
+#     float minSpeed;
+#     float maxSpeed;
+#     float currentSpeed;
+#     float acceleration;
+#     float absoluteOffset;
+#     float indexOffset;
+#     float syncOffset;
+#     float desiredPosition;
+#     float currentPosition;
+#     int32_t currentSteps;
+#     int32_t desiredSteps;
+#     int32_t ratioNum;
+#     int32_t ratioDen;
+#     int32_t maxValue;
+#     int32_t minValue;
+#     float breakingSpace, breakingTime;
+#     float allowedError;
+# } servo_t;
+SERVO_SCHEMA = StructSchema("servo_t", [
+    Field("min_speed", "f", c_name="minSpeed"),
+    Field("max_speed", "f", c_name="maxSpeed"),
+    Field("current_speed", "f", c_name="currentSpeed"),
+    Field("acceleration", "f"),
+    Field("absolute_offset", "f", c_name="absoluteOffset"),
+    Field("index_offset", "f", c_name="indexOffset"),
+    Field("sync_offset", "f", c_name="syncOffset"),
+    Field("desired_position", "f", c_name="desiredPosition"),
+    Field("current_position", "f", c_name="currentPosition"),
+    Field("current_steps", "l", c_name="currentSteps"),
+    Field("desired_steps", "l", c_name="desiredSteps"),
+    Field("ratio_num", "l", c_name="ratioNum"),
+    Field("ratio_den", "l", c_name="ratioDen"),
+    Field("max_value", "l", c_name="maxValue"),
+    Field("min_value", "l", c_name="minValue"),
+    Field("breaking_space", "f", c_name="breakingSpace"),
+    # The firmware reports the estimated servo speed in this slot
+    Field("breaking_time", "f", c_name="breakingTime", aliases=("estimated_speed",)),
+    Field("allowed_error", "f", c_name="allowedError"),
+])
+
+# typedef struct {
+#     uint32_t execution_interval;
+#     uint32_t execution_interval_previous;
+#     uint32_t execution_interval_current;
+#     uint32_t execution_cycles;
+#     index_t index;
+#     servo_t servo;
+#     input_t scales[SCALES_COUNT];
+# } rampsSharedData_t;
+GLOBAL_SCHEMA = StructSchema("rampsSharedData_t", [
+    Field("execution_interval", "L"),
+    Field("execution_interval_previous", "L"),
+    Field("execution_interval_current", "L"),
+    Field("execution_cycles", "L"),
+    Nested("index", INDEX_SCHEMA),
+    Nested("servo", SERVO_SCHEMA),
+    Nested("scales", SCALE_SCHEMA, count=SCALES_COUNT),
+])
+
+# typedef struct {
+#   float servoCurrent;
+#   float servoDesired;
+#   int32_t scaleCurrent[SCALES_COUNT];
+#   uint32_t cycles;
+# } fastData_t;
+FAST_DATA_SCHEMA = StructSchema("fastData_t", [
+    Field("servo_current", "f", c_name="servoCurrent"),
+    Field("servo_desired", "f", c_name="servoDesired"),
+    Field("scale_current", "l", c_name="scaleCurrent", count=SCALES_COUNT),
+    Field("cycles", "L"),
+])
+
+
+class ScaleAddresses(AddressMap):
+    schema = SCALE_SCHEMA
+
+
+class IndexAddresses(AddressMap):
+    schema = INDEX_SCHEMA
+
+
+class ServoAddresses(AddressMap):
+    schema = SERVO_SCHEMA
+
+
+class GlobalAddresses(AddressMap):
+    schema = GLOBAL_SCHEMA
 
     def __init__(self, base_address):
-        self.base_address = base_address
-        self.execution_interval = 0 + base_address
-        self.execution_interval_previous = 2 + base_address
-        self.execution_interval_current = 4 + base_address
-        self.execution_cycles = 6 + base_address
-        self.index_structure_offset = IndexAddresses(
-            self.execution_cycles + base_address + 2
-        )
-        self.servo_structure_offset = ServoAddresses(self.index_structure_offset.end)
-        end = self.servo_structure_offset.end
-        self.scales = []
-
-        for item in range(SCALES_COUNT):
-            scale = ScaleAddresses(end)
-            end = scale.end
-            self.scales.append(scale)
-
-
-class ServoAddresses:
-    #     typedef struct {
-    #     float minSpeed;
-    #     float maxSpeed;
-    #     float currentSpeed;
-    #     float acceleration;
-    #     float absoluteOffset;
-    #     float indexOffset;
-    #     float syncOffset;
-    #     float desiredPosition;
-    #     float currentPosition;
-    #     int32_t currentSteps;
-    #     int32_t desiredSteps;
-    #     int32_t ratioNum;
-    #     int32_t ratioDen;
-    #     int32_t maxValue;
-    #     int32_t minValue;
-    #     float breakingSpace, breakingTime;
-    #     float allowedError;
-    # } servo_t;
-    def __init__(self, base_address):
-        self.base_address = base_address
-        self.min_speed = 0 + base_address
-        self.max_speed = 2 + base_address
-        self.current_speed = 4 + base_address
-        self.acceleration = 6 + base_address
-        self.absolute_offset = 8 + base_address
-        self.index_offset = 10 + base_address
-        self.sync_offset = 12 + base_address
-        self.desired_position = 14 + base_address
-        self.current_position = 16 + base_address
-        self.current_steps = 18 + base_address
-        self.desired_steps = 20 + base_address
-        self.ratio_num = 22 + base_address
-        self.ratio_den = 24 + base_address
-        self.max_value = 26 + base_address
-        self.min_value = 28 + base_address
-        self.breaking_space = 30 + base_address
-        self.estimated_speed = 32 + base_address
-        self.allowed_error = 34 + base_address
-        self.end = 36 + base_address
-
-
-class FastDataAddresses:
-    # typedef struct {
-    #   float servoCurrent;
-    #   float servoDesired;
-    #   int32_t scaleCurrent[SCALES_COUNT];
-    #   uint32_t cycles;
-    # } fastData_t;
-    def __init__(self, base_address):
-        self.base_address = base_address
-        self.servo_current = 0 + base_address
-        self.servo_desired = 2 + base_address
-        self.scale_current = 4 + base_address
-        self.cycles = self.scale_current + (2 * SCALES_COUNT)
-        self.end = self.cycles + 2
+        super().__init__(base_address)
+        self.index_structure_offset = IndexAddresses(self.offset_of("index"))
+        self.servo_structure_offset = ServoAddresses(self.offset_of("servo"))
+        scales = self.offset_of("scales")
+        self.scales = [
+            ScaleAddresses(scales + i * SCALE_SCHEMA.registers) for i in range(SCALES_COUNT)
+        ]
 
-        import struct
 
-        self.struct_map = "<ff" + "l" * SCALES_COUNT + "l"
+class FastDataAddresses(AddressMap):
+    schema = FAST_DATA_SCHEMA
@@ -1,95 +1,137 @@
 import minimalmodbus
 import logging
+import struct
+
+from rotary_controller_python.utils.shadow import FLOAT, LONG, UNSIGNED, SIGNED, MAX_BLOCK_REGISTERS
+from rotary_controller_python.utils.metrics import ThrottledLogger
 
 log = logging.getLogger(__name__)
+throttled_log = ThrottledLogger(log)
 
 
 class BaseDevice:
     def __init__(self, device):
         from rotary_controller_python.utils.communication import DeviceManager
+        from rotary_controller_python.utils.schema import AddressMap
 
         self.dm: DeviceManager = device
+        self.addresses: AddressMap or None = None
 
-    def read_float(self, address) -> float:
+    def _transaction(self, method_name, *args, **kwargs):
+        """Run one instrument call, this is always executed by the thread owning the bus."""
         try:
-            value = self.dm.device.read_float(
-                address, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP
-            )
-            self.dm.connected = True
-            return value
+            return getattr(self.dm.device, method_name)(*args, **kwargs)
         except Exception as e:
-            self.dm.connected = False
-            log.error(e.__str__())
+            # The comms engine tracks the link state, only report failures of a live link
+            if self.dm.connected:
+                throttled_log.error(e.__str__())
             return 0
 
-    def write_float(self, address, value):
+    def _read(self, method_name, *args, **kwargs):
         try:
-            self.dm.device.write_float(
-                address, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP, value=value
-            )
-            self.dm.connected = True
+            return self.dm.execute(self._transaction, method_name, *args, **kwargs)
         except Exception as e:
-            self.dm.connected = False
-            log.error(e.__str__())
+            throttled_log.error(e.__str__())
+            return 0
 
-    def read_long(self, address) -> int:
+    def _read_shadow(self, codec, address, count):
+        """Serve a read from the shadow image, returns None when the address is not mirrored"""
+        shadow = self.dm.shadow
+        if shadow is None or not shadow.covers(address, count):
+            return None
         try:
-            value = self.dm.device.read_long(
-                address, signed=True, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP
-            )
-            self.dm.connected = True
-            return value
+            return shadow.unpack(codec, address)
         except Exception as e:
-            self.dm.connected = False
-            log.error(e.__str__())
+            if self.dm.connected:
+                throttled_log.error(e.__str__())
             return 0
 
+    def _write_transaction(self, method_name, address, *args, **kwargs):
+        self._transaction(method_name, address, *args, **kwargs)
+        # Any block read that completed before this write holds the old value
+        if self.dm.shadow is not None:
+            self.dm.shadow.invalidate(address, 2)
+
+    def _write(self, method_name, address, *args, codec=None, **kwargs):
+        tx = self.dm.active_transaction
+        if tx is not None:
+            tx.stage(address, codec, kwargs['value'])
+            return
+
+        if self.dm.shadow is not None:
+            self.dm.shadow.invalidate(address, 2)
+        self.dm.post(self._write_transaction, method_name, address, *args, **kwargs)
+
+    def read_float(self, address) -> float:
+        value = self._read_shadow(FLOAT, address, 2)
+        if value is not None:
+            return value
+        return self._read("read_float", address, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP)
+
+    def write_float(self, address, value):
+        self._write(
+            "write_float", address, codec=FLOAT, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP, value=value
+        )
+
+    def read_long(self, address) -> int:
+        value = self._read_shadow(LONG, address, 2)
+        if value is not None:
+            return value
+        return self._read("read_long", address, signed=True, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP)
+
     def write_long(self, address, value):
-        try:
-            self.dm.device.write_long(
-                address,
-                signed=True,
-                byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP,
-                value=int(value),
-            )
-            self.dm.connected = True
-            log.info(f"Written {int(value)} to address {address}")
-        except Exception as e:
-            self.dm.connected = False
-            log.error(e.__str__())
+        self._write(
+            "write_long",
+            address,
+            codec=LONG,
+            signed=True,
+            byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP,
+            value=int(value),
+        )
 
     def read_unsigned(self, address):
-        try:
-            value = self.dm.device.read_register(address, signed=False)
-            self.dm.connected = True
+        value = self._read_shadow(UNSIGNED, address, 1)
+        if value is not None:
             return value
-        except Exception as e:
-            self.dm.connected = False
-            log.error(e.__str__())
-            return 0
+        return self._read("read_register", address, signed=False)
 
     def write_unsigned(self, address, value):
-        try:
-            self.dm.device.write_register(address, signed=False, value=int(value))
-            self.dm.connected = True
-        except Exception as e:
-            self.dm.connected = False
-            log.error(e.__str__())
+        self._write("write_register", address, codec=UNSIGNED, signed=False, value=int(value))
 
     def read_signed(self, address):
-        try:
-            value = self.dm.device.read_register(address, signed=True)
-            self.dm.connected = True
+        value = self._read_shadow(SIGNED, address, 1)
+        if value is not None:
             return value
-        except Exception as e:
-            self.dm.connected = False
-            log.error(e.__str__())
-            return 0
+        return self._read("read_register", address, signed=True)
 
     def write_signed(self, address, value):
-        try:
-            self.dm.device.write_register(address, signed=True, value=int(value))
-            self.dm.connected = True
-        except Exception as e:
-            self.dm.connected = False
-            log.error(e.__str__())
+        self._write("write_register", address, codec=SIGNED, signed=True, value=int(value))
+
+    def _read_block(self, address, count):
+        """Read raw firmware memory with as few read requests as the protocol allows"""
+        registers = []
+        for start in range(address, address + count, MAX_BLOCK_REGISTERS):
+            registers += self.dm.device.read_registers(
+                registeraddress=start,
+                number_of_registers=min(MAX_BLOCK_REGISTERS, address + count - start),
+            )
+        return registers
+
+    def read_fields(self, *names) -> dict:
+        """
+        Read some members with a single request spanning just their registers, bypassing the
+        shadow image staleness budget, used by the poll groups.
+        """
+        schema = self.addresses.schema
+        fields = [schema[name] for name in names]
+        first = min(field.register for field in fields)
+        last = max(field.register + -(-field.size // 2) for field in fields)
+        address = self.addresses.base_address + first
+        registers = self.dm.execute(self._read_block, address, last - first)
+        if self.dm.shadow is not None:
+            self.dm.shadow.store(address, registers)
+        raw = struct.pack(f"<{len(registers)}H", *registers)
+        return {
+            name: field.codec.unpack_from(raw, field.offset - 2 * first)[0]
+            for name, field in zip(names, fields)
+        }
@@ -0,0 +1,75 @@
+"""
+Several control boards on one RS485 port. The port is owned by a SerialBus, each board is a
+DeviceManager with its own address, register map, shadow image and metrics, and the comms engine
+of the port interleaves the poll groups of all of them.
+"""
+import logging
+
+import minimalmodbus
+import serial
+
+from rotary_controller_python.utils.communication import DEFAULT_TRANSPORT
+from rotary_controller_python.utils.metrics import ThrottledLogger
+from rotary_controller_python.utils.rtu import RtuInstrument, RtuPort
+
+log = logging.getLogger(__name__)
+throttled_log = ThrottledLogger(log)
+
+
+class SerialBus:
+    """
+    Owner of one physical serial port shared by several slave boards. Boards are added with
+    `add`, or by passing the bus to their DeviceManager, and get an instrument on the shared port
+    every time the port is opened, so two boards never open the same device twice.
+    """
+
+    def __init__(self, serial_device="/dev/serial0", baudrate=57600, transport=DEFAULT_TRANSPORT, debug=False):
+        self.serial_device = serial_device
+        self.baudrate = baudrate
+        self.transport = transport
+        self.debug = debug
+        self.port = None
+        self.slaves = []
+
+    def add(self, device):
+        """Host a DeviceManager on this bus, its instrument is created when the port is opened"""
+        device.bus = self
+        self.slaves = self.slaves + [device]
+        if self.port is not None:
+            device.attach(self.instrument(device.address))
+        return device
+
+    def instrument(self, address):
+        if self.transport == "rtu":
+            return RtuInstrument(port=self.port, slaveaddress=address)
+        return minimalmodbus.Instrument(port=self.port, slaveaddress=address, debug=self.debug)
+
+    def open(self) -> bool:
+        """Open the port, closing any previous one, and give every board a new instrument"""
+        self.close()
+        try:
+            if self.transport == "rtu":
+                self.port = RtuPort(port=self.serial_device, baudrate=self.baudrate)
+            else:
+                self.port = serial.Serial(
+                    port=self.serial_device, baudrate=self.baudrate, timeout=0.1, write_timeout=0.1
+                )
+        except Exception as e:
+            throttled_log.error(e.__str__())
+            self.port = None
+            return False
+
+        for device in self.slaves:
+            device.attach(self.instrument(device.address))
+        return True
+
+    def close(self):
+        for device in self.slaves:
+            device.detach()
+        if self.port is None:
+            return
+        try:
+            self.port.close()
+        except Exception as e:
+            log.error(e.__str__())
+        self.port = None
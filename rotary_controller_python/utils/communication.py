@@ -1,13 +1,41 @@
+import contextlib
 import logging
+import threading
+import time
+
 import minimalmodbus
 
 from rotary_controller_python.utils.addresses import GlobalAddresses, SCALES_COUNT
+from rotary_controller_python.utils.metrics import BusMetrics, MeteredInstrument, ThrottledLogger
+from rotary_controller_python.utils.muxd import MuxPort
+from rotary_controller_python.utils.recorder import RecordingInstrument
+from rotary_controller_python.utils.rtu import RtuInstrument, RtuPort
+from rotary_controller_python.utils.shadow import ShadowMemory
+from rotary_controller_python.utils.transaction import WriteTransaction
 
 log = logging.getLogger(__name__)
+throttled_log = ThrottledLogger(log)
+
+# Transport of the boards when none is configured, for single boards and shared buses alike
+DEFAULT_TRANSPORT = "minimalmodbus"
+
 
 class DeviceManager:
+    # Seconds a caller waits for a blocking read queued on the comms engine
+    execute_timeout = 1.0
+
     def __init__(
-        self, serial_device="/dev/ttyUSB0", baudrate=57600, address=17, debug=False
+        self,
+        serial_device="/dev/ttyUSB0",
+        baudrate=57600,
+        address=17,
+        debug=False,
+        shadow_max_age=0.25,
+        transport=DEFAULT_TRANSPORT,
+        connect=True,
+        recorder=None,
+        name=None,
+        bus=None,
     ):
         from rotary_controller_python.utils.devices import (
             Global,
@@ -17,6 +45,10 @@ class DeviceManager:
             FastData,
         )
 
+        # Set by the CommsEngine when it takes ownership of the bus
+        self.engine = None
+        self._local = threading.local()
+
         self.addresses = GlobalAddresses(0)
         self.base = Global(device=self, base_address=self.addresses.base_address)
         self.index = Index(
@@ -34,17 +66,138 @@ class DeviceManager:
             device=self, base_address=self.scales[SCALES_COUNT - 1].addresses.end
         )
 
+        # Property getters are served from a block read image of the register map,
+        # a staleness budget of None disables the image and reads each value directly
+        self.shadow = None
+        if shadow_max_age is not None:
+            self.shadow = ShadowMemory(device=self, addresses=self.addresses, max_age=shadow_max_age)
+
+        self.serial_device = serial_device
+        self.baudrate = baudrate
+        self.address = address
+        self.debug = debug
+        self.transport = transport
+        # Every request of the instrument is recorded here, it survives reconnections
+        self.metrics = BusMetrics()
+        # A utils.recorder.SessionRecorder receiving the samples and the register writes
+        self.recorder = recorder
+        self.name = name if name is not None else f"slave-{address}"
+        # A utils.bus.SerialBus when the port is shared with other boards
+        self.bus = None
+        if bus is not None:
+            bus.add(self)
+        self.device = None
+        self.connected = False
+        if connect:
+            self.open()
+
+    def open(self) -> bool:
+        """
+        Create the instrument and open its serial port, closing any previous one. Failures are
+        logged and leave `device` unset, the comms engine calls this again while reconnecting.
+        On a shared bus the port is reopened for all the boards on it.
+        """
+        if self.bus is not None:
+            return self.bus.open() and self.device is not None
+
+        self.close()
         try:
-            self.device: minimalmodbus.Instrument = minimalmodbus.Instrument(
-                port=serial_device, slaveaddress=address, debug=debug
-            )
-            self.device.serial.timeout = 0.1
-            self.device.serial.write_timeout = 0.1
-            self.device.serial.baudrate = baudrate
-            self.connected = True
+            if self.transport == "rtu":
+                instrument = RtuInstrument(
+                    port=RtuPort(port=self.serial_device, baudrate=self.baudrate), slaveaddress=self.address
+                )
+            elif self.transport == "muxd":
+                # The port is owned by a utils.muxd daemon, serial_device is its socket
+                instrument = RtuInstrument(port=MuxPort(self.serial_device), slaveaddress=self.address)
+            else:
+                instrument = minimalmodbus.Instrument(
+                    port=self.serial_device, slaveaddress=self.address, debug=self.debug
+                )
+                instrument.serial.timeout = 0.1
+                instrument.serial.write_timeout = 0.1
+                instrument.serial.baudrate = self.baudrate
+            self.attach(instrument)
+        except Exception as e:
+            throttled_log.error(e.__str__())
+            self.detach()
+        return self.device is not None
+
+    def attach(self, instrument):
+        """Use an instrument whose port is already open"""
+        self.device = MeteredInstrument(instrument, self.metrics)
+        if self.recorder is not None:
+            self.device = RecordingInstrument(self.device, self.recorder)
+        self.connected = True
+
+    def detach(self):
+        self.device = None
+        self.connected = False
+
+    def close(self):
+        if self.device is None:
+            return
+        if self.bus is not None:
+            # The port stays open for the other boards, it is closed by the bus
+            self.detach()
+            return
+        try:
+            self.device.serial.close()
         except Exception as e:
             log.error(e.__str__())
-            self.connected = False
+        self.device = None
+        self.connected = False
+
+    def execute(self, fn, *args, **kwargs):
+        """
+        Run a bus operation and wait for its result. When a comms engine is attached the operation
+        is queued on the engine thread, so that the instrument is only ever used from one thread.
+        """
+        if self.engine is not None and self.engine.in_engine_thread():
+            return fn(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            if self.engine is None or not self.engine.running:
+                return fn(*args, **kwargs)
+            return self.engine.submit(fn, *args, **kwargs).result(timeout=self.execute_timeout)
+        finally:
+            # Only the calling thread updates its own total, no lock is needed
+            local = self._local
+            local.blocking_time = getattr(local, "blocking_time", 0.0) + time.perf_counter() - started
+
+    @property
+    def blocking_time(self) -> float:
+        """Seconds the calling thread spent waiting on the bus in execute, outside of the engine thread"""
+        return getattr(self._local, "blocking_time", 0.0)
+
+    @property
+    def active_transaction(self) -> WriteTransaction or None:
+        return getattr(self._local, "transaction", None)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Collect all the register writes issued in the block and commit them together when it exits,
+        nested blocks join the outermost transaction.
+        """
+        tx = self.active_transaction
+        if tx is None:
+            tx = WriteTransaction(device=self)
+            self._local.transaction = tx
+        tx.depth += 1
+        try:
+            yield tx
+        finally:
+            tx.depth -= 1
+            if tx.depth == 0:
+                self._local.transaction = None
+                self.post(tx.commit)
+
+    def post(self, fn, *args, **kwargs):
+        """Run a bus operation without waiting for it, used for writes coming from the UI."""
+        if self.engine is None or not self.engine.running:
+            fn(*args, **kwargs)
+            return
+        self.engine.submit(fn, *args, **kwargs)
 
 
 # def configure_device():
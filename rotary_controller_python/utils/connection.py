@@ -0,0 +1,32 @@
+import random
+
+# States of the link to the control board, in the order they are normally visited
+DISCONNECTED = "disconnected"
+PROBING = "probing"
+RESYNCING = "resyncing"
+LIVE = "live"
+
+STATES = (DISCONNECTED, PROBING, RESYNCING, LIVE)
+
+
+class Backoff:
+    """
+    Exponential delay between reconnection attempts, starting at `initial` seconds and growing
+    by `factor` up to `maximum`. A small random `jitter` fraction avoids retrying in lockstep
+    with a board that is rebooting on a fixed period.
+    """
+
+    def __init__(self, initial=0.25, maximum=5.0, factor=2.0, jitter=0.1):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next(self) -> float:
+        delay = min(self.maximum, self.initial * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def reset(self):
+        self.attempts = 0
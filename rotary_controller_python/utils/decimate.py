@@ -0,0 +1,68 @@
+"""
+Reduction of a series to about as many points as the pixels it is drawn on, so that the cost of
+drawing a plot does not depend on the number of samples in its window. Both methods return the
+indices of the samples to keep, in chronological order.
+"""
+import numpy as np
+
+
+def buckets_of(x: np.ndarray, count, start=None, end=None) -> np.ndarray:
+    """Bucket of each sample when [start, end] is split in `count` equal intervals"""
+    start = x[0] if start is None else start
+    end = x[-1] if end is None else end
+    if end <= start:
+        return np.zeros(len(x), dtype=np.int64)
+    buckets = ((x - start) * (count / (end - start))).astype(np.int64)
+    return np.clip(buckets, 0, count - 1)
+
+
+def minmax(x: np.ndarray, y: np.ndarray, count, start=None, end=None) -> np.ndarray:
+    """
+    The first, the last, the minimum and the maximum of each of `count` buckets. Drawn at one
+    bucket per pixel the result covers the same pixels as the whole series, spikes included.
+    """
+    if len(x) <= 4 * count:
+        return np.arange(len(x))
+    buckets = buckets_of(x, count, start, end)
+    # The samples are in time order, so each bucket is a contiguous run of them
+    starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+    lengths = np.diff(np.append(starts, len(x)))
+    selected = [starts, starts + lengths - 1]
+    for reduce in (np.minimum, np.maximum):
+        extremes = np.repeat(reduce.reduceat(y, starts), lengths)
+        hits = np.flatnonzero(y == extremes)
+        selected.append(hits[np.searchsorted(hits, starts)])
+    return np.unique(np.concatenate(selected))
+
+
+def lttb(x: np.ndarray, y: np.ndarray, count) -> np.ndarray:
+    """
+    Largest Triangle Three Buckets: keeps the first and the last sample plus, for each bucket in
+    between, the sample forming the largest triangle with the one kept before and the average of
+    the next bucket. Smoother than minmax, but it loops over the buckets so it is slower.
+    """
+    length = len(x)
+    if count >= length or count < 3:
+        return np.arange(length)
+
+    # Bucket edges over the samples between the first and the last one
+    edges = np.linspace(1, length - 1, count - 1).astype(np.int64)
+    selected = np.empty(count, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = length - 1
+    previous = 0
+    for i in range(count - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = length - 1, length
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[previous] - average_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (average_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas)) if len(areas) > 0 else start
+        selected[i + 1] = previous
+    return selected
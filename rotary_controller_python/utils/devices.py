@@ -1,4 +1,6 @@
 import struct
+import sys
+import time
 
 from rotary_controller_python.utils.addresses import FastDataAddresses, SCALES_COUNT
 from rotary_controller_python.utils.base_device import BaseDevice
@@ -110,7 +112,7 @@ class Servo(BaseDevice):
 
     @property
     def desired_steps(self):
-        return self.read_float(self.addresses.desired_steps)
+        return self.read_long(self.addresses.desired_steps)
 
     @property
     def ratio_num(self):
@@ -148,6 +150,10 @@ class Servo(BaseDevice):
     def breaking_space(self):
         return self.read_float(self.addresses.breaking_space)
 
+    @property
+    def breaking_time(self):
+        return self.read_float(self.addresses.breaking_time)
+
     @property
     def estimated_speed(self):
         return self.read_float(self.addresses.estimated_speed)
@@ -241,28 +247,125 @@ class Scale(BaseDevice):
         self.write_unsigned(self.addresses.sync_motion, int(value))
 
 
+class FastDataSample:
+    """Immutable snapshot of one fastData_t read, scale positions are converted to mm"""
+
+    __slots__ = ("timestamp", "servo_current", "servo_desired", "scale_current", "cycles")
+
+    def __init__(self, timestamp, servo_current, servo_desired, scale_current, cycles):
+        set_slot = object.__setattr__
+        set_slot(self, "timestamp", timestamp)
+        set_slot(self, "servo_current", servo_current)
+        set_slot(self, "servo_desired", servo_desired)
+        set_slot(self, "scale_current", scale_current)
+        set_slot(self, "cycles", cycles)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("FastDataSample is immutable")
+
+    def __repr__(self):
+        return (
+            f"FastDataSample(timestamp={self.timestamp}, servo_current={self.servo_current}, "
+            f"servo_desired={self.servo_desired}, scale_current={self.scale_current}, cycles={self.cycles})"
+        )
+
+
 class FastData(BaseDevice):
+    """
+    Reader of the fastData_t structure polled by the UI.
+
+    Register values are packed into a preallocated buffer and decoded with precompiled codecs
+    through a memoryview, so the decode path does not build any intermediate format string or
+    byte string. Each decode publishes a new immutable `FastDataSample` in `sample`.
+
+    The memory blocks each decode leaves allocated are counted with `sys.getallocatedblocks`, the
+    previous sample is released as the new one is published so `allocations_per_sample` stays at
+    zero unless the decode starts keeping objects alive. Both counters are also reported in the
+    metrics of the device.
+    """
+
     def __init__(self, device: DeviceManager, base_address: int):
         super().__init__(device=device)
-        from rotary_controller_python.utils.addresses import IndexAddresses
-
         self.addresses = FastDataAddresses(base_address)
-        self.scale_current = [0, 0, 0, 0]
-        self.servo_current = 0
-        self.servo_desired = 0
-        self.cycles = 0
         self.bytes_count = self.addresses.end - self.addresses.base_address
+        self.codec = self.addresses.schema.codec
+        self.registers_codec = struct.Struct(f"<{self.bytes_count}H")
+        self.buffer = bytearray(self.registers_codec.size)
+        self.view = memoryview(self.buffer)
+
+        self.samples_count = 0
+        self.sample = FastDataSample(0.0, 0, 0, (0,) * SCALES_COUNT, 0)
+        # Net count of memory blocks allocated by the decodes and still alive afterwards
+        self.retained_blocks = 0
+        # Decodes of a register response packed into the preallocated buffer
+        self.buffer_reuses = 0
+
+    @property
+    def allocations_per_sample(self):
+        if self.samples_count == 0:
+            return 0.0
+        return self.retained_blocks / self.samples_count
+
+    @property
+    def scale_current(self):
+        return self.sample.scale_current
+
+    @property
+    def servo_current(self):
+        return self.sample.servo_current
+
+    @property
+    def servo_desired(self):
+        return self.sample.servo_desired
+
+    @property
+    def cycles(self):
+        return self.sample.cycles
 
     def refresh(self):
-        raw_data = self.dm.device.read_registers(
+        device = self.dm.device
+        if hasattr(device, "read_registers_into"):
+            # The native transport writes the response straight into our buffer
+            device.read_registers_into(self.addresses.base_address, self.bytes_count, self.buffer)
+            return self.decode(self.view)
+
+        raw_data = device.read_registers(
             registeraddress=self.addresses.base_address,
             number_of_registers=int(self.bytes_count),
         )
-
-        raw_bytes = struct.pack("<" + "H" * int(self.bytes_count), *raw_data)
-        
-        converted_data = struct.unpack(self.addresses.struct_map, raw_bytes)
-        self.servo_current, self.servo_desired = converted_data[0:2]
-        for i in range(SCALES_COUNT):
-            self.scale_current[i] = converted_data[2 + i] / 1000
-        self.cycles = converted_data[2 + SCALES_COUNT]
+        return self.decode(raw_data)
+
+    def decode(self, raw_data) -> FastDataSample:
+        """Decode a fastData_t image, given as register values or as raw little endian bytes"""
+        # Measured around the whole decode, its temporaries are released by the time it returns
+        blocks = sys.getallocatedblocks()
+        self._decode(raw_data)
+        # The baseline reading is itself an int object, alive until the decode returns
+        retained = sys.getallocatedblocks() - blocks - 1
+        self.samples_count += 1
+        self.retained_blocks += retained
+        metrics = self.dm.metrics
+        metrics.count("fast_data_samples")
+        metrics.count("fast_data_retained_blocks", retained)
+        return self.sample
+
+    def _decode(self, raw_data):
+        if isinstance(raw_data, (bytes, bytearray, memoryview)):
+            view = raw_data
+        else:
+            if len(raw_data) != self.bytes_count:
+                # Unexpected response size, never happens with a well behaved transport
+                raise ValueError(f"Expected {self.bytes_count} registers, received {len(raw_data)}")
+            self.registers_codec.pack_into(self.buffer, 0, *raw_data)
+            view = self.view
+        if view is self.view:
+            self.buffer_reuses += 1
+
+        values = self.codec.unpack_from(view)
+        self.sample = FastDataSample(
+            time.monotonic(),
+            values[0],
+            values[1],
+            tuple([item / 1000 for item in values[2:2 + SCALES_COUNT]]),
+            values[2 + SCALES_COUNT],
+        )
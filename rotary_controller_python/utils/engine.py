@@ -0,0 +1,336 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+
+from rotary_controller_python.utils.communication import DeviceManager
+from rotary_controller_python.utils.connection import Backoff, DISCONNECTED, PROBING, RESYNCING, LIVE
+from rotary_controller_python.utils.history import SampleHistory
+from rotary_controller_python.utils.scheduler import PollScheduler, PollGroup, REALTIME
+from rotary_controller_python.utils.metrics import ThrottledLogger
+
+log = logging.getLogger(__name__)
+throttled_log = ThrottledLogger(log)
+
+
+class SlaveHealth:
+    """Consecutive failures and probe backoff of a board sharing the bus with the main one"""
+
+    def __init__(self, device: DeviceManager):
+        self.device = device
+        self.failures = 0
+        self.backoff = Backoff()
+        self.next_probe = 0.0
+
+    def reset(self):
+        self.failures = 0
+        self.backoff.reset()
+        self.next_probe = 0.0
+
+
+class CommsEngine:
+    """
+    Owns all the traffic on the serial bus of a DeviceManager.
+
+    The engine runs its own asyncio event loop in a background thread, the poll groups of its
+    scheduler, starting with the FastData realtime group, as well as any queued read or write
+    are executed there, so that the Kivy thread never waits for a modbus round trip. Finished
+    samples are published in `latest`, a plain attribute that the UI can read at any time
+    without locking.
+
+    The link goes through the states of `utils.connection`: while disconnected the engine probes
+    the board with a single register read, spaced by an exponential backoff, reopening the port
+    after `rebuild_after` failed probes. Once a probe answers the configuration is resynced and
+    the engine goes live, every transition is reported to `on_state_change(state)`.
+
+    Further boards sharing the port through a SerialBus are hosted with `attach`, their requests
+    go through the same thread and their poll groups, registered with their `slave` name, are
+    interleaved with those of the main board by the scheduler. Each of them has its own state in
+    `slave_states`: after `slave_failures` failed groups in a row the board is disconnected, its
+    groups are paused and it is probed again with its own backoff while the bus stays live, every
+    change is reported to `on_slave_state(name, state)`.
+    """
+
+    def __init__(
+        self,
+        device: DeviceManager,
+        poll_interval=1.0 / 30,
+        backoff: Backoff = None,
+        rebuild_after=3,
+        history_duration=600.0,
+        slave_failures=3,
+    ):
+        self.dm = device
+        self.dm.engine = self
+        self.dm.connected = False
+        # The main board first, its state drives the connection state of the whole bus
+        self.slaves = [device]
+        self.poll_interval = poll_interval
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.rebuild_after = rebuild_after
+        self.slave_failures = slave_failures
+        # State of each board attached after the main one, with its failures and next probe time
+        self.slave_states = dict()
+        self._slave_health = dict()
+        self.on_slave_state = None
+
+        self.latest = None
+        self.samples_count = 0
+        # Every sample is also kept in the history, for the consumers needing more than the latest
+        self.history = SampleHistory(duration=history_duration, rate=1.0 / poll_interval)
+        self.state = DISCONNECTED
+        self.failed_probes = 0
+        # Both callbacks run on the engine thread, `on_resync` returns False when it failed
+        self.on_state_change = None
+        self.on_resync = None
+
+        # The fast data is the realtime group, further groups are registered by the application
+        self.scheduler = PollScheduler(tick=poll_interval)
+        self.scheduler.on_result = self._group_result
+        self.scheduler.add(PollGroup("fast_data", REALTIME, self._poll, slave=device.name))
+        self._queue_time = 0.0
+
+        self.loop: asyncio.AbstractEventLoop or None = None
+        self.thread: threading.Thread or None = None
+        self._queue: asyncio.Queue or None = None
+        self._task: asyncio.Task or None = None
+        self._running = False
+        self._started = threading.Event()
+
+    @property
+    def running(self):
+        return self._running
+
+    def attach(self, device: DeviceManager, weight=1.0) -> DeviceManager:
+        """Host another board of the same bus, `weight` is its relative share of the spare bandwidth"""
+        device.engine = self
+        device.connected = False
+        self.slaves = self.slaves + [device]
+        self.slave_states[device.name] = DISCONNECTED
+        self._slave_health[device.name] = SlaveHealth(device)
+        self.scheduler.set_weight(device.name, weight)
+        self.scheduler.paused.add(device.name)
+        return device
+
+    def shares(self) -> dict:
+        """Fraction of the recent wall time each board kept the bus busy"""
+        return {device.name: device.metrics.rates()[1] for device in self.slaves}
+
+    def in_engine_thread(self) -> bool:
+        return self.thread is not None and threading.current_thread() is self.thread
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._started.clear()
+        self.thread = threading.Thread(target=self._run, name="comms-engine", daemon=True)
+        self.thread.start()
+        self._started.wait()
+
+    def stop(self, timeout=2.0):
+        if not self._running:
+            return
+        self._running = False
+        self.loop.call_soon_threadsafe(self._task.cancel)
+        self.thread.join(timeout)
+
+    def submit(self, fn, *args, **kwargs) -> concurrent.futures.Future:
+        """
+        Queue a bus operation on the engine thread and return a future for its result.
+        When called from the engine thread itself the operation is executed immediately.
+        """
+        future = concurrent.futures.Future()
+        if self.in_engine_thread() or not self._running:
+            self._execute(future, fn, args, kwargs)
+            return future
+
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, (future, fn, args, kwargs))
+        return future
+
+    def request(self, fn, callback, *args, **kwargs):
+        """
+        Queue a bus operation and call `callback(result)` once it is complete, exceptions
+        are logged and the callback is not invoked. The callback runs in the engine thread,
+        UI code should reschedule it with `Clock.schedule_once`.
+        """
+        def done(future: concurrent.futures.Future):
+            try:
+                result = future.result()
+            except Exception as e:
+                throttled_log.error(f"Request failed: {e.__str__()}")
+                return
+            callback(result)
+
+        self.submit(fn, *args, **kwargs).add_done_callback(done)
+
+    @staticmethod
+    def _execute(future, fn, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._queue = asyncio.Queue()
+        self._task = self.loop.create_task(self._poll_loop())
+        self._started.set()
+        try:
+            self.loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    async def _drain_queue(self, deadline):
+        """Execute queued operations until the next poll is due."""
+        while True:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                # Never starve queued writes, even when polling is late
+                started = time.perf_counter()
+                while not self._queue.empty():
+                    self._execute(*self._queue.get_nowait())
+                self._queue_time += time.perf_counter() - started
+                return
+            try:
+                job = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return
+            started = time.perf_counter()
+            self._execute(*job)
+            self._queue_time += time.perf_counter() - started
+
+    def _poll(self):
+        self.latest = self.dm.fast_data.refresh()
+        self.history.append(self.latest)
+        self.samples_count += 1
+        if self.dm.recorder is not None:
+            self.dm.recorder.record_sample(self.latest)
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        # Failed probes repeat for as long as the board is away, keep them out of the log
+        level = logging.DEBUG if PROBING in (self.state, state) and LIVE != state else logging.INFO
+        log.log(level, f"Connection {self.state} -> {state}")
+        self.state = state
+        self.dm.connected = state == LIVE
+        for health in self._slave_health.values():
+            # Boards found answering with the main one, failing ones are then probed on their own
+            health.reset()
+            self._set_slave_state(health.device, LIVE if state == LIVE else DISCONNECTED)
+        if self.on_state_change is not None:
+            try:
+                self.on_state_change(state)
+            except Exception as e:
+                log.error(e.__str__())
+
+    def _set_slave_state(self, device, state):
+        if self.slave_states.get(device.name) == state:
+            return
+        log.info(f"Slave {device.name} {self.slave_states.get(device.name)} -> {state}")
+        self.slave_states[device.name] = state
+        device.connected = state == LIVE
+        if state == LIVE:
+            self.scheduler.paused.discard(device.name)
+        else:
+            self.scheduler.paused.add(device.name)
+        if self.on_slave_state is not None:
+            try:
+                self.on_slave_state(device.name, state)
+            except Exception as e:
+                log.error(e.__str__())
+
+    def _group_result(self, group, error):
+        health = self._slave_health.get(group.slave)
+        if health is None:
+            # Failures of the main board are handled by the connection state of the bus
+            return
+        if error is None:
+            health.failures = 0
+            return
+        health.failures += 1
+        if health.failures >= self.slave_failures and self.slave_states[group.slave] == LIVE:
+            health.next_probe = time.monotonic() + health.backoff.next()
+            self._set_slave_state(health.device, DISCONNECTED)
+
+    def _probe_slaves(self):
+        """Probe the boards that stopped answering while the bus is live, each with its own backoff"""
+        now = time.monotonic()
+        for name, health in self._slave_health.items():
+            if self.slave_states[name] == LIVE or now < health.next_probe:
+                continue
+            device = health.device
+            try:
+                device.device.read_registers(registeraddress=device.addresses.base_address, number_of_registers=1)
+            except Exception as e:
+                log.debug(f"Probe of slave {name} failed: {e.__str__()}")
+                health.next_probe = now + health.backoff.next()
+                continue
+            if device.shadow is not None:
+                device.shadow.invalidate_all()
+            health.reset()
+            self._set_slave_state(device, LIVE)
+
+    def _probe(self):
+        """The cheapest request the board answers, reopening the port when it looks stuck"""
+        if self.dm.device is None or self.failed_probes >= self.rebuild_after:
+            self.failed_probes = 0
+            if not self.dm.open():
+                raise ConnectionError(f"Unable to open {self.dm.serial_device}")
+        self.dm.device.read_registers(registeraddress=self.dm.addresses.base_address, number_of_registers=1)
+
+    def _resync(self):
+        """Bring the board and the local state in agreement, once per reconnection"""
+        for device in self.slaves:
+            if device.shadow is not None:
+                device.shadow.invalidate_all()
+        if self.on_resync is not None and self.on_resync() is False:
+            raise ConnectionError("Configuration resync failed")
+        self._poll()
+
+    def _connect(self):
+        self._set_state(PROBING)
+        try:
+            self._probe()
+        except Exception as e:
+            self.failed_probes += 1
+            log.debug(f"Probe failed: {e.__str__()}")
+            self._set_state(DISCONNECTED)
+            return
+
+        self.failed_probes = 0
+        self._set_state(RESYNCING)
+        try:
+            self._resync()
+        except Exception as e:
+            throttled_log.error(f"Resync failed: {e.__str__()}")
+            self._set_state(DISCONNECTED)
+            return
+
+        self.backoff.reset()
+        self._set_state(LIVE)
+
+    async def _poll_loop(self):
+        while self._running:
+            started = self.loop.time()
+            if self.state == LIVE:
+                try:
+                    # Queued operations of the previous tick count against the bus budget
+                    self.scheduler.run(reserved=self._queue_time)
+                    self._probe_slaves()
+                except Exception as e:
+                    log.error(f"Connection lost: {e.__str__()}")
+                    self._set_state(DISCONNECTED)
+            else:
+                self._connect()
+
+            interval = self.poll_interval if self.state == LIVE else self.backoff.next()
+            self._queue_time = 0.0
+            await self._drain_queue(started + interval)
@@ -0,0 +1,156 @@
+"""
+Time spent in the callbacks scheduled on the kivy Clock, measured against the frame budget, to find
+which of them makes the interface stutter. The kv rules bound to the properties set by a callback
+run inside it, so their cost is accounted to that callback; the drawing of the window is accounted
+to a separate `draw` entry.
+"""
+import json
+import logging
+import time
+
+from rotary_controller_python.utils.metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+# 30 frames per second
+FRAME_BUDGET = 1 / 30
+# Upper bounds in seconds of the duration buckets, the last bucket collects everything slower
+DURATION_BOUNDS = (0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.016, 0.033, 0.05, 0.1, 0.25, 0.5)
+DRAW = "draw"
+
+
+class CallbackStats:
+    """Durations of one callback, and the part of them spent waiting for the serial bus"""
+
+    def __init__(self, name):
+        self.name = name
+        self.duration = Histogram(DURATION_BOUNDS)
+        self.bus = Histogram(DURATION_BOUNDS)
+        self.overruns = 0
+
+    def record(self, duration, bus_time, budget):
+        self.duration.record(duration)
+        self.bus.record(bus_time)
+        if duration > budget:
+            self.overruns += 1
+
+    def to_dict(self) -> dict:
+        return dict(duration=self.duration.to_dict(), bus=self.bus.to_dict(), overruns=self.overruns)
+
+
+class FrameProfiler:
+    """
+    Opt-in instrumentation of the Clock callbacks. Callbacks scheduled through `schedule_interval`
+    and `schedule_once` are wrapped only while the profiler is enabled, otherwise they are handed to
+    the Clock unchanged. `bus_time` returns the seconds spent so far by the UI thread waiting on the
+    bus, it is sampled around each callback to report the modbus time separately.
+    """
+
+    def __init__(self, budget=FRAME_BUDGET, bus_time=None):
+        self.budget = budget
+        self.bus_time = bus_time
+        self.enabled = False
+        self.callbacks = dict()
+        self.frames = Histogram(DURATION_BOUNDS)
+        self.frame_overruns = 0
+        self.started = time.perf_counter()
+        self._draw_started = None
+        self._last_flip = None
+
+    def enable(self):
+        """Start measuring, the callbacks already scheduled are not wrapped afterwards"""
+        from kivy.core.window import Window
+
+        if self.enabled:
+            return
+        self.enabled = True
+        Window.bind(on_draw=self._on_draw, on_flip=self._on_flip)
+        log.info(f"Frame profiling enabled, budget {self.budget * 1000:.1f}ms")
+
+    def stats(self, name) -> CallbackStats:
+        stats = self.callbacks.get(name)
+        if stats is None:
+            stats = CallbackStats(name)
+            self.callbacks[name] = stats
+        return stats
+
+    def wrap(self, callback, name=None):
+        if not self.enabled:
+            return callback
+        if name is None:
+            name = callback.__name__
+        self.stats(name)
+
+        def measured(*args):
+            bus_started = self.bus_time() if self.bus_time is not None else 0.0
+            started = time.perf_counter()
+            try:
+                return callback(*args)
+            finally:
+                duration = time.perf_counter() - started
+                bus_time = self.bus_time() - bus_started if self.bus_time is not None else 0.0
+                self.stats(name).record(duration, bus_time, self.budget)
+
+        return measured
+
+    def schedule_interval(self, callback, timeout, name=None):
+        from kivy.clock import Clock
+
+        return Clock.schedule_interval(self.wrap(callback, name), timeout)
+
+    def schedule_once(self, callback, timeout=0, name=None):
+        from kivy.clock import Clock
+
+        return Clock.schedule_once(self.wrap(callback, name), timeout)
+
+    def _on_draw(self, *args):
+        # Bound handlers run before the window draws its canvas in the default handler
+        self._draw_started = time.perf_counter()
+
+    def _on_flip(self, *args):
+        now = time.perf_counter()
+        if self._draw_started is not None:
+            self.stats(DRAW).record(now - self._draw_started, 0.0, self.budget)
+            self._draw_started = None
+        if self._last_flip is not None:
+            interval = now - self._last_flip
+            self.frames.record(interval)
+            if interval > self.budget:
+                self.frame_overruns += 1
+        self._last_flip = now
+
+    def reset(self):
+        self.callbacks = {name: CallbackStats(name) for name in self.callbacks}
+        self.frames = Histogram(DURATION_BOUNDS)
+        self.frame_overruns = 0
+        self.started = time.perf_counter()
+
+    def to_dict(self) -> dict:
+        return dict(
+            enabled=self.enabled,
+            budget=self.budget,
+            duration=time.perf_counter() - self.started,
+            frames=dict(interval=self.frames.to_dict(), overruns=self.frame_overruns),
+            callbacks={name: stats.to_dict() for name, stats in sorted(self.callbacks.items())},
+        )
+
+    def report(self) -> str:
+        lines = [
+            f"Frames: {self.frames.count}  p99 {min(self.frames.percentile(0.99), self.frames.maximum) * 1000:.1f}ms  "
+            f"max {self.frames.maximum * 1000:.1f}ms  over budget {self.frame_overruns}",
+            f"{'callback':<24}{'calls':>8}{'mean':>8}{'p99':>8}{'max':>8}{'bus':>8}{'over':>6}",
+        ]
+        ordered = sorted(self.callbacks.values(), key=lambda s: s.duration.total, reverse=True)
+        for stats in ordered:
+            lines.append(
+                f"{stats.name[:23]:<24}{stats.duration.count:>8}"
+                f"{stats.duration.mean * 1000:>8.2f}{min(stats.duration.percentile(0.99), stats.duration.maximum) * 1000:>8.1f}"
+                f"{stats.duration.maximum * 1000:>8.1f}{stats.bus.mean * 1000:>8.2f}"
+                f"{stats.overruns:>6}"
+            )
+        return "\n".join(lines)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        log.info(f"Frame timings written to {path}")
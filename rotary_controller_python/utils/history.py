@@ -0,0 +1,121 @@
+"""
+Fixed memory history of the FastData samples, shared by the speed estimation, the plots and the
+diagnostics instead of each widget keeping its own queue of values.
+"""
+import threading
+
+import numpy as np
+
+from rotary_controller_python.utils.addresses import SCALES_COUNT
+
+# Column of each value in the rows of the history
+TIMESTAMP = 0
+CYCLES = 1
+SCALES = slice(2, 2 + SCALES_COUNT)
+SERVO_CURRENT = 2 + SCALES_COUNT
+SERVO_DESIRED = 3 + SCALES_COUNT
+
+COLUMNS = ["timestamp", "cycles"] + [f"scale_{i}" for i in range(SCALES_COUNT)] + ["servo_current", "servo_desired"]
+
+
+def scale_column(index) -> int:
+    return SCALES.start + index
+
+
+class SampleHistory:
+    """
+    Ring buffer holding the last `duration` seconds of samples at the given poll `rate`.
+
+    Each row holds the host timestamp, the firmware cycles counter, the scale positions in mm and
+    the servo current and desired positions, see the column constants of this module. Samples are
+    appended by the comms engine and queried from the UI, queries return chronologically ordered
+    copies so the caller never sees a row being overwritten.
+    """
+
+    def __init__(self, duration=600.0, rate=30.0):
+        self.capacity = int(duration * rate)
+        self.data = np.zeros((self.capacity, len(COLUMNS)), dtype=np.float64)
+        # Index of the next row to be written and total number of rows ever appended
+        self.head = 0
+        self.appended = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.appended, self.capacity)
+
+    def append(self, sample):
+        with self._lock:
+            row = self.data[self.head]
+            row[TIMESTAMP] = sample.timestamp
+            row[CYCLES] = sample.cycles
+            row[SCALES] = sample.scale_current
+            row[SERVO_CURRENT] = sample.servo_current
+            row[SERVO_DESIRED] = sample.servo_desired
+            self.head = (self.head + 1) % self.capacity
+            self.appended += 1
+
+    def clear(self):
+        with self._lock:
+            self.head = 0
+            self.appended = 0
+
+    def _segments(self):
+        """The stored rows as two chronologically ordered views, older first"""
+        if self.appended < self.capacity:
+            return self.data[0:0], self.data[:self.head]
+        return self.data[self.head:], self.data[:self.head]
+
+    def _tail(self, count) -> np.ndarray:
+        older, newer = self._segments()
+        count = min(count, len(older) + len(newer))
+        if count <= len(newer):
+            return newer[len(newer) - count:].copy()
+        return np.concatenate((older[len(older) - (count - len(newer)):], newer))
+
+    def latest(self, count) -> np.ndarray:
+        """The last `count` samples"""
+        with self._lock:
+            return self._tail(count)
+
+    def between(self, start, end=None) -> np.ndarray:
+        """Samples with a timestamp in [start, end], end defaults to the latest sample"""
+        with self._lock:
+            older, newer = self._segments()
+            count = sum(len(part) - np.searchsorted(part[:, TIMESTAMP], start, side="left") for part in (older, newer))
+            rows = self._tail(int(count))
+        if end is not None:
+            rows = rows[rows[:, TIMESTAMP] <= end]
+        return rows
+
+    def window(self, seconds) -> np.ndarray:
+        """Samples of the last `seconds`, measured from the latest sample"""
+        with self._lock:
+            if self.appended == 0:
+                return self.data[0:0].copy()
+            last = self.data[self.head - 1, TIMESTAMP]
+        return self.between(last - seconds)
+
+    def column(self, name, seconds) -> np.ndarray:
+        return self.window(seconds)[:, COLUMNS.index(name)]
+
+    def mean(self, seconds) -> np.ndarray:
+        """Mean of each column over the last `seconds`, NaN when there are no samples"""
+        rows = self.window(seconds)
+        return rows.mean(axis=0) if len(rows) > 0 else np.full(len(COLUMNS), np.nan)
+
+    def minimum(self, seconds) -> np.ndarray:
+        rows = self.window(seconds)
+        return rows.min(axis=0) if len(rows) > 0 else np.full(len(COLUMNS), np.nan)
+
+    def maximum(self, seconds) -> np.ndarray:
+        rows = self.window(seconds)
+        return rows.max(axis=0) if len(rows) > 0 else np.full(len(COLUMNS), np.nan)
+
+    def deltas(self, seconds) -> np.ndarray:
+        """Differences between consecutive samples of the last `seconds`"""
+        return np.diff(self.window(seconds), axis=0)
+
+    def change(self, seconds) -> np.ndarray:
+        """Difference between the newest and the oldest sample of the last `seconds`"""
+        rows = self.window(seconds)
+        return rows[-1] - rows[0] if len(rows) > 1 else np.zeros(len(COLUMNS))
@@ -0,0 +1,83 @@
+"""
+Reading the end of a log file without loading all of it: blocks are read backwards from a given
+offset until enough lines are collected, and a LogTail returns the lines appended since its last
+read, so the cost depends on the lines shown and not on the size of the file.
+"""
+import os
+import re
+
+BLOCK_SIZE = 16384
+
+LEVELS = ["TRACE", "DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+LEVEL_PATTERN = re.compile(r"\b(TRACE|DEBUG|INFO|WARNING|ERROR|CRITICAL)\b")
+
+
+def decode(raw: bytes) -> str:
+    return raw.decode("utf-8", errors="replace")
+
+
+def read_lines_before(path, end, count, block_size=BLOCK_SIZE) -> tuple:
+    """
+    The last `count` complete lines ending at byte `end` of the file, and the offset where the
+    first of them starts. An offset of zero means the beginning of the file was reached.
+    """
+    chunks = []
+    newlines = 0
+    position = end
+    with open(path, "rb") as f:
+        # One more newline than lines is needed to know where the first line starts
+        while position > 0 and newlines <= count:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            chunk = f.read(size)
+            chunks.append(chunk)
+            newlines += chunk.count(b"\n")
+
+    data = b"".join(reversed(chunks))
+    lines = data.split(b"\n")
+    if data.endswith(b"\n"):
+        lines.pop()
+    if len(lines) > count:
+        skipped = lines[:len(lines) - count]
+        position += sum(len(line) + 1 for line in skipped)
+        lines = lines[len(lines) - count:]
+    return [decode(line) for line in lines], position
+
+
+def level_of(line, previous=None) -> str or None:
+    """Level named in a log line, continuation lines such as tracebacks keep the previous one"""
+    match = LEVEL_PATTERN.search(line, 0, 80)
+    return match.group(1) if match is not None else previous
+
+
+class LogTail:
+    """Follows a growing file from `offset`, starting over when it is truncated or replaced"""
+
+    def __init__(self, path, offset=None):
+        self.path = path
+        self.offset = os.path.getsize(path) if offset is None else offset
+        self.inode = os.stat(path).st_ino
+        self.partial = b""
+        # Count of the times the file was truncated or replaced
+        self.restarts = 0
+
+    def read_new(self, limit=1024 * 1024) -> list:
+        """Complete lines appended since the previous call, at most `limit` bytes are read"""
+        stat = os.stat(self.path)
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.inode = stat.st_ino
+            self.offset = 0
+            self.partial = b""
+            self.restarts += 1
+        if stat.st_size == self.offset:
+            return []
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(min(limit, stat.st_size - self.offset))
+        self.offset += len(data)
+        lines = (self.partial + data).split(b"\n")
+        # The last item is the beginning of a line still being written
+        self.partial = lines.pop()
+        return [decode(line) for line in lines]
@@ -0,0 +1,267 @@
+"""
+Health telemetry of the serial link: latency histograms per modbus function code, error counters,
+throughput and bus utilisation, plus a logger wrapper that keeps repeated errors out of the log.
+"""
+import bisect
+import collections
+import json
+import logging
+import threading
+import time
+
+import minimalmodbus
+
+from rotary_controller_python.utils import rtu
+
+log = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency buckets, the last bucket collects everything slower
+LATENCY_BOUNDS = (0.001, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+# Function code of each instrument method, used when the call does not pass one explicitly
+METHOD_FUNCTION_CODES = {
+    "read_registers": 3,
+    "read_registers_into": 3,
+    "read_register": 3,
+    "read_long": 3,
+    "read_float": 3,
+    "write_registers": 16,
+    "write_register": 16,
+    "write_long": 16,
+    "write_float": 16,
+}
+
+TIMEOUT_ERRORS = (minimalmodbus.NoResponseError, rtu.NoResponseError)
+SLAVE_ERRORS = (minimalmodbus.SlaveReportedException, rtu.SlaveReportedException)
+
+
+class Histogram:
+    """Fixed bucket latency histogram, cheap enough to be updated on every request"""
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def percentile(self, fraction) -> float:
+        """Upper bound of the bucket holding the given fraction of the samples"""
+        if self.count == 0:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return self.bounds[i] if i < len(self.bounds) else self.maximum
+        return self.maximum
+
+    def to_dict(self):
+        return dict(
+            count=self.count,
+            mean=self.mean,
+            p50=self.percentile(0.5),
+            p99=self.percentile(0.99),
+            max=self.maximum,
+            buckets={
+                (f"<={bound * 1000:g}ms" if i < len(self.bounds) else "slower"): count
+                for i, (bound, count) in enumerate(zip(self.bounds + (None,), self.buckets))
+            },
+        )
+
+
+class BusMetrics:
+    """
+    Counters of all the requests going through the serial link. Updated by the thread owning the
+    bus, read by the UI, so every access goes through a lock.
+    """
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self.started = time.monotonic()
+        self.histograms = dict()
+        self.counters = collections.Counter()
+        self.errors = collections.Counter()
+        # (end time, duration) of the requests completed in the last `window` seconds
+        self._recent = collections.deque()
+        self._lock = threading.Lock()
+
+    def record(self, function_code, duration, error: Exception or None = None):
+        now = time.monotonic()
+        with self._lock:
+            histogram = self.histograms.get(function_code)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[function_code] = histogram
+            histogram.record(duration)
+            self.counters["requests"] += 1
+            if error is not None:
+                self.counters["failures"] += 1
+                self.errors[type(error).__name__] += 1
+            self._recent.append((now, duration))
+            self._expire(now)
+
+    def count(self, name, value=1):
+        if value == 0:
+            return
+        with self._lock:
+            self.counters[name] += value
+
+    def _expire(self, now):
+        while len(self._recent) > 0 and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+
+    def rates(self) -> tuple:
+        """Transactions per second and fraction of time the bus was busy, over the recent window"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            span = min(self.window, now - self.started)
+            if span <= 0:
+                return 0.0, 0.0
+            busy = sum(duration for _, duration in self._recent)
+            return len(self._recent) / span, min(1.0, busy / span)
+
+    def summary(self) -> dict:
+        """The few numbers shown in the status bar"""
+        tps, utilisation = self.rates()
+        with self._lock:
+            histogram = self.histograms.get(3)
+            samples = self.counters["fast_data_samples"]
+            return dict(
+                tps=tps,
+                utilisation=utilisation,
+                read_p99=histogram.percentile(0.99) if histogram is not None else 0.0,
+                failures=self.counters["failures"],
+                # Memory blocks kept alive by each fast data decode, expected to stay at zero
+                allocations_per_sample=self.counters["fast_data_retained_blocks"] / samples if samples > 0 else 0.0,
+            )
+
+    def to_dict(self) -> dict:
+        tps, utilisation = self.rates()
+        with self._lock:
+            return dict(
+                uptime=time.monotonic() - self.started,
+                tps=tps,
+                utilisation=utilisation,
+                counters=dict(self.counters),
+                errors=dict(self.errors),
+                latency={f"fc{code}": histogram.to_dict() for code, histogram in sorted(self.histograms.items())},
+            )
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        log.info(f"Communication metrics written to {path}")
+
+
+class MeteredInstrument:
+    """
+    Wraps a minimalmodbus.Instrument or an RtuInstrument and records every call into a BusMetrics,
+    any other attribute is forwarded to the wrapped instrument.
+    """
+
+    def __init__(self, instrument, metrics: BusMetrics):
+        self.instrument = instrument
+        self.metrics = metrics
+        self._methods = dict()
+        # The native transport counts the retried attempts itself, they are copied as deltas
+        self._port = getattr(instrument, "port", None) if isinstance(instrument, rtu.RtuInstrument) else None
+        self._port_counters = self._read_port_counters()
+
+    def __getattr__(self, name):
+        value = getattr(self.instrument, name)
+        if name not in METHOD_FUNCTION_CODES:
+            return value
+        method = self._methods.get(name)
+        if method is None:
+            method = self._metered(name, value)
+            self._methods[name] = method
+        return method
+
+    def _read_port_counters(self):
+        if self._port is None:
+            return None
+        return dict(
+            retries=self._port.retries_count,
+            timeouts=self._port.timeouts_count,
+            crc_errors=self._port.crc_errors_count,
+        )
+
+    def _metered(self, name, method):
+        default_code = METHOD_FUNCTION_CODES[name]
+
+        def call(*args, **kwargs):
+            function_code = kwargs.get("functioncode", default_code)
+            started = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                self.metrics.record(function_code, time.perf_counter() - started, e)
+                self._count_errors(e)
+                raise
+            self.metrics.record(function_code, time.perf_counter() - started)
+            self._count_errors(None)
+            return result
+
+        return call
+
+    def _count_errors(self, error):
+        if self._port is not None:
+            counters = self._read_port_counters()
+            for key, value in counters.items():
+                self.metrics.count(key, value - self._port_counters[key])
+            self._port_counters = counters
+        elif error is not None:
+            # minimalmodbus does not retry, every failed call is a single failed attempt
+            if isinstance(error, TIMEOUT_ERRORS):
+                self.metrics.count("timeouts")
+            elif "Checksum error" in str(error):
+                self.metrics.count("crc_errors")
+        if isinstance(error, SLAVE_ERRORS):
+            self.metrics.count("slave_exceptions")
+
+
+class ThrottledLogger:
+    """
+    Logs each distinct message at most once every `interval` seconds, repetitions are counted and
+    reported with the next occurrence that gets through.
+    """
+
+    def __init__(self, logger, interval=10.0, max_messages=256):
+        self.logger = logger
+        self.interval = interval
+        self.max_messages = max_messages
+        self._messages = dict()
+        self._lock = threading.Lock()
+
+    def log(self, level, message):
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._messages.get(message, (None, 0))
+            if last is not None and now - last < self.interval:
+                self._messages[message] = (last, suppressed + 1)
+                return
+            if len(self._messages) >= self.max_messages:
+                self._messages.clear()
+            self._messages[message] = (now, 0)
+        if suppressed > 0:
+            message = f"{message} (repeated {suppressed} times)"
+        self.logger.log(level, message)
+
+    def error(self, message):
+        self.log(logging.ERROR, message)
+
+    def warning(self, message):
+        self.log(logging.WARNING, message)
@@ -0,0 +1,417 @@
+"""
+Serial port multiplexer: a daemon owning the serial port of the control board and serving Modbus
+requests to any number of local clients, so the UI, test.py and diagnostic scripts can share the
+bus without corrupting each other's frames::
+
+    python -m rotary_controller_python.utils.muxd --port /dev/serial0 --socket /tmp/rotary-muxd.sock
+
+Clients connect to the Unix socket or to the TCP port and speak Modbus TCP: an MBAP header with
+the slave address as unit id, followed by the request PDU. Reads of holding registers refreshed on
+the bus less than `max_age` seconds ago are answered from a cache, identical reads waiting for the
+bus share one request and everything else goes through a single queue, in order of arrival.
+
+The application connects with the "muxd" transport and the socket path, or host:port, as its
+serial port, scripts can use `RtuInstrument(MuxPort(path), 17)` or any Modbus TCP tool.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import logging
+import os
+import socket
+import struct
+import time
+
+from rotary_controller_python.utils import rtu
+from rotary_controller_python.utils.metrics import ThrottledLogger
+
+log = logging.getLogger(__name__)
+throttled_log = ThrottledLogger(log)
+
+# Transaction id, protocol id, length of the unit id and the PDU, unit id
+MBAP = struct.Struct(">HHHB")
+MAX_PDU = 253
+MAX_READ_REGISTERS = 125
+MAX_WRITE_REGISTERS = 123
+
+READ_HOLDING_REGISTERS = rtu.READ_HOLDING_REGISTERS
+READ_INPUT_REGISTERS = 4
+WRITE_SINGLE_REGISTER = 6
+WRITE_MULTIPLE_REGISTERS = rtu.WRITE_MULTIPLE_REGISTERS
+
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+ILLEGAL_DATA_VALUE = 0x03
+SERVER_DEVICE_FAILURE = 0x04
+GATEWAY_PATH_UNAVAILABLE = 0x0A
+GATEWAY_TARGET_FAILED = 0x0B
+
+DEFAULT_SOCKET = "/tmp/rotary-muxd.sock"
+DEFAULT_TCP_PORT = 5020
+
+
+def check_request(pdu: bytes) -> int or None:
+    """Exception code a request PDU must be answered with without reaching the bus, None if it is valid"""
+    function = pdu[0]
+    if function in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+        if len(pdu) != 5:
+            return ILLEGAL_DATA_VALUE
+        address, count = struct.unpack_from(">HH", pdu, 1)
+        if not 1 <= count <= MAX_READ_REGISTERS:
+            return ILLEGAL_DATA_VALUE
+        if address + count > 0x10000:
+            return ILLEGAL_DATA_ADDRESS
+        return None
+    if function == WRITE_SINGLE_REGISTER:
+        return None if len(pdu) == 5 else ILLEGAL_DATA_VALUE
+    if function == WRITE_MULTIPLE_REGISTERS:
+        if len(pdu) < 6:
+            return ILLEGAL_DATA_VALUE
+        address, count, size = struct.unpack_from(">HHB", pdu, 1)
+        if not 1 <= count <= MAX_WRITE_REGISTERS or size != 2 * count or len(pdu) != 6 + size:
+            return ILLEGAL_DATA_VALUE
+        if address + count > 0x10000:
+            return ILLEGAL_DATA_ADDRESS
+        return None
+    return ILLEGAL_FUNCTION
+
+
+def response_length(pdu: bytes) -> int or None:
+    """Length of the RTU response frame to a request PDU, None for the invalid or unsupported ones"""
+    if check_request(pdu) is not None:
+        return None
+    if pdu[0] in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+        return 5 + 2 * struct.unpack_from(">H", pdu, 3)[0]
+    return 8
+
+
+def exception_pdu(function, code) -> bytes:
+    return bytes((function | 0x80, code))
+
+
+def written_range(pdu: bytes) -> tuple or None:
+    """First register and count changed by a write request"""
+    if pdu[0] == WRITE_SINGLE_REGISTER:
+        return struct.unpack_from(">H", pdu, 1)[0], 1
+    if pdu[0] == WRITE_MULTIPLE_REGISTERS:
+        return struct.unpack_from(">HH", pdu, 1)
+    return None
+
+
+class RegisterCache:
+    """
+    The last value read from the bus of every register of each slave, with the time it was read.
+    A read is answered only when all its registers are younger than `max_age`.
+
+    Only registers a slave actually answered with are stored, requests for other unit ids or
+    addresses do not grow the cache.
+    """
+
+    def __init__(self, max_age=0.05):
+        self.max_age = max_age
+        # (unit, function, address) -> (value, time it was read)
+        self._registers = dict()
+
+    def __len__(self):
+        return len(self._registers)
+
+    def lookup(self, unit, function, address, count, now) -> bytes or None:
+        oldest = now - self.max_age
+        values = []
+        for register in range(address, address + count):
+            entry = self._registers.get((unit, function, register))
+            if entry is None or entry[1] < oldest:
+                return None
+            values.append(entry[0])
+        return struct.pack(f">{count}H", *values)
+
+    def store(self, unit, function, address, data: bytes, now):
+        values = struct.unpack(f">{len(data) // 2}H", data)
+        for i, value in enumerate(values):
+            self._registers[(unit, function, address + i)] = (value, now)
+
+    def invalidate(self, unit, address, count):
+        for function in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+            for register in range(address, address + count):
+                self._registers.pop((unit, function, register), None)
+
+
+class Multiplexer:
+    """
+    Owner of the serial port. Client connections are served by an asyncio loop, the bus requests
+    run one at a time on a single worker thread whose queue keeps them in order of arrival.
+    """
+
+    def __init__(
+        self,
+        serial_device="/dev/serial0",
+        baudrate=57600,
+        max_age=0.05,
+        socket_path=DEFAULT_SOCKET,
+        host="127.0.0.1",
+        tcp_port=DEFAULT_TCP_PORT,
+    ):
+        self.serial_device = serial_device
+        self.baudrate = baudrate
+        self.socket_path = socket_path
+        self.host = host
+        self.tcp_port = tcp_port
+        self.cache = RegisterCache(max_age=max_age)
+        self.port = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="muxd-bus")
+        self.servers = []
+        self.clients = 0
+        self._pending = dict()
+
+        self.requests_count = 0
+        self.cache_hits = 0
+        self.coalesced_count = 0
+        self.bus_requests = 0
+
+    def open_port(self) -> bool:
+        if self.port is not None:
+            return True
+        try:
+            self.port = rtu.RtuPort(port=self.serial_device, baudrate=self.baudrate)
+            log.info(f"Opened {self.serial_device} at {self.baudrate} baud")
+        except Exception as e:
+            throttled_log.error(e.__str__())
+        return self.port is not None
+
+    def close_port(self):
+        if self.port is None:
+            return
+        try:
+            self.port.close()
+        except Exception as e:
+            log.error(e.__str__())
+        self.port = None
+
+    def transact(self, unit, pdu: bytes) -> bytes:
+        """Send one request on the bus and return the response PDU, runs on the worker thread"""
+        function = pdu[0]
+        code = check_request(pdu)
+        if code is not None:
+            return exception_pdu(function, code)
+        length = response_length(pdu)
+        if not self.open_port():
+            return exception_pdu(function, GATEWAY_PATH_UNAVAILABLE)
+
+        frame = bytes((unit,)) + pdu
+        frame += struct.pack("<H", rtu.crc16(frame))
+        response = bytearray(length)
+        self.bus_requests += 1
+        try:
+            self.port.transact(frame, response)
+        except rtu.SlaveReportedException:
+            return exception_pdu(function, response[2])
+        except rtu.ModbusError as e:
+            throttled_log.warning(f"Slave {unit}: {e.__str__()}")
+            return exception_pdu(function, GATEWAY_TARGET_FAILED)
+        except Exception as e:
+            # The port itself failed, it is opened again on the next request
+            throttled_log.error(e.__str__())
+            self.close_port()
+            return exception_pdu(function, SERVER_DEVICE_FAILURE)
+        return bytes(response[1:-2])
+
+    async def request(self, unit, pdu: bytes) -> bytes:
+        self.requests_count += 1
+        function = pdu[0]
+        code = check_request(pdu)
+        if code is not None:
+            return exception_pdu(function, code)
+
+        loop = asyncio.get_running_loop()
+        if function in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+            address, count = struct.unpack_from(">HH", pdu, 1)
+            cached = self.cache.lookup(unit, function, address, count, time.monotonic())
+            if cached is not None:
+                self.cache_hits += 1
+                return bytes((function, 2 * count)) + cached
+
+            key = (unit, pdu)
+            future = self._pending.get(key)
+            if future is not None:
+                self.coalesced_count += 1
+                return await asyncio.shield(future)
+            future = loop.run_in_executor(self.executor, self.transact, unit, pdu)
+            self._pending[key] = future
+            try:
+                response = await future
+            finally:
+                self._pending.pop(key, None)
+            if response[0] == function:
+                self.cache.store(unit, function, address, response[2:], time.monotonic())
+            return response
+
+        response = await loop.run_in_executor(self.executor, self.transact, unit, pdu)
+        written = written_range(pdu)
+        if written is not None:
+            self.cache.invalidate(unit, *written)
+        return response
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients += 1
+        try:
+            while True:
+                transaction, protocol, length, unit = MBAP.unpack(await reader.readexactly(MBAP.size))
+                if protocol != 0 or not 2 <= length <= MAX_PDU + 1:
+                    log.warning(f"Closing a client sending an invalid header, protocol {protocol} length {length}")
+                    break
+                pdu = await reader.readexactly(length - 1)
+                try:
+                    response = await self.request(unit, pdu)
+                except Exception as e:
+                    # A request the daemon fails on must not take down the connection of the client
+                    throttled_log.error(f"Request {pdu.hex()} of slave {unit} failed: {e.__str__()}")
+                    response = exception_pdu(pdu[0], SERVER_DEVICE_FAILURE)
+                writer.write(MBAP.pack(transaction, 0, len(response) + 1, unit) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    async def serve(self):
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.servers.append(await asyncio.start_unix_server(self._handle, path=self.socket_path))
+            log.info(f"Listening on {self.socket_path}")
+        if self.tcp_port:
+            self.servers.append(await asyncio.start_server(self._handle, self.host, self.tcp_port))
+            log.info(f"Listening on {self.host}:{self.tcp_port}")
+        self.open_port()
+        try:
+            await asyncio.gather(*[server.serve_forever() for server in self.servers])
+        finally:
+            self.close()
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        self.servers = []
+        self.executor.shutdown(wait=True)
+        self.close_port()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        log.info(f"Stopped: {self.statistics()}")
+
+    def statistics(self) -> dict:
+        return dict(
+            clients=self.clients,
+            requests=self.requests_count,
+            cache_hits=self.cache_hits,
+            coalesced=self.coalesced_count,
+            bus_requests=self.bus_requests,
+        )
+
+
+class MuxPort:
+    """
+    Stands in for an RtuPort, the RTU frames of an RtuInstrument are sent to a muxd daemon as
+    Modbus TCP requests. `address` is the path of the Unix socket, or host:port for TCP.
+    """
+
+    def __init__(self, address=DEFAULT_SOCKET, timeout=1.0):
+        self.address = address
+        self.timeout = timeout
+        self.socket = None
+        self.transaction = 0
+        self.requests_count = 0
+        self.retries_count = 0
+        self.timeouts_count = 0
+        self.crc_errors_count = 0
+        self.connect()
+
+    @property
+    def serial(self):
+        return self
+
+    def connect(self):
+        if ":" in self.address:
+            host, port = self.address.rsplit(":", 1)
+            self.socket = socket.create_connection((host, int(port)), timeout=self.timeout)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(self.timeout)
+            self.socket.connect(self.address)
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def _receive(self, length) -> bytes:
+        data = bytearray()
+        while len(data) < length:
+            chunk = self.socket.recv(length - len(data))
+            if chunk == b"":
+                raise ConnectionError("The multiplexer closed the connection")
+            data += chunk
+        return bytes(data)
+
+    def transact(self, request: bytes, response: bytearray):
+        if self.socket is None:
+            self.connect()
+        self.requests_count += 1
+        self.transaction = (self.transaction + 1) & 0xFFFF
+        unit, pdu = request[0], request[1:-2]
+        try:
+            self.socket.sendall(MBAP.pack(self.transaction, 0, len(pdu) + 1, unit) + pdu)
+            transaction, _, length, _ = MBAP.unpack(self._receive(MBAP.size))
+            answer = self._receive(length - 1)
+        except socket.timeout:
+            # A late answer would be taken for the next one, start over on a new connection
+            self.close()
+            self.timeouts_count += 1
+            raise rtu.NoResponseError("No response from the multiplexer")
+        except OSError:
+            self.close()
+            raise
+        if transaction != self.transaction:
+            self.close()
+            raise rtu.InvalidResponseError(f"Unexpected transaction id {transaction}")
+
+        if answer[0] & 0x80:
+            if answer[1] in (GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_FAILED):
+                self.timeouts_count += 1
+                raise rtu.NoResponseError(f"No response from slave {unit}")
+            raise rtu.SlaveReportedException(f"Slave reported exception code {answer[1]}")
+        frame = bytes((unit,)) + answer
+        frame += struct.pack("<H", rtu.crc16(frame))
+        if len(frame) != len(response):
+            raise rtu.InvalidResponseError(f"Unexpected response length {len(frame)}")
+        response[:] = frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Share the serial port of the control board between local clients")
+    parser.add_argument("--port", default="/dev/serial0", help="Serial port of the bus")
+    parser.add_argument("--baudrate", type=int, default=57600)
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path, empty to disable")
+    parser.add_argument("--host", default="127.0.0.1", help="Address of the Modbus TCP listener")
+    parser.add_argument("--tcp-port", type=int, default=DEFAULT_TCP_PORT, help="Modbus TCP port, 0 to disable")
+    parser.add_argument("--max-age", type=float, default=0.05, help="Seconds a read is answered from the cache")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    multiplexer = Multiplexer(
+        serial_device=args.port,
+        baudrate=args.baudrate,
+        max_age=args.max_age,
+        socket_path=args.socket,
+        host=args.host,
+        tcp_port=args.tcp_port,
+    )
+    try:
+        asyncio.run(multiplexer.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
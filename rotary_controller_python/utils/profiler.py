@@ -0,0 +1,59 @@
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+
+def process_age() -> float:
+    """Seconds elapsed since the process was created, so the interpreter startup is accounted too"""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # The command name may contain spaces, the fields are counted after its closing bracket
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK"))
+    except Exception:
+        return 0.0
+
+
+class StartupProfiler:
+    """
+    Records when each startup phase completes, from the creation of the process up to the first
+    frame on screen and the first live position from the board.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter() - process_age()
+        self.marks = []
+
+    def mark(self, phase):
+        """Record the end of a phase, only the first mark of each phase counts"""
+        if any(name == phase for name, _ in self.marks):
+            return False
+        self.marks.append((phase, time.perf_counter()))
+        return True
+
+    def elapsed(self, phase) -> float or None:
+        for name, timestamp in self.marks:
+            if name == phase:
+                return timestamp - self.started
+        return None
+
+    def to_dict(self) -> dict:
+        phases = dict()
+        previous = self.started
+        for name, timestamp in self.marks:
+            phases[name] = dict(duration=timestamp - previous, elapsed=timestamp - self.started)
+            previous = timestamp
+        return phases
+
+    def report(self) -> str:
+        lines = ["Startup profile:"]
+        for name, times in self.to_dict().items():
+            lines.append(f"  {name:<24} +{times['duration'] * 1000:8.1f}ms  at {times['elapsed'] * 1000:8.1f}ms")
+        return "\n".join(lines)
+
+
+profiler = StartupProfiler()
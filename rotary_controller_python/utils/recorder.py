@@ -0,0 +1,200 @@
+"""
+Append-only binary recording of a session: every FastData sample and every register write, in
+fixed size records that can be memory mapped for analysis or played back by `utils.replay`.
+
+The file starts with a header followed by records of 40 bytes, each holding a monotonic timestamp,
+the record kind and a payload of 28 bytes. The payload of a sample is the fastData_t image in the
+firmware memory layout, the payload of a write holds up to 14 registers starting at `address`.
+"""
+import logging
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from rotary_controller_python.utils import rtu
+from rotary_controller_python.utils.addresses import FAST_DATA_SCHEMA, SCALES_COUNT
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"RCREC\x00\x00\x00"
+VERSION = 1
+# Magic, version, record size, wall clock and monotonic time of the start of the recording
+HEADER = struct.Struct("<8sHHdd")
+
+SAMPLE = 1
+WRITE = 2
+
+PAYLOAD_SIZE = FAST_DATA_SCHEMA.codec.size
+WRITE_REGISTERS = PAYLOAD_SIZE // 2
+RECORD_PREFIX = struct.Struct("<dBBH")
+SAMPLE_CODEC = struct.Struct(RECORD_PREFIX.format + FAST_DATA_SCHEMA.codec.format[1:])
+WRITE_CODEC = struct.Struct(f"{RECORD_PREFIX.format}{WRITE_REGISTERS}H")
+
+RECORD = np.dtype([
+    ("timestamp", "<f8"),
+    ("kind", "u1"),
+    ("count", "u1"),
+    ("address", "<u2"),
+    ("payload", f"V{PAYLOAD_SIZE}"),
+])
+SAMPLE_PAYLOAD = np.dtype([
+    ("servo_current", "<f4"),
+    ("servo_desired", "<f4"),
+    ("scale_current", "<i4", (SCALES_COUNT,)),
+    ("cycles", "<u4"),
+])
+WRITE_PAYLOAD = np.dtype([("registers", "<u2", (WRITE_REGISTERS,))])
+
+
+class SessionRecorder:
+    """
+    Records samples and writes into `path`. Records are packed into a memory buffer by the caller,
+    which costs about a microsecond each, and written to the file in batches every
+    `flush_interval` seconds by a background thread.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.records_count = 0
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.itemsize, time.time(), time.monotonic()))
+        self._thread = threading.Thread(target=self._run, name="session-recorder", daemon=True)
+        self._thread.start()
+        log.info(f"Recording the session to {path}")
+
+    def record_sample(self, sample):
+        record = SAMPLE_CODEC.pack(
+            sample.timestamp,
+            SAMPLE,
+            0,
+            0,
+            sample.servo_current,
+            sample.servo_desired,
+            *[round(position * 1000) for position in sample.scale_current],
+            sample.cycles,
+        )
+        with self._lock:
+            self._buffer += record
+            self.records_count += 1
+
+    def record_write(self, address, values):
+        timestamp = time.monotonic()
+        for start in range(0, len(values), WRITE_REGISTERS):
+            chunk = list(values[start:start + WRITE_REGISTERS])
+            record = WRITE_CODEC.pack(
+                timestamp, WRITE, len(chunk), address + start, *(chunk + [0] * (WRITE_REGISTERS - len(chunk)))
+            )
+            with self._lock:
+                self._buffer += record
+                self.records_count += 1
+
+    def flush(self):
+        with self._lock:
+            batch = self._buffer
+            self._buffer = bytearray()
+        if len(batch) == 0 or self._file.closed:
+            return
+        try:
+            self._file.write(batch)
+            self._file.flush()
+            self.bytes_written += len(batch)
+        except Exception as e:
+            log.error(e.__str__())
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join(self.flush_interval + 1.0)
+        self.flush()
+        self._file.close()
+        log.info(f"Recorded {self.records_count} records to {self.path}")
+
+
+class RecordingInstrument:
+    """
+    Wraps an instrument and records the registers of every successful write into a SessionRecorder,
+    any other attribute is forwarded to the wrapped instrument.
+    """
+
+    def __init__(self, instrument, recorder: SessionRecorder):
+        self.instrument = instrument
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.instrument, name)
+
+    def write_registers(self, registeraddress, values):
+        self.instrument.write_registers(registeraddress, values)
+        self.recorder.record_write(registeraddress, values)
+
+    def write_register(self, registeraddress, value, number_of_decimals=0, functioncode=16, signed=False):
+        self.instrument.write_register(registeraddress, value, number_of_decimals, functioncode, signed)
+        self.recorder.record_write(registeraddress, [int(round(value * 10 ** number_of_decimals)) & 0xFFFF])
+
+    def _record_32(self, registeraddress, fmt, value, byteorder):
+        raw = rtu.word_order(struct.pack(fmt, value), byteorder)
+        self.recorder.record_write(registeraddress, struct.unpack(">HH", raw))
+
+    def write_long(self, registeraddress, value, signed=False, byteorder=rtu.BYTEORDER_BIG):
+        self.instrument.write_long(registeraddress, value, signed=signed, byteorder=byteorder)
+        self._record_32(registeraddress, ">l" if signed else ">L", int(value), byteorder)
+
+    def write_float(self, registeraddress, value, number_of_registers=2, byteorder=rtu.BYTEORDER_BIG):
+        self.instrument.write_float(registeraddress, value, number_of_registers=number_of_registers, byteorder=byteorder)
+        self._record_32(registeraddress, ">f", value, byteorder)
+
+
+class Recording:
+    """A recording file memory mapped as an array of RECORD, a trailing partial record is ignored"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path} is not a session recording")
+        magic, version, record_size, self.started_at, self.started_monotonic = HEADER.unpack(header)
+        if magic != MAGIC or record_size != RECORD.itemsize:
+            raise ValueError(f"{path} is not a session recording")
+        if version != VERSION:
+            raise ValueError(f"Unsupported recording version {version}")
+
+        count = (os.path.getsize(path) - HEADER.size) // RECORD.itemsize
+        if count > 0:
+            self.records = np.memmap(path, dtype=RECORD, mode="r", offset=HEADER.size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD)
+
+    def __len__(self):
+        return len(self.records)
+
+    def samples(self) -> np.ndarray:
+        """Timestamps and decoded payloads of the samples, scale positions are left in um"""
+        records = self.records[self.records["kind"] == SAMPLE]
+        payloads = np.ascontiguousarray(records["payload"]).view(SAMPLE_PAYLOAD)
+        samples = np.empty(len(records), dtype=[("timestamp", "<f8")] + SAMPLE_PAYLOAD.descr)
+        samples["timestamp"] = records["timestamp"]
+        for name in SAMPLE_PAYLOAD.names:
+            samples[name] = payloads[name]
+        return samples
+
+    def writes(self) -> list:
+        """The register writes as (timestamp, address, registers) tuples"""
+        records = self.records[self.records["kind"] == WRITE]
+        payloads = np.ascontiguousarray(records["payload"]).view(WRITE_PAYLOAD)
+        return [
+            (float(record["timestamp"]), int(record["address"]), payload["registers"][:record["count"]].tolist())
+            for record, payload in zip(records, payloads)
+        ]
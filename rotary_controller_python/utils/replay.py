@@ -0,0 +1,120 @@
+"""
+Playback of a session recording through the regular comms path. The recorded samples and writes
+are applied to the register image of a simulated board, which answers the modbus requests of an
+RtuInstrument, so the UI, the comms engine and any analysis run unchanged against the recording.
+"""
+import logging
+import time
+
+from rotary_controller_python.utils import rtu
+from rotary_controller_python.utils.communication import DeviceManager
+from rotary_controller_python.utils.recorder import Recording, SAMPLE, WRITE, PAYLOAD_SIZE
+from rotary_controller_python.utils.simulator import Simulator
+
+log = logging.getLogger(__name__)
+
+
+class ReplayBoard(Simulator):
+    """
+    A simulated board whose fastData_t and execution cycles follow the recording instead of the
+    synthetic motion. Time runs `speed` times faster than the wall clock, from the first record.
+    """
+
+    def __init__(self, recording: Recording, address=17, speed=1.0, loop=False):
+        self.recording = recording
+        self.speed = speed
+        self.loop = loop
+        self.cursor = 0
+        self.replay_started = None
+        super().__init__(address=address)
+
+    @property
+    def finished(self) -> bool:
+        return self.cursor >= len(self.recording)
+
+    def rewind(self):
+        self.cursor = 0
+        self.replay_started = None
+
+    def replay_time(self, now) -> float:
+        """Timestamp of the recording reached at the given monotonic time"""
+        records = self.recording.records
+        if self.replay_started is None:
+            self.replay_started = now
+        return records["timestamp"][0] + (now - self.replay_started) * self.speed
+
+    def step(self, now=None):
+        records = self.recording.records
+        if len(records) == 0:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.finished and self.loop:
+                self.rewind()
+            target = self.replay_time(now)
+            fast = 2 * self.fast_addresses.base_address
+            while self.cursor < len(records) and records["timestamp"][self.cursor] <= target:
+                record = records[self.cursor]
+                payload = bytes(record["payload"])
+                if record["kind"] == SAMPLE:
+                    self.image.data[fast:fast + PAYLOAD_SIZE] = payload
+                    cycles = self.image.get_unsigned_long(self.fast_addresses.cycles)
+                    self.image.set_unsigned_long(self.addresses.execution_cycles, cycles)
+                elif record["kind"] == WRITE:
+                    count = int(record["count"])
+                    self.image.data[2 * int(record["address"]):2 * (int(record["address"]) + count)] = payload[:2 * count]
+                self.cursor += 1
+
+
+class ReplayPort:
+    """Stands in for an RtuPort, requests are answered by the replay board without any wire"""
+
+    def __init__(self, board: ReplayBoard):
+        self.board = board
+        self.requests_count = 0
+        self.retries_count = 0
+        self.timeouts_count = 0
+        self.crc_errors_count = 0
+
+    @property
+    def serial(self):
+        return self
+
+    def close(self):
+        pass
+
+    def transact(self, request: bytes, response: bytearray):
+        self.requests_count += 1
+        self.board.step()
+        answer = self.board.handle(request)
+        if answer is None:
+            self.timeouts_count += 1
+            raise rtu.NoResponseError("No response from the replay board")
+        if answer[1] & 0x80:
+            raise rtu.SlaveReportedException(f"Slave reported exception code {answer[2]}")
+        if len(answer) != len(response):
+            raise rtu.InvalidResponseError(f"Unexpected response length {len(answer)}")
+        response[:] = answer
+
+
+class ReplayDeviceManager(DeviceManager):
+    """
+    A DeviceManager playing back the recording at `path` instead of talking to the serial port,
+    writes coming from the UI land in the register image of the replay board.
+    """
+
+    def __init__(self, path, speed=1.0, loop=False, **kv):
+        self.recording = Recording(path)
+        self.board = None
+        self.speed = speed
+        self.loop = loop
+        kv.setdefault("transport", "replay")
+        super().__init__(serial_device=path, **kv)
+
+    def open(self) -> bool:
+        self.close()
+        if self.board is None:
+            self.board = ReplayBoard(self.recording, address=self.address, speed=self.speed, loop=self.loop)
+            log.info(f"Replaying {len(self.recording)} records from {self.serial_device} at {self.speed}x")
+        self.attach(rtu.RtuInstrument(port=ReplayPort(self.board), slaveaddress=self.address))
+        return True
@@ -0,0 +1,285 @@
+"""
+Native Modbus RTU transport tuned for the RS485 link to the control board.
+
+Compared to minimalmodbus the port is opened once, the exact length of every response is known
+in advance so a read returns as soon as the last byte arrives instead of waiting for a timeout,
+the inter-frame silence is derived from the baudrate and every request has its own deadline
+with bounded retries.
+"""
+import logging
+import select
+import struct
+import time
+
+import serial
+
+log = logging.getLogger(__name__)
+
+READ_HOLDING_REGISTERS = 3
+WRITE_MULTIPLE_REGISTERS = 16
+
+# Same values as the minimalmodbus byte order constants, so callers can keep passing those
+BYTEORDER_BIG = 0
+BYTEORDER_LITTLE = 1
+BYTEORDER_BIG_SWAP = 2
+BYTEORDER_LITTLE_SWAP = 3
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(data) -> int:
+    crc = 0xFFFF
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+class ModbusError(IOError):
+    pass
+
+
+class NoResponseError(ModbusError):
+    pass
+
+
+class InvalidResponseError(ModbusError):
+    pass
+
+
+class CrcError(InvalidResponseError):
+    pass
+
+
+class SlaveReportedException(ModbusError):
+    pass
+
+
+class RtuPort:
+    """
+    Owner of one serial port, all the instruments sharing the port go through `transact`.
+
+    `response_margin` is the time allowed to the slave to start answering on top of the wire
+    time of the frames, `latency_budget` bounds the total time spent on one request including
+    its retries.
+    """
+
+    def __init__(
+        self,
+        port,
+        baudrate=57600,
+        bytesize=8,
+        parity=serial.PARITY_NONE,
+        stopbits=1,
+        response_margin=0.02,
+        retries=2,
+        latency_budget=0.1,
+    ):
+        self.serial = serial.Serial(
+            port=port, baudrate=baudrate, bytesize=bytesize, parity=parity, stopbits=stopbits, timeout=0
+        )
+        self.response_margin = response_margin
+        self.retries = retries
+        self.latency_budget = latency_budget
+
+        bits = 1 + bytesize + (0 if parity == serial.PARITY_NONE else 1) + stopbits
+        self.char_time = bits / baudrate
+        # The RTU specification fixes the silence to 1.75ms above 19200 baud
+        self.silence = 3.5 * self.char_time if baudrate <= 19200 else 0.00175
+        self.last_activity = 0.0
+
+        self.requests_count = 0
+        self.retries_count = 0
+        self.timeouts_count = 0
+        self.crc_errors_count = 0
+
+    def close(self):
+        self.serial.close()
+
+    def wire_time(self, length):
+        return length * self.char_time
+
+    def _wait_silence(self):
+        remaining = self.last_activity + self.silence - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def _read_exact(self, buffer: memoryview, deadline) -> int:
+        """Fill the buffer with incoming bytes, returns the count received before the deadline"""
+        received = 0
+        fd = self.serial.fileno()
+        while received < len(buffer):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                break
+            data = self.serial.read(len(buffer) - received)
+            buffer[received:received + len(data)] = data
+            received += len(data)
+        self.last_activity = time.perf_counter()
+        return received
+
+    def _attempt(self, request: bytes, response: bytearray, deadline):
+        self._wait_silence()
+        self.serial.reset_input_buffer()
+        self.serial.write(request)
+        self.serial.flush()
+        self.last_activity = time.perf_counter()
+
+        view = memoryview(response)
+        # Address, function and the first byte of data tell exception frames apart
+        if self._read_exact(view[:3], deadline) < 3:
+            raise NoResponseError("No response from the slave")
+        if view[0] != request[0] or view[1] != request[1]:
+            if view[1] == request[1] | 0x80:
+                self._read_exact(view[3:5], deadline)
+                if crc16(view[:3]) == struct.unpack_from("<H", view, 3)[0]:
+                    raise SlaveReportedException(f"Slave reported exception code {view[2]}")
+            raise InvalidResponseError(f"Unexpected response header {bytes(view[:3]).hex()}")
+
+        if self._read_exact(view[3:], deadline) < len(view) - 3:
+            raise NoResponseError("Incomplete response from the slave")
+        if crc16(view[:-2]) != struct.unpack_from("<H", view, len(view) - 2)[0]:
+            raise CrcError("Checksum error in the response")
+
+    def transact(self, request: bytes, response: bytearray):
+        """
+        Send a complete request frame and read the response in the preallocated buffer, which
+        must be exactly as long as the expected response frame.
+        """
+        started = time.perf_counter()
+        budget = started + self.latency_budget
+        timeout = self.wire_time(len(request) + len(response)) + self.response_margin
+        self.requests_count += 1
+
+        attempt = 0
+        while True:
+            deadline = min(time.perf_counter() + timeout, max(budget, started + timeout))
+            try:
+                self._attempt(request, response, deadline)
+                return
+            except SlaveReportedException:
+                raise
+            except ModbusError as e:
+                if isinstance(e, CrcError):
+                    self.crc_errors_count += 1
+                elif isinstance(e, NoResponseError):
+                    self.timeouts_count += 1
+                attempt += 1
+                if attempt > self.retries or time.perf_counter() + timeout > budget:
+                    raise
+                self.retries_count += 1
+                # Let the rest of a garbled frame drain before trying again
+                self.last_activity = time.perf_counter()
+
+
+def word_order(raw: bytes, byteorder) -> bytes:
+    """Convert 4 big endian bytes ABCD into the register byte order used on the wire"""
+    if byteorder == BYTEORDER_BIG:
+        return raw
+    if byteorder == BYTEORDER_LITTLE:
+        return raw[::-1]
+    if byteorder == BYTEORDER_BIG_SWAP:
+        return bytes((raw[1], raw[0], raw[3], raw[2]))
+    return raw[2:4] + raw[0:2]
+
+
+class RtuInstrument:
+    """
+    A slave device on an RtuPort, exposes the subset of the minimalmodbus.Instrument interface used
+    by the application together with `read_registers_into` for allocation free block reads.
+    """
+
+    def __init__(self, port: RtuPort, slaveaddress):
+        self.port = port
+        self.address = slaveaddress
+        self._responses = dict()
+
+    @property
+    def serial(self):
+        return self.port.serial
+
+    def _response_buffer(self, length) -> bytearray:
+        buffer = self._responses.get(length)
+        if buffer is None:
+            buffer = bytearray(length)
+            self._responses[length] = buffer
+        return buffer
+
+    def _frame(self, pdu: bytes) -> bytes:
+        frame = bytes((self.address,)) + pdu
+        return frame + struct.pack("<H", crc16(frame))
+
+    def _read(self, registeraddress, number_of_registers, functioncode) -> bytearray:
+        if not 1 <= number_of_registers <= 125:
+            raise ValueError(f"Invalid number of registers: {number_of_registers}")
+        request = self._frame(struct.pack(">BHH", functioncode, registeraddress, number_of_registers))
+        response = self._response_buffer(5 + 2 * number_of_registers)
+        self.port.transact(request, response)
+        if response[2] != 2 * number_of_registers:
+            raise InvalidResponseError(f"Unexpected byte count {response[2]}")
+        return response
+
+    def read_registers(self, registeraddress, number_of_registers, functioncode=READ_HOLDING_REGISTERS):
+        response = self._read(registeraddress, number_of_registers, functioncode)
+        return list(struct.unpack_from(f">{number_of_registers}H", response, 3))
+
+    def read_registers_into(self, registeraddress, number_of_registers, buffer, functioncode=READ_HOLDING_REGISTERS):
+        """Read registers into `buffer` as little endian words, the memory layout of the firmware"""
+        response = memoryview(self._read(registeraddress, number_of_registers, functioncode))
+        data = response[3:3 + 2 * number_of_registers]
+        buffer[0:len(data):2] = data[1::2]
+        buffer[1:len(data):2] = data[0::2]
+
+    def write_registers(self, registeraddress, values):
+        count = len(values)
+        if not 1 <= count <= 123:
+            raise ValueError(f"Invalid number of registers: {count}")
+        pdu = struct.pack(f">BHHB{count}H", WRITE_MULTIPLE_REGISTERS, registeraddress, count, 2 * count, *values)
+        response = self._response_buffer(8)
+        self.port.transact(self._frame(pdu), response)
+        if struct.unpack_from(">HH", response, 2) != (registeraddress, count):
+            raise InvalidResponseError("Write response does not match the request")
+
+    def read_register(self, registeraddress, number_of_decimals=0, functioncode=READ_HOLDING_REGISTERS, signed=False):
+        value = self.read_registers(registeraddress, 1, functioncode)[0]
+        if signed and value >= 0x8000:
+            value -= 0x10000
+        return value / 10 ** number_of_decimals if number_of_decimals else value
+
+    def write_register(self, registeraddress, value, number_of_decimals=0, functioncode=16, signed=False):
+        value = int(round(value * 10 ** number_of_decimals))
+        self.write_registers(registeraddress, [value & 0xFFFF])
+
+    def _read_32(self, registeraddress, fmt, functioncode, byteorder):
+        response = self._read(registeraddress, 2, functioncode)
+        return struct.unpack(fmt, word_order(bytes(response[3:7]), byteorder))[0]
+
+    def _write_32(self, registeraddress, fmt, value, byteorder):
+        raw = word_order(struct.pack(fmt, value), byteorder)
+        self.write_registers(registeraddress, list(struct.unpack(">HH", raw)))
+
+    def read_long(self, registeraddress, functioncode=READ_HOLDING_REGISTERS, signed=False, byteorder=BYTEORDER_BIG):
+        return self._read_32(registeraddress, ">l" if signed else ">L", functioncode, byteorder)
+
+    def write_long(self, registeraddress, value, signed=False, byteorder=BYTEORDER_BIG):
+        self._write_32(registeraddress, ">l" if signed else ">L", int(value), byteorder)
+
+    def read_float(self, registeraddress, functioncode=READ_HOLDING_REGISTERS, number_of_registers=2, byteorder=BYTEORDER_BIG):
+        return self._read_32(registeraddress, ">f", functioncode, byteorder)
+
+    def write_float(self, registeraddress, value, number_of_registers=2, byteorder=BYTEORDER_BIG):
+        self._write_32(registeraddress, ">f", value, byteorder)
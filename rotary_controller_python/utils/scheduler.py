@@ -0,0 +1,197 @@
+import logging
+import time
+
+from rotary_controller_python.utils.metrics import ThrottledLogger
+
+log = logging.getLogger(__name__)
+throttled_log = ThrottledLogger(log)
+
+REALTIME = "realtime"
+NORMAL = "normal"
+SLOW = "slow"
+ON_DEMAND = "on_demand"
+
+# Polling frequency in Hz of each rate class, on demand groups only run when requested
+RATES = {
+    REALTIME: 30.0,
+    NORMAL: 10.0,
+    SLOW: 1.0,
+    ON_DEMAND: 0.0,
+}
+
+# Lower values are served first and dropped last when the bus is saturated, on demand requests
+# come from the operator and rank right after the realtime data
+PRIORITIES = {
+    REALTIME: 0,
+    ON_DEMAND: 1,
+    NORMAL: 2,
+    SLOW: 3,
+}
+
+
+class PollGroup:
+    """
+    A set of registers read together at the rate of its class. `read` performs the bus
+    transactions and returns the data, `callback` receives the data on the bus thread. `slave`
+    names the board the registers belong to when several boards share the bus.
+    """
+
+    def __init__(self, name, rate_class, read, callback=None, slave=None):
+        self.name = name
+        self.slave = slave
+        self.rate_class = rate_class
+        self.priority = PRIORITIES[rate_class]
+        self.period = 1.0 / RATES[rate_class] if RATES[rate_class] > 0 else None
+        self.read = read
+        self.callback = callback
+
+        self.next_due = 0.0
+        self.requested = False
+        # Moving average of the time one execution keeps the bus busy
+        self.cost = 0.0
+        self.runs = 0
+        self.deferred = 0
+        self.failures = 0
+
+    def is_due(self, now) -> bool:
+        if self.period is None:
+            return self.requested
+        return now >= self.next_due
+
+    def run(self, now):
+        started = time.perf_counter()
+        try:
+            data = self.read()
+        finally:
+            elapsed = time.perf_counter() - started
+            self.runs += 1
+            self.requested = False
+            if self.period is not None:
+                # Keep the phase, but never try to catch up with missed periods
+                self.next_due = max(self.next_due + self.period, now)
+
+        # Only answered requests count, a timeout would have the group deferred for good and its
+        # failures would never be seen again
+        self.cost = elapsed if self.cost == 0.0 else 0.8 * self.cost + 0.2 * elapsed
+
+        if self.callback is not None:
+            self.callback(data)
+        return elapsed
+
+
+class PollScheduler:
+    """
+    Decides which poll groups are executed at each tick of the bus thread.
+
+    Due groups are served by priority, as long as their expected cost fits in the share of the
+    tick the bus can sustain (`max_utilisation`). When the link saturates the groups that do not
+    fit are deferred to the next tick, so the lower priority classes are dropped first while the
+    realtime data keeps flowing.
+
+    With several slaves on the bus, groups of the same priority are served starting from the slave
+    that used the least bus time recently relative to its weight, so a board with many groups
+    cannot starve the others and the bandwidth left by the realtime data is split by weight.
+    """
+
+    # Share of the bus time of the previous ticks still counted at each tick
+    fairness_decay = 0.9
+
+    def __init__(self, tick=1.0 / RATES[REALTIME], max_utilisation=0.8):
+        self.tick = tick
+        self.max_utilisation = max_utilisation
+        self.groups = dict()
+        # Relative bandwidth of each slave, 1 when not set, and its recent decayed bus time
+        self.weights = dict()
+        self.served = dict()
+        # Fraction of the wall time spent on the bus, measured over the recent ticks
+        self.utilisation = 0.0
+        # Slaves whose groups are not run, while they do not answer
+        self.paused = set()
+        # Called with each group executed and the exception it raised, None when it succeeded
+        self.on_result = None
+
+    def add(self, group: PollGroup) -> PollGroup:
+        """
+        Register a group, it replaces the group of the same slave with the same name. Boards on the
+        same bus have their own names, each of them can register its own fast data group.
+        """
+        # Groups are registered from the UI thread, replace the dictionary instead of
+        # mutating the one the bus thread may be iterating
+        self.groups = {**self.groups, (group.slave, group.name): group}
+        return group
+
+    def remove(self, name, slave=None):
+        self.groups = {key: value for key, value in self.groups.items() if key != (slave, name)}
+
+    def set_weight(self, slave, weight):
+        self.weights = {**self.weights, slave: weight}
+
+    def request(self, name, slave=None):
+        """Schedule one execution of a group as soon as the bus has room for it"""
+        self.groups[(slave, name)].requested = True
+
+    def due(self, now) -> list:
+        served = self.served
+        weights = self.weights
+        return sorted(
+            [group for group in self.groups.values() if group.slave not in self.paused and group.is_due(now)],
+            # Within a slave the group waiting for the longest time goes first
+            key=lambda group: (
+                group.priority,
+                served.get(group.slave, 0.0) / weights.get(group.slave, 1.0),
+                group.next_due,
+            ),
+        )
+
+    def run(self, now=None, reserved=0.0) -> float:
+        """
+        Execute the groups due at `now`, `reserved` is the bus time already committed in this tick,
+        returns the bus time spent. Exceptions of realtime groups are propagated to the caller.
+        """
+        now = time.monotonic() if now is None else now
+        budget = self.tick * self.max_utilisation - reserved
+        spent = 0.0
+        for slave in self.served:
+            self.served[slave] *= self.fairness_decay
+        for group in self.due(now):
+            if group.rate_class != REALTIME and spent + group.cost > budget:
+                group.deferred += 1
+                continue
+            started = time.perf_counter()
+            try:
+                spent += group.run(now)
+            except Exception as e:
+                group.failures += 1
+                self._report(group, e)
+                if group.rate_class == REALTIME:
+                    raise
+                throttled_log.error(f"Poll group {group.name} failed: {e.__str__()}")
+            else:
+                self._report(group, None)
+            finally:
+                self.served[group.slave] = self.served.get(group.slave, 0.0) + time.perf_counter() - started
+
+        busy = spent + reserved
+        self.utilisation = 0.9 * self.utilisation + 0.1 * min(1.0, busy / self.tick)
+        return spent
+
+    def _report(self, group, error):
+        if self.on_result is None:
+            return
+        try:
+            self.on_result(group, error)
+        except Exception as e:
+            log.error(e.__str__())
+
+    def statistics(self) -> dict:
+        return {
+            name if slave is None else f"{slave}/{name}": dict(
+                slave=group.slave,
+                rate_class=group.rate_class,
+                runs=group.runs,
+                deferred=group.deferred,
+                failures=group.failures,
+                cost=group.cost,
+            )
+            for (slave, name), group in self.groups.items()
+        }
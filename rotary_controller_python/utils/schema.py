@@ -0,0 +1,189 @@
+"""
+Declarative description of the firmware shared structures.
+
+A `StructSchema` lists the members of a C struct in declaration order, offsets are computed with
+the natural alignment rules of the ARM EABI used by the firmware, so that the register map never
+needs to be computed by hand. Every schema also precompiles a `struct.Struct` codec covering the
+whole structure, a complete struct is decoded or encoded with a single call.
+"""
+import collections
+import struct
+
+REGISTER_SIZE = 2
+
+
+class Field:
+    """A scalar struct member, or an array of `count` scalars"""
+
+    def __init__(self, name, fmt, c_name=None, count=1, aliases=()):
+        self.name = name
+        self.fmt = fmt
+        self.c_name = c_name if c_name is not None else name
+        self.count = count
+        self.aliases = aliases
+        self.codec = struct.Struct("<" + fmt)
+        self.size = self.codec.size * count
+        self.alignment = self.codec.size
+        self.offset = None
+
+    @property
+    def register(self):
+        """Register offset of the member from the start of the structure"""
+        return self.offset // REGISTER_SIZE
+
+    def layout(self):
+        return self.fmt * self.count
+
+    def flat_count(self):
+        return self.count
+
+    def build(self, values, start):
+        if self.count == 1:
+            return values[start], start + 1
+        return tuple(values[start:start + self.count]), start + self.count
+
+    def flatten(self, value, output):
+        if self.count == 1:
+            output.append(value)
+        else:
+            output.extend(value)
+
+
+class Nested:
+    """A member that is itself a structure, or an array of `count` structures"""
+
+    def __init__(self, name, schema, c_name=None, count=1):
+        self.name = name
+        self.schema = schema
+        self.c_name = c_name if c_name is not None else name
+        self.count = count
+        self.aliases = ()
+        self.size = schema.size * count
+        self.alignment = schema.alignment
+        self.offset = None
+
+    @property
+    def register(self):
+        return self.offset // REGISTER_SIZE
+
+    def layout(self):
+        return self.schema.layout() * self.count
+
+    def flat_count(self):
+        return self.schema.flat_count() * self.count
+
+    def build(self, values, start):
+        if self.count == 1:
+            return self.schema.build(values, start)
+        items = []
+        for _ in range(self.count):
+            item, start = self.schema.build(values, start)
+            items.append(item)
+        return tuple(items), start
+
+    def flatten(self, value, output):
+        if self.count == 1:
+            self.schema.flatten(value, output)
+        else:
+            for item in value:
+                self.schema.flatten(item, output)
+
+
+class StructSchema:
+    """
+    Layout of a firmware structure. Members are accessible by name with `schema[name]`,
+    `decode` returns a namedtuple with one entry per member, nested structures and arrays
+    are returned as nested records and tuples.
+    """
+
+    def __init__(self, c_name, members):
+        self.c_name = c_name
+        self.members = members
+        self.by_name = dict()
+
+        offset = 0
+        alignment = 1
+        layout = ""
+        for member in members:
+            padding = -offset % member.alignment
+            layout += "x" * padding
+            offset += padding
+            member.offset = offset
+            offset += member.size
+            layout += member.layout()
+            alignment = max(alignment, member.alignment)
+            self.by_name[member.name] = member
+            for alias in member.aliases:
+                self.by_name[alias] = member
+
+        # C structures are padded to a multiple of their alignment, and the register
+        # map rounds them to whole registers
+        alignment = max(alignment, REGISTER_SIZE)
+        tail = -offset % alignment
+        self.size = offset + tail
+        self.alignment = alignment
+        self._layout = layout + "x" * tail
+        self.registers = self.size // REGISTER_SIZE
+
+        self.codec = struct.Struct("<" + self._layout)
+        self.record = collections.namedtuple(c_name, [member.name for member in members])
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def layout(self):
+        return self._layout
+
+    def flat_count(self):
+        return sum(member.flat_count() for member in self.members)
+
+    def build(self, values, start=0):
+        items = []
+        for member in self.members:
+            item, start = member.build(values, start)
+            items.append(item)
+        return self.record._make(items), start
+
+    def flatten(self, record, output):
+        for member, value in zip(self.members, record):
+            member.flatten(value, output)
+
+    def decode(self, buffer, offset=0):
+        """Decode a whole structure from a buffer holding the raw firmware memory"""
+        record, _ = self.build(self.codec.unpack_from(buffer, offset))
+        return record
+
+    def encode(self, record) -> bytes:
+        values = []
+        self.flatten(record, values)
+        return self.codec.pack(*values)
+
+    def decode_registers(self, registers):
+        """Decode a structure from the list of register values returned by a modbus read"""
+        return self.decode(struct.pack(f"<{len(registers)}H", *registers))
+
+    def encode_registers(self, record):
+        """Encode a structure into the register values for a write multiple registers request"""
+        return list(struct.unpack(f"<{self.registers}H", self.encode(record)))
+
+
+class AddressMap:
+    """
+    Absolute register addresses of a structure placed at `base_address`, one attribute for each
+    scalar member of the schema plus `base_address` and `end`.
+    """
+
+    schema: StructSchema = None
+
+    def __init__(self, base_address):
+        self.base_address = base_address
+        for name, member in self.schema.by_name.items():
+            if isinstance(member, Field):
+                setattr(self, name, base_address + member.register)
+        self.end = base_address + self.schema.registers
+
+    def offset_of(self, name):
+        return self.base_address + self.schema[name].register
@@ -0,0 +1,135 @@
+import logging
+import struct
+import threading
+import time
+
+from rotary_controller_python.utils.addresses import GlobalAddresses
+
+log = logging.getLogger(__name__)
+
+# Modbus limits a single read holding registers request to 125 registers
+MAX_BLOCK_REGISTERS = 125
+
+FLOAT = struct.Struct("<f")
+LONG = struct.Struct("<l")
+UNSIGNED = struct.Struct("<H")
+SIGNED = struct.Struct("<h")
+
+
+def struct_boundaries(addresses: GlobalAddresses):
+    """List the (start, end) register ranges of the structures composing rampsSharedData_t"""
+    index = addresses.index_structure_offset
+    servo = addresses.servo_structure_offset
+    boundaries = [
+        (addresses.base_address, index.end),
+        (servo.base_address, servo.end),
+    ]
+    for scale in addresses.scales:
+        boundaries.append((scale.base_address, scale.end))
+    return boundaries
+
+
+def pack_blocks(boundaries, max_registers=MAX_BLOCK_REGISTERS):
+    """Merge adjacent structures into as few block reads as the protocol allows"""
+    blocks = []
+    start, end = boundaries[0]
+    for item_start, item_end in boundaries[1:]:
+        if item_start == end and item_end - start <= max_registers:
+            end = item_end
+        else:
+            blocks.append((start, end))
+            start, end = item_start, item_end
+    blocks.append((start, end))
+    return blocks
+
+
+class ShadowMemory:
+    """
+    Local image of the whole rampsSharedData_t register layout.
+
+    The image is refreshed with block reads and the device property getters are served from it
+    as long as the relevant block is younger than `max_age` seconds. Concurrent requests for the
+    same stale block wait for the transaction already in flight instead of issuing their own.
+    """
+
+    def __init__(self, device, addresses: GlobalAddresses, max_age=0.25):
+        from rotary_controller_python.utils.communication import DeviceManager
+
+        self.dm: DeviceManager = device
+        self.max_age = max_age
+        self.blocks = pack_blocks(struct_boundaries(addresses))
+        self.base_address = self.blocks[0][0]
+        self.end = self.blocks[-1][1]
+        self.image = bytearray(2 * (self.end - self.base_address))
+        self.updated = [0.0] * len(self.blocks)
+        self._locks = [threading.Lock() for _ in self.blocks]
+
+        self.block_reads = 0
+        self.cache_hits = 0
+
+    def covers(self, address, count=1) -> bool:
+        return self.base_address <= address and address + count <= self.end
+
+    def block_of(self, address) -> int:
+        for i, (start, end) in enumerate(self.blocks):
+            if start <= address < end:
+                return i
+        raise IndexError(f"Address {address} is not part of the shadow image")
+
+    def invalidate(self, address, count=1):
+        """Mark the blocks overlapping the given registers as stale, used after a write"""
+        for i, (start, end) in enumerate(self.blocks):
+            if start < address + count and address < end:
+                self.updated[i] = 0.0
+
+    def invalidate_all(self):
+        """Mark the whole image as stale, used when the board may have lost its state"""
+        self.updated = [0.0] * len(self.blocks)
+
+    def refresh(self, block_index=None):
+        """Reload one block, or the whole image when no block is specified"""
+        indexes = range(len(self.blocks)) if block_index is None else [block_index]
+        for i in indexes:
+            self.dm.execute(self._fetch, i, requested_at=time.monotonic())
+
+    def _fetch(self, block_index, requested_at):
+        """Read one block from the bus, must run on the thread owning the bus"""
+        with self._locks[block_index]:
+            # Another caller completed a read of this block while we were waiting
+            if self.updated[block_index] >= requested_at:
+                self.cache_hits += 1
+                return
+
+            start, end = self.blocks[block_index]
+            values = self.dm.device.read_registers(
+                registeraddress=start,
+                number_of_registers=end - start,
+            )
+            offset = 2 * (start - self.base_address)
+            struct.pack_into(f"<{end - start}H", self.image, offset, *values)
+            self.updated[block_index] = time.monotonic()
+            self.block_reads += 1
+
+    def store(self, address, values):
+        """Copy registers read outside of the block refreshes into the image"""
+        if self.covers(address, len(values)):
+            struct.pack_into(f"<{len(values)}H", self.image, 2 * (address - self.base_address), *values)
+
+    def decode(self, schema, address):
+        """Decode a whole structure from the image, refreshing every stale block it spans"""
+        now = time.monotonic()
+        for i, (start, end) in enumerate(self.blocks):
+            if start < address + schema.registers and address < end:
+                if now - self.updated[i] > self.max_age:
+                    self.dm.execute(self._fetch, i, requested_at=now)
+        return schema.decode(self.image, 2 * (address - self.base_address))
+
+    def unpack(self, codec: struct.Struct, address):
+        """Decode a value from the image, refreshing its block first if it is too old"""
+        block_index = self.block_of(address)
+        now = time.monotonic()
+        if now - self.updated[block_index] > self.max_age:
+            self.dm.execute(self._fetch, block_index, requested_at=now)
+        else:
+            self.cache_hits += 1
+        return codec.unpack_from(self.image, 2 * (address - self.base_address))[0]
@@ -0,0 +1,365 @@
+"""
+Virtual control board serving the rampsSharedData_t and fastData_t register maps as a Modbus RTU
+slave behind a Linux pseudo-terminal.
+
+The slave side of the pty behaves like a serial port, so a DeviceManager can be pointed at it
+without any change::
+
+    python -m rotary_controller_python.utils.simulator --address 17
+
+The simulator moves the scales on synthetic trajectories, lets the servo follow its desired
+position within the configured min_speed, max_speed and acceleration, and can inject latency,
+CRC errors, dropped frames and timeouts to measure throughput and recovery of the comms path.
+"""
+import argparse
+import logging
+import math
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+from rotary_controller_python.utils.addresses import GlobalAddresses, FastDataAddresses, SCALES_COUNT
+from rotary_controller_python.utils.rtu import crc16
+
+log = logging.getLogger(__name__)
+
+READ_HOLDING_REGISTERS = 3
+READ_INPUT_REGISTERS = 4
+WRITE_SINGLE_REGISTER = 6
+WRITE_MULTIPLE_REGISTERS = 16
+
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+
+
+def with_crc(frame: bytes) -> bytes:
+    return frame + struct.pack("<H", crc16(frame))
+
+
+class Faults:
+    """Fault injection settings, rates are probabilities applied to each request"""
+
+    def __init__(self, latency=0.0, crc_error_rate=0.0, drop_rate=0.0, timeout_rate=0.0, timeout_delay=0.5):
+        # Extra delay before every response, in seconds
+        self.latency = latency
+        # Response sent with a corrupted checksum
+        self.crc_error_rate = crc_error_rate
+        # Response truncated half way, the master sees a short frame
+        self.drop_rate = drop_rate
+        # No response at all within `timeout_delay` seconds
+        self.timeout_rate = timeout_rate
+        self.timeout_delay = timeout_delay
+
+
+class RegisterImage:
+    """Register storage with typed accessors using the same word order as the firmware"""
+
+    def __init__(self, count):
+        self.count = count
+        self.data = bytearray(2 * count)
+
+    def get_registers(self, address, count):
+        return struct.unpack_from(f"<{count}H", self.data, 2 * address)
+
+    def set_registers(self, address, values):
+        struct.pack_into(f"<{len(values)}H", self.data, 2 * address, *values)
+
+    def get_float(self, address) -> float:
+        return struct.unpack_from("<f", self.data, 2 * address)[0]
+
+    def set_float(self, address, value):
+        struct.pack_into("<f", self.data, 2 * address, value)
+
+    def get_long(self, address) -> int:
+        return struct.unpack_from("<l", self.data, 2 * address)[0]
+
+    def set_long(self, address, value):
+        struct.pack_into("<l", self.data, 2 * address, int(value))
+
+    def get_unsigned_long(self, address) -> int:
+        return struct.unpack_from("<L", self.data, 2 * address)[0]
+
+    def set_unsigned_long(self, address, value):
+        struct.pack_into("<L", self.data, 2 * address, int(value) & 0xFFFFFFFF)
+
+
+class Simulator:
+    """
+    Modbus RTU slave emulating the control board firmware.
+
+    `port` holds the path of the pty slave device once the simulator is started. When `baudrate`
+    is given each response is delayed by the time the request and response frames would take on
+    a real serial line.
+    """
+
+    # Firmware main loop period in seconds, reported through execution_interval in microseconds
+    cycle_period = 1.0 / 10000
+
+    def __init__(self, address=17, baudrate=None, faults: Faults = None, seed=None):
+        self.address = address
+        self.baudrate = baudrate
+        self.faults = faults if faults is not None else Faults()
+        self.random = random.Random(seed)
+
+        self.addresses = GlobalAddresses(0)
+        self.fast_addresses = FastDataAddresses(self.addresses.scales[SCALES_COUNT - 1].end)
+        self.image = RegisterImage(self.fast_addresses.end)
+
+        # Synthetic scale motion, amplitude in um and period in seconds for each input
+        self.scale_amplitude = [50000, 20000, 5000, 0]
+        self.scale_period = [8.0, 5.0, 3.0, 1.0]
+
+        self.port = None
+        self.requests_count = 0
+        self.faults_count = 0
+        self._master_fd = None
+        self._slave_fd = None
+        self._thread = None
+        self._running = False
+        self._lock = threading.RLock()
+        self._started_at = time.monotonic()
+        self._last_step = self._started_at
+
+        self.reset()
+
+    def reset(self):
+        servo = self.addresses.servo_structure_offset
+        with self._lock:
+            self.image.set_long(self.addresses.execution_interval, int(self.cycle_period * 1e6))
+            self.image.set_long(self.addresses.index_structure_offset.divisions, 1)
+            self.image.set_float(servo.min_speed, 1)
+            self.image.set_float(servo.max_speed, 1000)
+            self.image.set_float(servo.acceleration, 1000)
+            self.image.set_long(servo.ratio_num, 400)
+            self.image.set_long(servo.ratio_den, 360)
+            for scale in self.addresses.scales:
+                self.image.set_long(scale.ratio_num, 1)
+                self.image.set_long(scale.ratio_den, 1)
+
+    def start(self):
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="simulator", daemon=True)
+        self._thread.start()
+        log.info(f"Simulator listening on {self.port} with slave address {self.address}")
+        return self.port
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(1.0)
+        for fd in (self._master_fd, self._slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self._master_fd = self._slave_fd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def step(self, now=None):
+        """Advance the simulated machine to the current time"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            dt = now - self._last_step
+            self._last_step = now
+            if dt <= 0:
+                return
+            elapsed = now - self._started_at
+            cycles = int(elapsed / self.cycle_period)
+            self.image.set_unsigned_long(self.addresses.execution_cycles, cycles)
+            self.image.set_unsigned_long(self.fast_addresses.cycles, cycles)
+
+            for i, scale in enumerate(self.addresses.scales):
+                position = self.image.get_long(scale.position)
+                if self.scale_amplitude[i] != 0:
+                    phase = 2 * math.pi * elapsed / self.scale_period[i]
+                    previous_phase = 2 * math.pi * (elapsed - dt) / self.scale_period[i]
+                    position += int(self.scale_amplitude[i] * (math.sin(phase) - math.sin(previous_phase)))
+                self.image.set_long(scale.position, position)
+                self.image.set_long(self.fast_addresses.scale_current + 2 * i, position)
+
+            self._step_servo(dt)
+
+    def _step_servo(self, dt):
+        servo = self.addresses.servo_structure_offset
+        index = self.addresses.index_structure_offset
+        image = self.image
+
+        divisions = image.get_long(index.divisions)
+        index_offset = 360.0 * image.get_long(index.index) / divisions if divisions != 0 else 0.0
+        image.set_float(servo.index_offset, index_offset)
+        desired = index_offset + image.get_float(servo.absolute_offset) + image.get_float(servo.sync_offset)
+        image.set_float(servo.desired_position, desired)
+
+        current = image.get_float(servo.current_position)
+        speed = image.get_float(servo.current_speed)
+        min_speed = abs(image.get_float(servo.min_speed))
+        max_speed = max(abs(image.get_float(servo.max_speed)), min_speed)
+        acceleration = abs(image.get_float(servo.acceleration))
+
+        error = desired - current
+        direction = 1 if error > 0 else -1
+        # Highest speed that still allows to stop at the desired position
+        braking_speed = math.sqrt(2 * acceleration * abs(error))
+        target_speed = direction * max(min(max_speed, braking_speed), min_speed)
+        if speed < target_speed:
+            speed = min(speed + acceleration * dt, target_speed)
+        else:
+            speed = max(speed - acceleration * dt, target_speed)
+
+        step = speed * dt
+        if abs(step) >= abs(error):
+            current = desired
+            speed = 0.0
+        else:
+            current += step
+
+        image.set_float(servo.current_position, current)
+        image.set_float(servo.current_speed, speed)
+        image.set_float(servo.estimated_speed, speed)
+        image.set_float(self.fast_addresses.servo_current, current)
+        image.set_float(self.fast_addresses.servo_desired, desired)
+
+    def _run(self):
+        buffer = bytearray()
+        while self._running:
+            readable, _, _ = select.select([self._master_fd], [], [], 0.01)
+            if not readable:
+                # Inter frame silence, anything left is an incomplete frame
+                buffer.clear()
+                self.step()
+                continue
+            try:
+                buffer += os.read(self._master_fd, 256)
+            except OSError:
+                continue
+
+            while True:
+                length = self.frame_length(buffer)
+                if length is None or len(buffer) < length:
+                    break
+                frame = bytes(buffer[:length])
+                del buffer[:length]
+                self.step()
+                response = self.handle(frame)
+                if response is not None:
+                    self._send(frame, response)
+
+    @staticmethod
+    def frame_length(buffer) -> int or None:
+        """Length of the request at the head of the buffer, None until enough bytes are received"""
+        if len(buffer) < 2:
+            return None
+        function = buffer[1]
+        if function in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS, WRITE_SINGLE_REGISTER):
+            return 8
+        if function == WRITE_MULTIPLE_REGISTERS:
+            if len(buffer) < 7:
+                return None
+            return 9 + buffer[6]
+        # Unknown function, consume the whole buffer and reply with an exception
+        return len(buffer)
+
+    def handle(self, frame: bytes) -> bytes or None:
+        if len(frame) < 4 or crc16(frame[:-2]) != struct.unpack("<H", frame[-2:])[0]:
+            log.debug("Discarding frame with bad checksum")
+            return None
+        if frame[0] != self.address:
+            return None
+
+        self.requests_count += 1
+        function = frame[1]
+        with self._lock:
+            if function in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+                start, count = struct.unpack(">HH", frame[2:6])
+                if count < 1 or count > 125 or start + count > self.image.count:
+                    return self.exception(function, ILLEGAL_DATA_ADDRESS)
+                values = self.image.get_registers(start, count)
+                return with_crc(struct.pack(f">BBB{count}H", self.address, function, 2 * count, *values))
+
+            if function == WRITE_SINGLE_REGISTER:
+                start, value = struct.unpack(">HH", frame[2:6])
+                if start >= self.image.count:
+                    return self.exception(function, ILLEGAL_DATA_ADDRESS)
+                self.image.set_registers(start, [value])
+                return with_crc(frame[:6])
+
+            if function == WRITE_MULTIPLE_REGISTERS:
+                start, count, byte_count = struct.unpack(">HHB", frame[2:7])
+                if count < 1 or count > 123 or byte_count != 2 * count:
+                    return self.exception(function, ILLEGAL_DATA_VALUE)
+                if start + count > self.image.count:
+                    return self.exception(function, ILLEGAL_DATA_ADDRESS)
+                self.image.set_registers(start, struct.unpack(f">{count}H", frame[7:7 + byte_count]))
+                return with_crc(frame[:6])
+
+        return self.exception(function, ILLEGAL_FUNCTION)
+
+    def exception(self, function, code) -> bytes:
+        return with_crc(struct.pack(">BBB", self.address, function | 0x80, code))
+
+    def _send(self, request: bytes, response: bytes):
+        faults = self.faults
+        delay = faults.latency
+        if self.baudrate:
+            # 10 bits per character on the wire with 8N1 framing
+            delay += (len(request) + len(response)) * 10 / self.baudrate
+
+        if self.random.random() < faults.timeout_rate:
+            self.faults_count += 1
+            time.sleep(faults.timeout_delay)
+            return
+        if self.random.random() < faults.crc_error_rate:
+            self.faults_count += 1
+            response = response[:-2] + bytes([response[-2] ^ 0xFF, response[-1]])
+        elif self.random.random() < faults.drop_rate:
+            self.faults_count += 1
+            response = response[:len(response) // 2]
+
+        if delay > 0:
+            time.sleep(delay)
+        os.write(self._master_fd, response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated rotary controller board on a pseudo-terminal")
+    parser.add_argument("--address", type=int, default=17, help="Modbus slave address")
+    parser.add_argument("--baudrate", type=int, default=None, help="Emulate the wire time of this baudrate")
+    parser.add_argument("--latency", type=float, default=0.0, help="Extra response latency in seconds")
+    parser.add_argument("--crc-errors", type=float, default=0.0, help="Rate of responses with a bad checksum")
+    parser.add_argument("--drops", type=float, default=0.0, help="Rate of truncated responses")
+    parser.add_argument("--timeouts", type=float, default=0.0, help="Rate of requests left without a response")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    faults = Faults(
+        latency=args.latency,
+        crc_error_rate=args.crc_errors,
+        drop_rate=args.drops,
+        timeout_rate=args.timeouts,
+    )
+    simulator = Simulator(address=args.address, baudrate=args.baudrate, faults=faults)
+    port = simulator.start()
+    print(port, flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Speed of every axis and of the servo, estimated from the sample history.
+
+The firmware `cycles` counter is the timebase: it is incremented by the board at the time the
+positions are sampled, so it does not carry the jitter of the host side timestamps. The duration of
+one cycle is calibrated against the host clock over a long window, where the jitter averages out.
+"""
+import numpy as np
+
+from rotary_controller_python.utils.history import SampleHistory, TIMESTAMP, CYCLES, SCALES, SERVO_CURRENT
+
+# The counter is an unsigned 32 bit value in the firmware
+CYCLES_MODULO = 2 ** 32
+
+
+def unwrap_cycles(cycles: np.ndarray) -> np.ndarray:
+    """Cycles elapsed since the first sample, across the wraps of the firmware counter"""
+    elapsed = np.zeros(len(cycles))
+    if len(cycles) > 1:
+        np.cumsum(np.mod(np.diff(cycles), CYCLES_MODULO), out=elapsed[1:])
+    return elapsed
+
+
+def slopes(x: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Least squares slope of each column of `values` against `x`"""
+    centered = x - x.mean()
+    denominator = centered @ centered
+    if denominator == 0:
+        return np.zeros(values.shape[1])
+    return centered @ (values - values.mean(axis=0)) / denominator
+
+
+class SpeedEstimator:
+    """
+    Estimates the speed of the scales in mm/s and of the servo in its units per second, as the
+    least squares slope of the positions over the last `window` seconds of samples.
+    """
+
+    def __init__(self, history: SampleHistory, window=0.5, calibration_window=10.0, calibration_interval=1.0):
+        self.history = history
+        self.window = window
+        self.calibration_window = calibration_window
+        self.calibration_interval = calibration_interval
+        # Seconds per firmware cycle, None until there are enough samples to calibrate it
+        self.cycle_period = None
+        self.calibrated_at = None
+
+        self.scales = np.zeros(SCALES.stop - SCALES.start)
+        self.servo = 0.0
+
+    def calibrate(self):
+        rows = self.history.window(self.calibration_window)
+        if len(rows) < 2:
+            return
+        period = slopes(unwrap_cycles(rows[:, CYCLES]), rows[:, [TIMESTAMP]])[0]
+        if period > 0:
+            self.cycle_period = period
+            self.calibrated_at = rows[-1, TIMESTAMP]
+
+    def update(self):
+        """Compute the speeds over the latest window, returns the scale speeds"""
+        rows = self.history.window(self.window)
+        if len(rows) < 2:
+            self.scales[:] = 0.0
+            self.servo = 0.0
+            return self.scales
+
+        now = rows[-1, TIMESTAMP]
+        if self.calibrated_at is None or now - self.calibrated_at >= self.calibration_interval:
+            self.calibrate()
+        if self.cycle_period is None:
+            return self.scales
+
+        seconds = unwrap_cycles(rows[:, CYCLES]) * self.cycle_period
+        speeds = slopes(seconds, rows[:, SCALES.start:SERVO_CURRENT + 1])
+        self.scales = speeds[:-1]
+        self.servo = speeds[-1]
+        return self.scales
@@ -0,0 +1,298 @@
+"""
+Telemetry stream for remote readouts and dashboards. The samples are taken from the history of the
+comms engine, never from the bus, so the serial link carries the same load with any number of
+clients.
+
+Clients connect over plain TCP and exchange newline terminated JSON messages, or over WebSocket on
+the same port with one JSON message per text frame. The server sends:
+
+    {"type": "hello", "columns": [...], "rate": 10}
+    {"type": "state", "state": "live"}
+    {"type": "samples", "rows": [[timestamp, cycles, scale_0, ..., servo_desired], ...]}
+
+and a client may send {"rate": 5} to receive a batch of samples that many times per second.
+"""
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import logging
+import struct
+import threading
+import time
+
+from rotary_controller_python.utils.history import COLUMNS
+
+log = logging.getLogger(__name__)
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# Batches per second sent to a client that did not ask for a rate
+DEFAULT_RATE = 10.0
+MAX_RATE = 30.0
+# Clients only send small control messages, longer frames close the connection
+MAX_FRAME_SIZE = 4096
+
+
+def websocket_accept(key: str) -> str:
+    return base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()).decode()
+
+
+def websocket_frame(payload: bytes, opcode=0x1) -> bytes:
+    """A single unmasked frame, as sent by a server"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+class TelemetryClient:
+    """
+    One connected client. Outgoing messages wait in a bounded queue, when the client does not keep
+    up the oldest messages are dropped so it always receives the most recent data.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, websocket=False, queue_size=64):
+        self.writer = writer
+        self.websocket = websocket
+        self.queue = collections.deque(maxlen=queue_size)
+        self.ready = asyncio.Event()
+        self.rate = DEFAULT_RATE
+        self.next_batch = 0.0
+        self.rows = []
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+
+    @property
+    def peer(self):
+        return self.writer.get_extra_info("peername")
+
+    def send(self, message: dict):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(json.dumps(message, separators=(",", ":")).encode())
+        self.ready.set()
+
+    def encode(self, data: bytes) -> bytes:
+        return websocket_frame(data) if self.websocket else data + b"\n"
+
+    async def write_loop(self):
+        while not self.closed:
+            await self.ready.wait()
+            self.ready.clear()
+            while len(self.queue) > 0:
+                self.writer.write(self.encode(self.queue.popleft()))
+                self.sent += 1
+                await self.writer.drain()
+
+
+class TelemetryServer:
+    """
+    Fans out the FastData samples and the connection state of a CommsEngine to many clients. The
+    server runs its own event loop in a background thread, new rows are collected from the engine
+    history every `tick` and each client receives them in batches at its own rate.
+    """
+
+    # Seconds waited for the first line of a client, to tell WebSocket and plain clients apart
+    greeting_timeout = 0.5
+
+    def __init__(self, engine, host="0.0.0.0", port=8765, queue_size=64, tick=1.0 / 30):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.tick = tick
+        self.clients = set()
+        self.loop = None
+        self.thread = None
+        self._server = None
+        self._running = False
+        self._started = threading.Event()
+        self._error = None
+        self._seen = 0
+        self._state = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._started.clear()
+        self._error = None
+        self.thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self.thread.start()
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+
+    def stop(self, timeout=2.0):
+        if not self._running:
+            return
+        self._running = False
+        self.thread.join(timeout)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        except Exception as e:
+            # Failures to bind are raised by start, later ones only end the server
+            if self._started.is_set():
+                log.error(f"Telemetry server stopped: {e.__str__()}")
+            self._error = e
+        finally:
+            self._running = False
+            self._started.set()
+            self.loop.close()
+
+    async def _serve(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self._seen = self.engine.history.appended
+        self._state = self.engine.state
+        log.info(f"Telemetry server listening on {self.host}:{self.port}")
+        self._started.set()
+        try:
+            while self._running:
+                self.publish(time.monotonic())
+                await asyncio.sleep(self.tick)
+        finally:
+            self._server.close()
+            for client in list(self.clients):
+                client.closed = True
+                client.writer.close()
+            await self._server.wait_closed()
+
+    def new_rows(self) -> list:
+        history = self.engine.history
+        appended = history.appended
+        count = appended - self._seen
+        self._seen = appended
+        if count <= 0:
+            return []
+        return history.latest(min(count, history.capacity)).tolist()
+
+    def publish(self, now):
+        rows = self.new_rows()
+        state = self.engine.state
+        state_changed = state != self._state
+        self._state = state
+        if len(self.clients) == 0:
+            return
+
+        for client in self.clients:
+            if state_changed:
+                client.send(dict(type="state", state=state))
+            client.rows.extend(rows)
+            if now >= client.next_batch:
+                client.next_batch = now + 1.0 / client.rate
+                if len(client.rows) > 0:
+                    client.send(dict(type="samples", rows=client.rows))
+                    client.rows = []
+            # A client with a very low rate keeps only as many rows as the history would
+            if len(client.rows) > self.engine.history.capacity:
+                del client.rows[:len(client.rows) - self.engine.history.capacity]
+
+    def configure(self, client: TelemetryClient, message: bytes):
+        try:
+            request = json.loads(message)
+            rate = float(request.get("rate", client.rate))
+        except Exception as e:
+            log.debug(f"Invalid telemetry request from {client.peer}: {e.__str__()}")
+            return
+        client.rate = min(MAX_RATE, max(0.1, rate))
+        client.next_batch = 0.0
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # WebSocket clients start with their request, plain clients may stay silent
+            first = await asyncio.wait_for(reader.readline(), self.greeting_timeout)
+        except asyncio.TimeoutError:
+            first = b""
+        websocket = first.startswith(b"GET ")
+        if websocket:
+            if not await self._handshake(reader, writer):
+                writer.close()
+                return
+
+        client = TelemetryClient(writer, websocket=websocket, queue_size=self.queue_size)
+        self.clients.add(client)
+        log.info(f"Telemetry client connected from {client.peer}")
+        client.send(dict(type="hello", columns=COLUMNS, rate=client.rate))
+        client.send(dict(type="state", state=self.engine.state))
+        if not websocket and first.strip() != b"":
+            self.configure(client, first)
+
+        write_task = asyncio.ensure_future(client.write_loop())
+        try:
+            if websocket:
+                await self._read_websocket(reader, client)
+            else:
+                while True:
+                    line = await reader.readline()
+                    if line == b"":
+                        break
+                    self.configure(client, line)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            client.closed = True
+            client.ready.set()
+            self.clients.discard(client)
+            write_task.cancel()
+            writer.close()
+            log.info(f"Telemetry client {client.peer} left, {client.sent} sent, {client.dropped} dropped")
+
+    @staticmethod
+    async def _handshake(reader, writer) -> bool:
+        key = None
+        while True:
+            line = await reader.readline()
+            if line in (b"", b"\r\n", b"\n"):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "sec-websocket-key":
+                key = value.strip()
+        if key is None:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+            return False
+        writer.write(
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + websocket_accept(key).encode() + b"\r\n\r\n"
+        )
+        await writer.drain()
+        return True
+
+    async def _read_websocket(self, reader, client: TelemetryClient):
+        while True:
+            first, second = await reader.readexactly(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack(">H", await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack(">Q", await reader.readexactly(8))[0]
+            if length > MAX_FRAME_SIZE:
+                log.warning(f"Closing telemetry client {client.peer}, frame of {length} bytes")
+                client.writer.write(websocket_frame(struct.pack(">H", 1009), opcode=0x8))
+                return
+            mask = await reader.readexactly(4) if second & 0x80 else b"\x00" * 4
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+            if opcode == 0x8:
+                return
+            if opcode == 0x9:
+                client.writer.write(websocket_frame(payload, opcode=0xA))
+            elif opcode == 0x1:
+                self.configure(client, payload)
+
+    def statistics(self) -> dict:
+        return {
+            str(client.peer): dict(rate=client.rate, sent=client.sent, dropped=client.dropped)
+            for client in list(self.clients)
+        }
@@ -0,0 +1,100 @@
+import logging
+import struct
+
+from rotary_controller_python.utils.metrics import ThrottledLogger
+
+log = logging.getLogger(__name__)
+throttled_log = ThrottledLogger(log)
+
+# Modbus limits a single write multiple registers request to 123 registers
+MAX_WRITE_REGISTERS = 123
+MAX_READ_REGISTERS = 125
+
+
+def merge_runs(dirty: dict, max_registers=MAX_WRITE_REGISTERS):
+    """Group the dirty registers into runs of consecutive addresses, returns a list of (start, values)"""
+    runs = []
+    for address in sorted(dirty):
+        if runs:
+            start, values = runs[-1]
+            if address == start + len(values) and len(values) < max_registers:
+                values.append(dirty[address])
+                continue
+        runs.append((address, [dirty[address]]))
+    return runs
+
+
+class WriteTransaction:
+    """
+    Collects register writes and commits them with as few write multiple registers (function 16)
+    requests as possible, neighbouring registers are merged into a single request so that values
+    belonging together, like a ratio numerator and denominator, reach the firmware at once.
+
+    The commit runs as a single job on the thread owning the bus, so no poll can observe a half
+    written configuration, and the written range is verified with a block read-back.
+    """
+
+    def __init__(self, device):
+        from rotary_controller_python.utils.communication import DeviceManager
+
+        self.dm: DeviceManager = device
+        self.dirty = dict()
+        self.depth = 0
+        # Outcome of the commit, None until it has run
+        self.ok = None
+
+    def stage(self, address, codec: struct.Struct, value):
+        """Record a value to be written, later writes to the same registers replace earlier ones"""
+        self.stage_bytes(address, codec.pack(value))
+
+    def stage_bytes(self, address, raw: bytes):
+        """Record raw firmware memory to be written starting at the given register"""
+        if len(raw) % 2 != 0:
+            # Registers are 16 bit wide, single byte members share theirs with the padding
+            raw += b"\x00"
+        registers = struct.unpack(f"<{len(raw) // 2}H", raw)
+        for i, register in enumerate(registers):
+            self.dirty[address + i] = register
+
+    def commit(self) -> bool:
+        """Write all the staged registers and verify them, must run on the thread owning the bus"""
+        if len(self.dirty) == 0:
+            self.ok = True
+            return True
+
+        runs = merge_runs(self.dirty)
+        try:
+            for start, values in runs:
+                self.dm.device.write_registers(start, values)
+            ok = self.verify()
+        except Exception as e:
+            # Settings changed while the link is down are written again by the resync
+            if self.dm.connected:
+                throttled_log.error(f"Transaction failed: {e.__str__()}")
+            ok = False
+        finally:
+            if self.dm.shadow is not None:
+                for start, values in runs:
+                    self.dm.shadow.invalidate(start, len(values))
+
+        log.info(f"Committed {len(self.dirty)} registers with {len(runs)} writes")
+        self.ok = ok
+        return ok
+
+    def verify(self) -> bool:
+        """Read back the whole written range and compare it with the staged values"""
+        first = min(self.dirty)
+        last = max(self.dirty) + 1
+        mismatches = []
+        for start in range(first, last, MAX_READ_REGISTERS):
+            count = min(MAX_READ_REGISTERS, last - start)
+            values = self.dm.device.read_registers(registeraddress=start, number_of_registers=count)
+            for i, value in enumerate(values):
+                expected = self.dirty.get(start + i)
+                if expected is not None and expected != value:
+                    mismatches.append(start + i)
+
+        if len(mismatches) > 0:
+            log.error(f"Transaction verification failed for registers: {mismatches}")
+            return False
+        return True